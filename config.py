@@ -7,6 +7,7 @@ sets up logging, and validates that all required settings are present.
 """
 import logging
 import os
+import socket
 
 from dotenv import load_dotenv
 
@@ -39,6 +40,16 @@ CLOUDINARY_URL: str = os.getenv("CLOUDINARY_URL", "")
 # Heroku RedisCloud provides REDISCLOUD_URL; fallback to REDIS_URL if set.
 REDISCLOUD_URL: str = os.getenv("REDISCLOUD_URL", "")
 REDIS_URL: str = os.getenv("REDIS_URL") or REDISCLOUD_URL
+# "redis" — справжній сервер за REDIS_URL; "local" — in-process stand-in (utils/local_redis)
+# для бенчмарків та перевірок без Redis-сервера.
+REDIS_BACKEND: str = os.getenv("REDIS_BACKEND", "redis").lower()
+# Connection pool: requests wait up to REDIS_POOL_TIMEOUT_SECONDS for a free connection
+REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+REDIS_POOL_TIMEOUT_SECONDS: float = float(os.getenv("REDIS_POOL_TIMEOUT_SECONDS", "5"))
+REDIS_SOCKET_TIMEOUT_SECONDS: float = float(os.getenv("REDIS_SOCKET_TIMEOUT_SECONDS", "5"))
+REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS", "3"))
+REDIS_HEALTH_CHECK_INTERVAL_SECONDS: int = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL_SECONDS", "30"))
+REDIS_RETRY_ATTEMPTS: int = int(os.getenv("REDIS_RETRY_ATTEMPTS", "3"))
 
 # ------------------------------------------------------------------------------
 # Database URLs (sync and async)
@@ -46,6 +57,17 @@ REDIS_URL: str = os.getenv("REDIS_URL") or REDISCLOUD_URL
 SYNC_DATABASE_URL: str = os.getenv("DATABASE_URL", "")
 ASYNC_DATABASE_URL: str = os.getenv("AS_BASE", "")  # Use AS_BASE for async URL
 
+# Shared engine pool (database/engine.py). Keep pool_size + max_overflow per dyno
+# below the Postgres plan's connection limit.
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE_SECONDS: int = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_TIMEOUT_SECONDS: float = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+# Скільки інстанс чекає, поки інший застосовує міграції (database/migrations.py)
+MIGRATIONS_LOCK_WAIT_SECONDS: float = float(os.getenv("MIGRATIONS_LOCK_WAIT_SECONDS", "900"))
+
 # ------------------------------------------------------------------------------
 # Other core settings
 # ------------------------------------------------------------------------------
@@ -59,6 +81,43 @@ WELCOME_IMAGE_URL: str = (
 MAX_TELEGRAM_MESSAGE_LENGTH: int = 4090
 MAX_CHAT_HISTORY_LENGTH: int = 10
 
+# ------------------------------------------------------------------------------
+# In-process L1 cache (profiles and settings), invalidated via Redis pub/sub
+# ------------------------------------------------------------------------------
+L1_CACHE_MAX_SIZE: int = int(os.getenv("L1_CACHE_MAX_SIZE", "5000"))
+L1_CACHE_TTL_SECONDS: float = float(os.getenv("L1_CACHE_TTL_SECONDS", "60"))
+# Shared Redis copy of user settings (cache-aside, includes "no settings row" entries)
+SETTINGS_CACHE_TTL_SECONDS: int = int(os.getenv("SETTINGS_CACHE_TTL_SECONDS", str(6 * 3600)))
+
+# ------------------------------------------------------------------------------
+# Chat history retention (table chat_messages)
+# ------------------------------------------------------------------------------
+CHAT_HISTORY_RETENTION_MESSAGES: int = int(os.getenv("CHAT_HISTORY_RETENTION_MESSAGES", "200"))
+CHAT_HISTORY_RETENTION_DAYS: int = int(os.getenv("CHAT_HISTORY_RETENTION_DAYS", "90"))
+CHAT_HISTORY_PRUNE_INTERVAL_SECONDS: float = float(os.getenv("CHAT_HISTORY_PRUNE_INTERVAL_SECONDS", str(6 * 3600)))
+
+# ------------------------------------------------------------------------------
+# In-memory session fallback (used only while Redis is unavailable)
+# ------------------------------------------------------------------------------
+SESSION_FALLBACK_MAX_ENTRIES: int = int(os.getenv("SESSION_FALLBACK_MAX_ENTRIES", "2000"))
+SESSION_FALLBACK_SWEEP_INTERVAL_SECONDS: float = float(os.getenv("SESSION_FALLBACK_SWEEP_INTERVAL_SECONDS", "300"))
+
+# ------------------------------------------------------------------------------
+# FSM storage ("redis" — спільне для всіх воркерів, "memory" — лише в процесі)
+# ------------------------------------------------------------------------------
+FSM_STORAGE: str = os.getenv("FSM_STORAGE", "redis").lower()
+# Покинуті діалоги (реєстрація, Vision, створення паті) видаляються через цей час
+FSM_STATE_TTL_SECONDS: int = int(os.getenv("FSM_STATE_TTL_SECONDS", str(24 * 3600)))
+
+# ------------------------------------------------------------------------------
+# Write-behind persistence (chat history → DB in batches)
+# ------------------------------------------------------------------------------
+WRITE_BEHIND_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_SECONDS", "5"))
+WRITE_BEHIND_MAX_BATCH_SIZE: int = int(os.getenv("WRITE_BEHIND_MAX_BATCH_SIZE", "200"))
+# Власний журнал кожного воркера; ідентифікатор має бути сталим між рестартами (на Heroku — DYNO),
+# щоб після падіння воркер дочитав саме свій журнал
+WRITE_BEHIND_WORKER_ID: str = os.getenv("WRITE_BEHIND_WORKER_ID") or os.getenv("DYNO") or socket.gethostname()
+
 # ------------------------------------------------------------------------------
 # Conversation & Vision settings
 # ------------------------------------------------------------------------------
@@ -83,6 +142,12 @@ VISION_CONTENT_EMOJIS: dict[str, str] = {
     "patch_notes": "📋", "tournament": "🏆", "general": "🔍"
 }
 
+# ------------------------------------------------------------------------------
+# Prompt library settings
+# ------------------------------------------------------------------------------
+# Інтервал перевірки змін у prompts/ для гарячого перезавантаження (0 — вимкнено).
+PROMPT_RELOAD_INTERVAL_SECONDS: float = float(os.getenv("PROMPT_RELOAD_INTERVAL_SECONDS", "30"))
+
 # ------------------------------------------------------------------------------
 # Party manager configuration
 # ------------------------------------------------------------------------------
@@ -99,6 +164,31 @@ PARTY_LOBBY_ROLES: list[str] = [
     "Стрілець (золото)", "Боєць (досвід)"
 ]
 PARTY_LOBBY_COOLDOWN_SECONDS: int = 60  # 1 minute per lobby creation
+# Сховище лобі: "redis" — спільне для всіх воркерів, "memory" — лише в процесі
+PARTY_LOBBY_STORE: str = os.getenv("PARTY_LOBBY_STORE", "redis").lower()
+# Лобі без жодної активності видаляються з Redis через цей час
+PARTY_LOBBY_TTL_SECONDS: int = int(os.getenv("PARTY_LOBBY_TTL_SECONDS", str(24 * 3600)))
+# Вікно debounce для редагувань повідомлення лобі: за вікно — одне редагування
+PARTY_LOBBY_EDIT_DEBOUNCE_SECONDS: float = float(os.getenv("PARTY_LOBBY_EDIT_DEBOUNCE_SECONDS", "1.0"))
+# Лобі без активності довше за цей час закриваються sweeper'ом (APScheduler)
+PARTY_LOBBY_IDLE_TIMEOUT_SECONDS: int = int(os.getenv("PARTY_LOBBY_IDLE_TIMEOUT_SECONDS", str(2 * 3600)))
+PARTY_LOBBY_SWEEP_INTERVAL_SECONDS: int = int(os.getenv("PARTY_LOBBY_SWEEP_INTERVAL_SECONDS", "300"))
+# Матчмейкінг (/party): скільки лобі пропонувати і на скільки рангових груп можна відхилятися
+PARTY_MATCH_SUGGESTIONS: int = int(os.getenv("PARTY_MATCH_SUGGESTIONS", "5"))
+PARTY_MATCH_RANK_SPREAD: int = int(os.getenv("PARTY_MATCH_RANK_SPREAD", "1"))
+# Як часто зміни індексу матчмейкінгу дзеркаляться в Redis
+PARTY_MATCH_MIRROR_FLUSH_SECONDS: float = float(os.getenv("PARTY_MATCH_MIRROR_FLUSH_SECONDS", "1.0"))
+
+# ------------------------------------------------------------------------------
+# Telegram fan-out (розсилка особистих повідомлень, utils/message_fanout)
+# ------------------------------------------------------------------------------
+# Загальний бюджет повідомлень на секунду для всіх розсилок процесу (ліміт Telegram ~30/с)
+FANOUT_GLOBAL_RATE_PER_SECOND: float = float(os.getenv("FANOUT_GLOBAL_RATE_PER_SECOND", "25"))
+# Мінімальний інтервал між повідомленнями в один чат
+FANOUT_PER_CHAT_INTERVAL_SECONDS: float = float(os.getenv("FANOUT_PER_CHAT_INTERVAL_SECONDS", "1.0"))
+# Скільки запитів до Telegram виконуються одночасно
+FANOUT_CONCURRENCY: int = int(os.getenv("FANOUT_CONCURRENCY", "8"))
+FANOUT_MAX_RETRIES: int = int(os.getenv("FANOUT_MAX_RETRIES", "3"))
 
 # ------------------------------------------------------------------------------
 # Reply keyboard navigation settings
@@ -171,7 +261,7 @@ _critical_vars = {
     "CLOUDINARY_URL": bool(CLOUDINARY_URL),
     "DATABASE_URL (sync)": bool(SYNC_DATABASE_URL),
     "AS_BASE (async)": bool(ASYNC_DATABASE_URL),
-    "REDIS_URL": bool(REDIS_URL),
+    "REDIS_URL": bool(REDIS_URL) or REDIS_BACKEND == "local",
 }
 _missing = [name for name, ok in _critical_vars.items() if not ok]
 if _missing:
@@ -191,4 +281,7 @@ logger.info("✅ GOOGLE_CLOUD_PROJECT_ID loaded.")
 logger.info("✅ CLOUDINARY_URL loaded.")
 logger.info("✅ SYNC_DATABASE_URL loaded.")
 logger.info("✅ ASYNC_DATABASE_URL loaded.")
-logger.info("✅ REDIS_URL loaded.")
+if REDIS_BACKEND == "local":
+    logger.warning("⚠️ REDIS_BACKEND=local: using the in-process Redis stand-in (not for production).")
+else:
+    logger.info("✅ REDIS_URL loaded.")
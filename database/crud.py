@@ -1,85 +1,293 @@
 """
 Функції для взаємодії з базою даних (Create, Read, Update, Delete).
 """
-from typing import Any, Literal
+from typing import Any, Iterable, Literal, Mapping
 
-from sqlalchemy import insert, update, select, delete
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy import BigInteger, update, select, delete, any_, bindparam, func, literal, literal_column, or_, text, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 
-from database.models import User, UserSettings
-from config import ASYNC_DATABASE_URL, logger
+from database.models import ChatMessage, User, UserSettings
+from config import SETTINGS_CACHE_TTL_SECONDS, logger
+from database.engine import engine
+from utils.local_cache import LocalCache, cache_invalidator
+from utils.redis_client import get_redis, redis_pipeline
 
-engine = create_async_engine(ASYNC_DATABASE_URL)
+# L1-кеш налаштувань: {telegram_id: бітова маска м'ютів} (0 — налаштування за замовчуванням)
+SETTINGS_INVALIDATION_NAMESPACE = "settings"
+_settings_l1_cache = LocalCache("user_settings")
+cache_invalidator.register(SETTINGS_INVALIDATION_NAMESPACE, _settings_l1_cache)
+# L2 (Redis, спільний для всіх процесів): рядок з маскою; v1 — розкладка бітів MUTE_*
+SETTINGS_KEY_TEMPLATE = "settings:v1:{user_id}"
 
 
 # --- User CRUD ---
 
+# Колонки, без яких рядок users не можна вставити (NOT NULL без значення за замовчуванням)
+_USER_INSERT_REQUIRED = frozenset(
+    column.name for column in User.__table__.columns
+    if not column.nullable and not column.primary_key
+    and column.default is None and column.server_default is None
+)
+# Назви унікального обмеження на player_id (з моделі та з санітизації в main.py)
+_PLAYER_ID_CONSTRAINTS = frozenset({"uq_users_player_id", "users_player_id_key"})
+
+
+def _is_player_id_conflict(error: IntegrityError) -> bool:
+    """
+    Визначає порушення унікальності player_id за SQLSTATE та назвою обмеження
+    з помилки драйвера (asyncpg), а не за текстом повідомлення.
+    """
+    orig = error.orig
+    cause = getattr(orig, "__cause__", None)
+    sqlstate = getattr(orig, "sqlstate", None) or getattr(cause, "sqlstate", None)
+    constraint = getattr(cause, "constraint_name", None) or getattr(orig, "constraint_name", None)
+    return sqlstate == "23505" and constraint in _PLAYER_ID_CONSTRAINTS
+
+
+def _user_columns(user_data: dict[str, Any]) -> dict[str, Any]:
+    # 🧠 Уникаємо передачі рядків у поля datetime: БД сама проставить значення
+    return {k: v for k, v in user_data.items() if k not in ("created_at", "updated_at")}
+
+
+def _user_upsert_stmt(columns: list[str]):
+    """INSERT … ON CONFLICT (telegram_id) DO UPDATE для набору колонок (значення — bindparam)."""
+    stmt = pg_insert(User)
+    update_set = {name: stmt.excluded[name] for name in columns if name != "telegram_id"}
+    update_set["updated_at"] = func.now()
+    return stmt.on_conflict_do_update(index_elements=["telegram_id"], set_=update_set)
+
+
 async def add_or_update_user(user_data: dict[str, Any]) -> Literal['success', 'conflict', 'error']:
-    # ... (код цієї функції залишається без змін) ...
     """
-    Додає або оновлює користувача, перевіряючи унікальність player_id.
+    Додає або оновлює користувача одним запитом, перевіряючи унікальність player_id.
+
+    - Повний профіль (є nickname/player_id/server_id): INSERT … ON CONFLICT (telegram_id)
+      DO UPDATE … RETURNING.
+    - Часткове оновлення (статистика, герої): UPDATE … WHERE telegram_id … RETURNING.
 
     Returns:
         - 'success': Користувача успішно створено або оновлено.
         - 'conflict': Такий player_id вже зареєстрований іншим telegram_id.
-        - 'error': Сталася інша помилка.
+        - 'error': Сталася інша помилка (зокрема часткове оновлення незареєстрованого користувача).
     """
-    # 🧠 Уникаємо передачі рядків у поля datetime!
-    for dt_field in ("created_at", "updated_at"):
-        if dt_field in user_data:
-            # Видаляємо, щоб БД сама проставила значення
-            user_data.pop(dt_field)
+    values = _user_columns(user_data)
+    telegram_id = values.get('telegram_id')
+    player_id = values.get('player_id')
+
+    if _USER_INSERT_REQUIRED <= values.keys():
+        stmt = (
+            _user_upsert_stmt(list(values))
+            .values(**values)
+            .returning(User.id, literal_column("xmax = 0").label("inserted"))
+        )
+    else:
+        stmt = (
+            update(User)
+            .where(User.telegram_id == telegram_id)
+            .values(**{k: v for k, v in values.items() if k != 'telegram_id'})
+            .returning(User.id, literal(False).label("inserted"))
+        )
 
     async with engine.connect() as conn:
-        async with conn.begin():
-            telegram_id = user_data.get('telegram_id')
-            player_id = user_data.get('player_id')
+        try:
+            async with conn.begin():
+                row = (await conn.execute(stmt)).first()
+        except IntegrityError as e:
+            if _is_player_id_conflict(e):
+                logger.warning(f"Конфлікт: Player ID {player_id} вже зареєстровано іншим користувачем. Спроба від Telegram ID {telegram_id}.")
+                return 'conflict'
+            logger.error(f"Неочікувана помилка цілісності: {e}", exc_info=True)
+            return 'error'
+        except Exception as e:
+            logger.error(f"Загальна помилка в add_or_update_user: {e}", exc_info=True)
+            return 'error'
+
+    if row is None:
+        logger.error(f"Часткове оновлення для незареєстрованого користувача з Telegram ID: {telegram_id}")
+        return 'error'
+    if row.inserted:
+        logger.info(f"Створено нового користувача з Telegram ID: {telegram_id}")
+    else:
+        logger.info(f"Оновлення даних для користувача з Telegram ID: {telegram_id}")
+    return 'success'
+
+
+async def bulk_add_or_update_users(
+    records: list[dict[str, Any]],
+) -> dict[int, Literal['success', 'conflict', 'error']]:
+    """
+    Пакетний варіант add_or_update_user для write-behind/batch-шляхів.
+
+    Записи з однаковим набором колонок виконуються одним upsert (executemany)
+    в окремому SAVEPOINT. Якщо пакет впирається в конфлікт player_id, лише цей
+    пакет повторюється по одному запису, щоб визначити, хто саме конфліктує.
+    Кілька записів для одного telegram_id об'єднуються (перемагає останній).
+    Часткові оновлення (без nickname/player_id/server_id) для неіснуючих
+    користувачів просто нічого не змінюють.
+
+    Returns:
+        Словник {telegram_id: статус}.
+    """
+    merged: dict[int, dict[str, Any]] = {}
+    for record in records:
+        values = _user_columns(record)
+        merged.setdefault(values['telegram_id'], {}).update(values)
+
+    groups: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+    for values in merged.values():
+        groups.setdefault(tuple(sorted(values)), []).append(values)
+
+    results: dict[int, Literal['success', 'conflict', 'error']] = {}
+    async with engine.connect() as conn:
+        try:
+            async with conn.begin():
+                for columns, rows in groups.items():
+                    if _USER_INSERT_REQUIRED <= set(columns):
+                        stmt = _user_upsert_stmt(list(columns))
+                        params = rows
+                    else:
+                        stmt = (
+                            update(User)
+                            .where(User.telegram_id == bindparam("b_telegram_id"))
+                            .values(**{c: bindparam(f"b_{c}") for c in columns if c != 'telegram_id'})
+                        )
+                        params = [{f"b_{k}": v for k, v in row.items()} for row in rows]
+                    try:
+                        async with conn.begin_nested():
+                            await conn.execute(stmt, params)
+                        results.update({row['telegram_id']: 'success' for row in rows})
+                        continue
+                    except IntegrityError as e:
+                        if not _is_player_id_conflict(e):
+                            logger.error(f"Помилка цілісності в пакетному upsert ({len(rows)} записів): {e}", exc_info=True)
+                            results.update({row['telegram_id']: 'error' for row in rows})
+                            continue
+
+                    # Пакет містить конфлікт player_id: шукаємо винуватців по одному
+                    for row, row_params in zip(rows, params):
+                        try:
+                            async with conn.begin_nested():
+                                await conn.execute(stmt, [row_params])
+                            results[row['telegram_id']] = 'success'
+                        except IntegrityError as e:
+                            results[row['telegram_id']] = 'conflict' if _is_player_id_conflict(e) else 'error'
+        except Exception as e:
+            logger.error(f"Загальна помилка в bulk_add_or_update_users: {e}", exc_info=True)
+            return {telegram_id: 'error' for telegram_id in merged}
+
+    conflicts = [tid for tid, status in results.items() if status == 'conflict']
+    if conflicts:
+        logger.warning(f"Пакетний upsert: конфлікт player_id для Telegram ID {conflicts}.")
+    return results
+
+
+# --- Chat messages (append-only) ---
+
+# Один INSERT на весь пакет: масиви розгортаються unnest у порядку надходження,
+# seq видає послідовність саме в цьому порядку. JOIN з users відкидає повідомлення
+# користувачів без профілю (для них історія живе лише в кеші/сесії).
+_INSERT_CHAT_MESSAGES_SQL = text("""
+    INSERT INTO chat_messages (user_id, role, content, message_id)
+    SELECT m.user_id, m.role, m.content, m.message_id
+    FROM unnest(
+             CAST(:user_ids AS BIGINT[]), CAST(:roles AS TEXT[]),
+             CAST(:contents AS TEXT[]), CAST(:message_ids AS UUID[])
+         ) WITH ORDINALITY AS m(user_id, role, content, message_id, ord)
+    JOIN users u ON u.telegram_id = m.user_id
+    ORDER BY m.ord
+    ON CONFLICT (message_id) DO NOTHING
+""")
+
+
+async def bulk_insert_chat_messages(messages_by_user: dict[int, list[dict[str, Any]]]) -> bool:
+    """
+    Дописує нові повідомлення багатьох користувачів однією транзакцією та одним запитом.
+
+    Args:
+        messages_by_user: Словник {telegram_id: [{"role": ..., "content": ..., "id": ...}, ...]}.
+            Повідомлення з уже записаним id пропускаються, тож повтор пакета безпечний.
+
+    Returns:
+        True, якщо пакет успішно записано.
+    """
+    user_ids: list[int] = []
+    roles: list[str] = []
+    contents: list[str] = []
+    message_ids: list[str | None] = []
+    for telegram_id, messages in messages_by_user.items():
+        for message in messages:
+            user_ids.append(telegram_id)
+            roles.append(str(message.get("role", "user")))
+            contents.append(str(message.get("content", "")))
+            message_ids.append(message.get("id"))
+    if not user_ids:
+        return True
 
-            try:
-                # 1. Перевіряємо, чи існує користувач з таким telegram_id
-                user_by_telegram_id = await conn.execute(
-                    select(User).where(User.telegram_id == telegram_id)
+    async with engine.connect() as conn:
+        try:
+            async with conn.begin():
+                await conn.execute(
+                    _INSERT_CHAT_MESSAGES_SQL,
+                    {"user_ids": user_ids, "roles": roles, "contents": contents, "message_ids": message_ids},
                 )
-                existing_user = user_by_telegram_id.first()
-
-                if existing_user:
-                    # Користувач з таким telegram_id вже існує - це оновлення
-                    stmt = (
-                        update(User)
-                        .where(User.telegram_id == telegram_id)
-                        .values(**user_data)
-                    )
-                    logger.info(f"Оновлення даних для користувача з Telegram ID: {telegram_id}")
-                else:
-                    # Новий користувач для цього telegram_id - це створення
-                    stmt = insert(User).values(**user_data)
-                    logger.info(f"Спроба створення нового користувача з Telegram ID: {telegram_id}")
-
-                await conn.execute(stmt)
-                await conn.commit()
-                return 'success'
-
-            except IntegrityError as e:
-                await conn.rollback() # Відкат транзакції
-                # 🧠 Більш надійна перевірка на основі тексту помилки від PostgreSQL.
-                # SQLAlchemy може по-різному "загортати" вихідні помилки драйвера.
-                error_text = str(e).lower()
-                if 'unique constraint' in error_text and ('uq_users_player_id' in error_text or 'users_player_id_key' in error_text):
-                    logger.warning(f"Конфлікт: Player ID {player_id} вже зареєстровано іншим користувачем. Спроба від Telegram ID {telegram_id}.")
-                    return 'conflict'
-                else:
-                    logger.error(f"Неочікувана помилка цілісності: {e}", exc_info=True)
-                    return 'error'
-            except Exception as e:
-                await conn.rollback()
-                logger.error(f"Загальна помилка в add_or_update_user: {e}", exc_info=True)
-                return 'error'
+            return True
+        except Exception as e:
+            logger.error(f"Помилка пакетного запису повідомлень чату ({len(user_ids)} записів): {e}", exc_info=True)
+            return False
+
+
+async def get_recent_chat_messages(telegram_id: int, limit: int) -> list[dict[str, Any]]:
+    """Останні `limit` повідомлень користувача у хронологічному порядку (скан PK назад)."""
+    recent = (
+        select(ChatMessage.seq, ChatMessage.role, ChatMessage.content)
+        .where(ChatMessage.user_id == telegram_id)
+        .order_by(ChatMessage.seq.desc())
+        .limit(limit)
+        .subquery()
+    )
+    async with engine.connect() as conn:
+        result = await conn.execute(select(recent.c.role, recent.c.content).order_by(recent.c.seq))
+        return [{"role": row.role, "content": row.content} for row in result]
+
+
+async def prune_chat_messages(keep_per_user: int, max_age_days: int) -> int:
+    """
+    Ретеншн історії: лишає не більше keep_per_user останніх повідомлень на користувача
+    і видаляє всі, старші за max_age_days.
+
+    Returns:
+        Кількість видалених повідомлень.
+    """
+    ranked = (
+        select(
+            ChatMessage.user_id,
+            ChatMessage.seq,
+            func.row_number().over(partition_by=ChatMessage.user_id, order_by=ChatMessage.seq.desc()).label("rn"),
+        )
+        .subquery()
+    )
+    overflow = select(ranked.c.user_id, ranked.c.seq).where(ranked.c.rn > keep_per_user)
+    by_count = delete(ChatMessage).where(tuple_(ChatMessage.user_id, ChatMessage.seq).in_(overflow))
+    by_age = delete(ChatMessage).where(
+        ChatMessage.created_at < func.now() - func.make_interval(0, 0, 0, max_age_days)
+    )
+    async with engine.connect() as conn:
+        try:
+            async with conn.begin():
+                deleted = (await conn.execute(by_age)).rowcount
+                deleted += (await conn.execute(by_count)).rowcount
+            return deleted
+        except Exception as e:
+            logger.error(f"Помилка прибирання історії чату: {e}", exc_info=True)
+            return 0
 
 
 async def get_user_by_telegram_id(telegram_id: int) -> dict[str, Any] | None:
-    # ... (код цієї функції залишається без змін) ...
+    """
+    Повний рядок користувача (включно з chat_history).
+    Для гарячих перевірок використовуйте проєкції нижче.
+    """
     async with engine.connect() as conn:
         stmt = select(User).where(User.telegram_id == telegram_id)
         result = await conn.execute(stmt)
@@ -89,6 +297,38 @@ async def get_user_by_telegram_id(telegram_id: int) -> dict[str, Any] | None:
             return dict(user_row._mapping)
     return None
 
+
+# --- User projections (гарячі запити без зайвих колонок) ---
+
+# Усі колонки профілю, крім історії чату (JSON може бути в рази більшим за решту рядка)
+_PROFILE_CARD_COLUMNS = tuple(column for column in User.__table__.columns if column.name != "chat_history")
+
+
+async def user_exists(telegram_id: int) -> bool:
+    """Чи зареєстрований користувач (SELECT 1 по індексу telegram_id)."""
+    async with engine.connect() as conn:
+        stmt = select(literal(1)).where(User.telegram_id == telegram_id).limit(1)
+        return (await conn.execute(stmt)).first() is not None
+
+
+async def get_user_rank(telegram_id: int) -> str | None:
+    """
+    Лише ранг користувача. Покривний індекс ix_users_telegram_id_rank
+    (telegram_id) INCLUDE (current_rank) дозволяє index-only scan.
+    """
+    async with engine.connect() as conn:
+        stmt = select(User.current_rank).where(User.telegram_id == telegram_id)
+        return (await conn.execute(stmt)).scalar_one_or_none()
+
+
+async def get_user_profile_card(telegram_id: int) -> dict[str, Any] | None:
+    """Дані для картки/каруселі профілю: усі колонки, крім chat_history."""
+    async with engine.connect() as conn:
+        stmt = select(*_PROFILE_CARD_COLUMNS).where(User.telegram_id == telegram_id)
+        user_row = (await conn.execute(stmt)).first()
+        return dict(user_row._mapping) if user_row else None
+
+
 async def delete_user_by_telegram_id(telegram_id: int) -> bool:
     # ... (код цієї функції залишається без змін) ...
     """
@@ -115,19 +355,134 @@ async def delete_user_by_telegram_id(telegram_id: int) -> bool:
 
 # --- UserSettings CRUD ---
 
+# Компактне представлення налаштувань: один int на користувача замість ORM-об'єкта
+MUTE_VISION = 1 << 0
+MUTE_CHAT = 1 << 1
+MUTE_PARTY = 1 << 2
+MUTE_ALL = MUTE_VISION | MUTE_CHAT | MUTE_PARTY
+_SETTINGS_FLAGS: tuple[tuple[str, int], ...] = (
+    ("mute_vision", MUTE_VISION),
+    ("mute_chat", MUTE_CHAT),
+    ("mute_party", MUTE_PARTY),
+)
+_SETTINGS_COLUMNS = (UserSettings.telegram_id, UserSettings.mute_vision, UserSettings.mute_chat, UserSettings.mute_party)
+
+
+def settings_to_mask(values: Mapping[str, Any] | UserSettings) -> int:
+    """Згортає прапорці налаштувань (рядок БД, словник або UserSettings) у бітову маску."""
+    if isinstance(values, Mapping):
+        return sum(flag for name, flag in _SETTINGS_FLAGS if values.get(name))
+    return sum(flag for name, flag in _SETTINGS_FLAGS if getattr(values, name, False))
+
+
+def settings_from_mask(telegram_id: int, mask: int) -> UserSettings:
+    """Розгортає бітову маску в новий (не прив'язаний до сесії) об'єкт UserSettings."""
+    return UserSettings(telegram_id=telegram_id, **{name: bool(mask & flag) for name, flag in _SETTINGS_FLAGS})
+
+
 async def get_user_settings(telegram_id: int) -> UserSettings:
     """
-    Отримує налаштування користувача з БД.
+    Отримує налаштування користувача (L1-кеш процесу → БД).
     Якщо користувача немає, повертає об'єкт UserSettings з налаштуваннями за замовчуванням.
+    Кожен виклик отримує новий об'єкт, тож його зміна не впливає на кеш.
+    """
+    return settings_from_mask(telegram_id, await get_settings_mask(telegram_id))
+
+
+async def _read_settings_from_redis(telegram_ids: list[int]) -> dict[int, int]:
+    """Маски з Redis (L2) для переданих id; відсутні ключі та помилки Redis пропускаються."""
+    try:
+        redis = await get_redis()
+        values = await redis.mget([SETTINGS_KEY_TEMPLATE.format(user_id=telegram_id) for telegram_id in telegram_ids])
+    except Exception as e:
+        logger.warning(f"Redis unavailable for settings lookup: {e}")
+        return {}
+    return {telegram_id: int(value) for telegram_id, value in zip(telegram_ids, values) if value is not None}
+
+
+async def _write_settings_to_redis(masks: dict[int, int]) -> None:
+    """Записує маски в Redis (L2) з TTL одним round-trip."""
+    if not masks:
+        return
+    try:
+        async with redis_pipeline() as pipe:
+            for telegram_id, mask in masks.items():
+                pipe.set(SETTINGS_KEY_TEMPLATE.format(user_id=telegram_id), mask, ex=SETTINGS_CACHE_TTL_SECONDS)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Redis unavailable for settings cache write: {e}")
+
+
+async def get_settings_mask(telegram_id: int) -> int:
+    """
+    Бітова маска налаштувань користувача (MUTE_*); 0 — налаштування за замовчуванням.
+    Cache-aside: L1 процесу → Redis → БД. Відсутній запис теж кешується (маска 0),
+    тож для більшості користувачів без налаштувань БД не запитується взагалі.
     """
+    cached = _settings_l1_cache.get(telegram_id)
+    if cached is not None:
+        return cached
+
+    from_redis = await _read_settings_from_redis([telegram_id])
+    if telegram_id in from_redis:
+        mask = from_redis[telegram_id]
+        _settings_l1_cache.set(telegram_id, mask)
+        return mask
+
     async with engine.connect() as conn:
-        stmt = select(UserSettings).where(UserSettings.telegram_id == telegram_id)
-        result = await conn.execute(stmt)
-        settings_row = result.first()
-        if settings_row:
-            return UserSettings(**settings_row._mapping)
-    # Якщо запис не знайдено, повертаємо дефолтний об'єкт
-    return UserSettings(telegram_id=telegram_id)
+        result = await conn.execute(select(*_SETTINGS_COLUMNS).where(UserSettings.telegram_id == telegram_id))
+        row = result.first()
+
+    mask = settings_to_mask(row._mapping) if row else 0
+    _settings_l1_cache.set(telegram_id, mask)
+    await _write_settings_to_redis({telegram_id: mask})
+    return mask
+
+
+async def get_settings_many(telegram_ids: Iterable[int]) -> dict[int, int]:
+    """
+    Бітові маски налаштувань для багатьох користувачів: L1 → Redis (MGET) → БД одним запитом (= ANY(:ids)).
+    Повертає {telegram_id: mask} для кожного переданого id; користувачі без м'ютів отримують 0.
+    Запит до БД читає лише рядки з м'ютами (частковий індекс ix_user_settings_muted).
+    """
+    masks: dict[int, int] = {}
+    missing: list[int] = []
+    for telegram_id in dict.fromkeys(telegram_ids):
+        cached = _settings_l1_cache.get(telegram_id)
+        if cached is None:
+            missing.append(telegram_id)
+        else:
+            masks[telegram_id] = cached
+    if not missing:
+        return masks
+
+    from_redis = await _read_settings_from_redis(missing)
+    for telegram_id, mask in from_redis.items():
+        _settings_l1_cache.set(telegram_id, mask)
+        masks[telegram_id] = mask
+    missing = [telegram_id for telegram_id in missing if telegram_id not in from_redis]
+    if not missing:
+        return masks
+
+    stmt = select(*_SETTINGS_COLUMNS).where(
+        UserSettings.telegram_id == any_(bindparam("ids", type_=ARRAY(BigInteger))),
+        or_(UserSettings.mute_vision, UserSettings.mute_chat, UserSettings.mute_party),
+    )
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(stmt, {"ids": missing})
+            muted = {row.telegram_id: settings_to_mask(row._mapping) for row in result}
+    except Exception as e:
+        logger.error(f"Помилка при масовому читанні налаштувань ({len(missing)} користувачів): {e}", exc_info=True)
+        # Без налаштувань вважаємо всіх не зам'юченими, але нічого не кешуємо
+        return {**masks, **dict.fromkeys(missing, 0)}
+
+    loaded = {telegram_id: muted.get(telegram_id, 0) for telegram_id in missing}
+    for telegram_id, mask in loaded.items():
+        _settings_l1_cache.set(telegram_id, mask)
+    await _write_settings_to_redis(loaded)
+    masks.update(loaded)
+    return masks
 
 
 async def update_user_settings(telegram_id: int, **kwargs) -> bool:
@@ -147,11 +502,15 @@ async def update_user_settings(telegram_id: int, **kwargs) -> bool:
                 stmt = stmt.on_conflict_do_update(
                     index_elements=['telegram_id'],
                     set_=kwargs
-                )
-                await conn.execute(stmt)
+                ).returning(*_SETTINGS_COLUMNS)
+                row = (await conn.execute(stmt)).one()
                 await conn.commit()
-                logger.info(f"Налаштування для користувача {telegram_id} оновлено: {kwargs}")
-                return True
+            logger.info(f"Налаштування для користувача {telegram_id} оновлено: {kwargs}")
+            # Спершу свіже значення в Redis, потім інвалідація L1 усіх процесів:
+            # так інші процеси після інвалідації перечитають уже нову маску.
+            await _write_settings_to_redis({telegram_id: settings_to_mask(row._mapping)})
+            await cache_invalidator.invalidate(SETTINGS_INVALIDATION_NAMESPACE, telegram_id)
+            return True
         except Exception as e:
             await conn.rollback()
             logger.error(f"Помилка при оновленні налаштувань для {telegram_id}: {e}", exc_info=True)
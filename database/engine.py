@@ -0,0 +1,102 @@
+"""
+Спільний асинхронний engine SQLAlchemy для всього бота.
+
+- Один пул з’єднань на процес (crud, міграції, ігри) з налаштуваннями
+  з config: розмір, overflow, recycle, pool_pre_ping.
+- asyncpg: розмір кешу підготовлених запитів і серверний statement_timeout,
+  щоб завислий запит не тримав з’єднання пулу безкінечно.
+- Метрики пулу: час очікування на з’єднання (checkout) та насиченість.
+"""
+import time
+from typing import Any
+
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from config import (
+    ASYNC_DATABASE_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE_SECONDS,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT_SECONDS,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_STATEMENT_TIMEOUT_MS,
+    logger,
+)
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """Пул, що рахує час очікування на з’єднання та пікову кількість зайнятих з’єднань."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.peak_checked_out = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        connection = super()._do_get()
+        waited = time.perf_counter() - started
+        self.checkouts += 1
+        self.checkout_wait_total += waited
+        self.checkout_wait_max = max(self.checkout_wait_max, waited)
+        self.peak_checked_out = max(self.peak_checked_out, self.checkedout())
+        return connection
+
+    def stats(self) -> dict[str, Any]:
+        capacity = self.size() + self._max_overflow
+        return {
+            "pool_size": self.size(),
+            "max_overflow": self._max_overflow,
+            "checked_out": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "peak_checked_out": self.peak_checked_out,
+            "saturation": round(self.checkedout() / capacity, 3) if capacity > 0 else 0.0,
+            "checkouts": self.checkouts,
+            "checkout_wait_avg_ms": (
+                round(self.checkout_wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0
+            ),
+            "checkout_wait_max_ms": round(self.checkout_wait_max * 1000, 3),
+        }
+
+
+def create_engine() -> AsyncEngine:
+    """Створює engine з налаштуваннями пулу та asyncpg з config."""
+    return create_async_engine(
+        ASYNC_DATABASE_URL,
+        poolclass=MeteredQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+        pool_pre_ping=True,
+        connect_args={
+            # 0 — якщо між ботом і БД стоїть pgbouncer у transaction-режимі
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {
+                "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS),
+                "application_name": "mlbb-iui-mini",
+            },
+        },
+    )
+
+
+engine = create_engine()
+
+
+def get_db_pool_stats() -> dict[str, Any]:
+    """Метрики пулу з’єднань БД (насиченість та час очікування checkout)."""
+    pool = engine.pool
+    if isinstance(pool, MeteredQueuePool):
+        return pool.stats()
+    return {"status": pool.status()}
+
+
+async def dispose_engine() -> None:
+    """Закриває всі з’єднання пулу при завершенні програми."""
+    logger.info(f"Database pool stats on shutdown: {get_db_pool_stats()}")
+    await engine.dispose()
+    logger.info("🔒 Database engine disposed.")
@@ -0,0 +1,291 @@
+"""
+Версіоновані міграції схеми.
+
+- Кожен крок має номер версії; застосовані кроки записуються в schema_migrations.
+- На звичайному старті виконується лише один запит (MAX(version)): якщо схема
+  актуальна, жодного DDL і жодного сканування таблиць.
+- Відсутні кроки застосовуються по черзі, кожен у власній транзакції, під
+  advisory-локом, тож два дино, що стартують одночасно, не виконують міграції двічі.
+  Лок береться опитуванням pg_try_advisory_lock (кожен запит миттєвий, тож
+  statement_timeout з engine не спрацьовує), не довше за MIGRATIONS_LOCK_WAIT_SECONDS;
+  інакше — MigrationLockTimeout.
+- Крок, що впав, зупиняє міграції з MigrationFailed: бот не стартує на
+  напівмігрованій схемі.
+- Новий крок — нова функція з декоратором @migration(<наступна версія>, "<назва>").
+  Вже застосовані кроки не змінюються: вони не виконаються повторно.
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config import MIGRATIONS_LOCK_WAIT_SECONDS, logger
+from database.engine import engine
+from database.models import Base
+
+# Довільний, але сталий ключ pg_advisory_lock для міграцій цього бота
+MIGRATIONS_LOCK_KEY = 4_417_020_001
+MIGRATIONS_LOCK_POLL_SECONDS = 1.0
+
+MigrationFunc = Callable[[AsyncConnection], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: MigrationFunc
+
+
+MIGRATIONS: list[Migration] = []
+
+
+class MigrationLockTimeout(RuntimeError):
+    """Інший інстанс тримає лок міграцій довше за MIGRATIONS_LOCK_WAIT_SECONDS."""
+
+
+class MigrationFailed(RuntimeError):
+    """Крок міграції впав; схема лишилася на попередній версії."""
+
+
+def migration(version: int, name: str) -> Callable[[MigrationFunc], MigrationFunc]:
+    """Реєструє крок міграції. Версії мають іти строго по зростанню."""
+    def decorator(func: MigrationFunc) -> MigrationFunc:
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise ValueError(f"Migration version {version} ({name}) must be greater than {MIGRATIONS[-1].version}")
+        MIGRATIONS.append(Migration(version, name, func))
+        return func
+    return decorator
+
+
+# --- Кроки міграцій ---
+
+@migration(1, "create_tables")
+async def _create_tables(conn: AsyncConnection) -> None:
+    await conn.run_sync(Base.metadata.create_all)
+
+
+@migration(2, "users_soft_columns")
+async def _users_soft_columns(conn: AsyncConnection) -> None:
+    # Колонки, які додавалися до users після першого релізу (для старих баз)
+    columns = [
+        ("chat_history", "JSON"),
+        ("likes_received", "INTEGER"),
+        ("location", "TEXT"),
+        ("squad_name", "TEXT"),
+        ("stats_filter_type", "TEXT"),
+        ("mvp_count", "INTEGER"),
+        ("legendary_count", "INTEGER"),
+        ("maniac_count", "INTEGER"),
+        ("double_kill_count", "INTEGER"),
+        ("most_kills_in_one_game", "INTEGER"),
+        ("longest_win_streak", "INTEGER"),
+        ("highest_dmg_per_min", "INTEGER"),
+        ("highest_gold_per_min", "INTEGER"),
+        ("savage_count", "INTEGER"),
+        ("triple_kill_count", "INTEGER"),
+        ("mvp_loss_count", "INTEGER"),
+        ("most_assists_in_one_game", "INTEGER"),
+        ("first_blood_count", "INTEGER"),
+        ("highest_dmg_taken_per_min", "INTEGER"),
+        ("kda_ratio", "FLOAT"),
+        ("teamfight_participation_rate", "FLOAT"),
+        ("avg_gold_per_min", "INTEGER"),
+        ("avg_hero_dmg_per_min", "INTEGER"),
+        ("avg_deaths_per_match", "FLOAT"),
+        ("avg_turret_dmg_per_match", "INTEGER"),
+        ("hero1_name", "TEXT"),
+        ("hero1_matches", "INTEGER"),
+        ("hero1_win_rate", "FLOAT"),
+        ("hero2_name", "TEXT"),
+        ("hero2_matches", "INTEGER"),
+        ("hero2_win_rate", "FLOAT"),
+        ("hero3_name", "TEXT"),
+        ("hero3_matches", "INTEGER"),
+        ("hero3_win_rate", "FLOAT"),
+        ("basic_profile_file_id", "TEXT"),
+        ("basic_profile_permanent_url", "TEXT"),
+        ("stats_photo_file_id", "TEXT"),
+        ("stats_photo_permanent_url", "TEXT"),
+        ("heroes_photo_file_id", "TEXT"),
+        ("heroes_photo_permanent_url", "TEXT"),
+        ("avatar_file_id", "TEXT"),
+        ("avatar_permanent_url", "TEXT"),
+        ("is_muted", "BOOLEAN DEFAULT false"),
+    ]
+    # Один ALTER TABLE замість 43 окремих: одне блокування таблиці і один перезапис каталогу
+    await conn.execute(text(
+        "ALTER TABLE users "
+        + ", ".join(f"ADD COLUMN IF NOT EXISTS {name} {ddl}" for name, ddl in columns)
+    ))
+
+
+@migration(3, "dedupe_player_id")
+async def _dedupe_player_id(conn: AsyncConnection) -> None:
+    # Колишня sanitize_database() з main.py: лишаємо найновіший запис кожного player_id
+    result = await conn.execute(text("""
+        DELETE FROM users
+        WHERE ctid IN (
+            SELECT ctid
+            FROM (
+                SELECT
+                    ctid,
+                    ROW_NUMBER() OVER(PARTITION BY player_id ORDER BY created_at DESC) as rn
+                FROM users
+            ) as sub
+            WHERE rn > 1
+        )
+    """))
+    if result.rowcount:
+        logger.warning(f"Deleted {result.rowcount} duplicate user entries by player_id.")
+    await conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_users_player_id ON users (player_id)"))
+
+
+@migration(4, "users_rank_covering_index")
+async def _users_rank_covering_index(conn: AsyncConnection) -> None:
+    # Покривний індекс для get_user_rank (index-only scan)
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_telegram_id_rank ON users (telegram_id) INCLUDE (current_rank)"
+    ))
+
+
+@migration(5, "chat_history_to_messages")
+async def _chat_history_to_messages(conn: AsyncConnection) -> None:
+    """
+    Переносить історію з JSON-колонки users.chat_history у таблицю chat_messages
+    і звільняє колонку. Переносяться лише користувачі, у яких ще немає повідомлень.
+    """
+    moved = await conn.execute(text("""
+        INSERT INTO chat_messages (user_id, role, content)
+        SELECT u.telegram_id,
+               LEFT(COALESCE(m.value ->> 'role', 'user'), 16),
+               COALESCE(m.value ->> 'content', '')
+        FROM users u
+        CROSS JOIN LATERAL json_array_elements(u.chat_history) WITH ORDINALITY AS m(value, ord)
+        WHERE u.chat_history IS NOT NULL
+          AND json_typeof(u.chat_history) = 'array'
+          AND NOT EXISTS (SELECT 1 FROM chat_messages c WHERE c.user_id = u.telegram_id)
+        ORDER BY u.telegram_id, m.ord
+    """))
+    cleared = await conn.execute(text("UPDATE users SET chat_history = NULL WHERE chat_history IS NOT NULL"))
+    if moved.rowcount or cleared.rowcount:
+        logger.info(
+            f"Chat history migrated: {moved.rowcount} messages from {cleared.rowcount} users "
+            "moved to chat_messages."
+        )
+
+
+@migration(6, "user_settings_muted_index")
+async def _user_settings_muted_index(conn: AsyncConnection) -> None:
+    # Частковий індекс для get_settings_many: лише користувачі з хоча б одним м'ютом
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_user_settings_muted ON user_settings (telegram_id) "
+        "WHERE mute_vision OR mute_chat OR mute_party"
+    ))
+
+
+@migration(7, "chat_messages_message_id")
+async def _chat_messages_message_id(conn: AsyncConnection) -> None:
+    # Ідемпотентні вставки з журналу write-behind: INSERT ... ON CONFLICT (message_id) DO NOTHING
+    await conn.execute(text("ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS message_id UUID"))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_chat_messages_message_id ON chat_messages (message_id)"
+    ))
+
+
+# --- Виконавець ---
+
+async def get_schema_version(conn: AsyncConnection) -> int:
+    """Поточна версія схеми; 0 — якщо таблиці schema_migrations ще немає."""
+    try:
+        result = await conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations"))
+        return int(result.scalar_one())
+    except ProgrammingError:
+        # undefined_table: база ще не бачила версіонованих міграцій
+        await conn.rollback()
+        return 0
+
+
+async def _acquire_migrations_lock(conn: AsyncConnection, wait_seconds: float) -> None:
+    """
+    Чекає на advisory-лок міграцій, опитуючи pg_try_advisory_lock.
+    Блокуючий pg_advisory_lock скасувався б за statement_timeout з engine,
+    поки інший інстанс виконує довгий крок.
+    """
+    deadline = time.monotonic() + wait_seconds
+    waiting_logged = False
+    while True:
+        result = await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+        acquired = bool(result.scalar_one())
+        await conn.commit()
+        if acquired:
+            return
+        if time.monotonic() >= deadline:
+            raise MigrationLockTimeout(
+                f"Migrations lock is still held by another instance after {wait_seconds:.0f} s."
+            )
+        if not waiting_logged:
+            logger.info("Another instance is applying migrations, waiting for the lock...")
+            waiting_logged = True
+        await asyncio.sleep(MIGRATIONS_LOCK_POLL_SECONDS)
+
+
+async def run_migrations() -> int:
+    """
+    Застосовує всі відсутні міграції та повертає кількість застосованих кроків.
+    Якщо крок падає — MigrationFailed: наступні кроки не виконуються (вони можуть
+    від нього залежати), а старт бота переривається; наступний старт повторить
+    спробу з цього ж кроку.
+    Якщо лок не вдалося отримати за MIGRATIONS_LOCK_WAIT_SECONDS — MigrationLockTimeout.
+    """
+    latest = MIGRATIONS[-1].version
+    async with engine.connect() as conn:
+        current = await get_schema_version(conn)
+        await conn.commit()
+        if current >= latest:
+            logger.info(f"Database schema is up to date (version {current}).")
+            return 0
+
+        await _acquire_migrations_lock(conn, MIGRATIONS_LOCK_WAIT_SECONDS)
+        applied = 0
+        try:
+            async with conn.begin():
+                await conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                    )
+                """))
+            # Інший дино міг застосувати частину кроків, поки ми чекали на лок
+            current = await get_schema_version(conn)
+            await conn.commit()
+            for step in MIGRATIONS:
+                if step.version <= current:
+                    continue
+                started = time.perf_counter()
+                try:
+                    async with conn.begin():
+                        # Міграції можуть сканувати великі таблиці: без ліміту з engine
+                        await conn.execute(text("SET LOCAL statement_timeout = 0"))
+                        await step.apply(conn)
+                        await conn.execute(
+                            text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                            {"version": step.version, "name": step.name},
+                        )
+                except Exception as e:
+                    logger.error(f"❌ Migration {step.version} ({step.name}) failed: {e}", exc_info=True)
+                    raise MigrationFailed(f"migration {step.version} ({step.name}) failed: {e}") from e
+                applied += 1
+                logger.info(
+                    f"✅ Migration {step.version} ({step.name}) applied "
+                    f"in {(time.perf_counter() - started) * 1000:.0f} ms."
+                )
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+            await conn.commit()
+    return applied
@@ -14,7 +14,12 @@ from sqlalchemy import (
     DateTime,
     JSON,
     Boolean,
+    ForeignKey,
+    Index,
+    Sequence,
+    Text,
 )
+from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.sql import func
 
@@ -40,6 +45,15 @@ class UserSettings(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
 
+    __table_args__ = (
+        # Частковий індекс лише по користувачах з хоча б одним м'ютом:
+        # для масових перевірок (get_settings_many) решта рядків не потрібна.
+        Index(
+            'ix_user_settings_muted', 'telegram_id',
+            postgresql_where=mute_vision | mute_chat | mute_party,
+        ),
+    )
+
     def __repr__(self) -> str:
         return (
             f"<UserSettings(telegram_id={self.telegram_id}, "
@@ -116,7 +130,8 @@ class User(Base):
     avatar_file_id = Column(String(255), nullable=True)
     avatar_permanent_url = Column(String(512), nullable=True)
 
-    # Історія чату для AI-асистента
+    # ❗️ ЗАСТАРІЛЕ: історія чату тепер у таблиці chat_messages.
+    # Колонка лишається для одноразової міграції старих даних (database/migrations.py).
     chat_history = Column(JSON, nullable=True)
 
     # ❗️ ПОЛЕ is_muted тепер є застарілим, але ми його не видаляємо, щоб не зламати міграцію.
@@ -133,6 +148,39 @@ class User(Base):
             f"nickname='{self.nickname}', player_id={self.player_id})>"
         )
 
+# Глобальна послідовність: seq монотонно зростає і в межах кожного користувача,
+# тож паралельні вставки не потребують MAX(seq) + 1 чи блокувань.
+chat_messages_seq = Sequence("chat_messages_seq")
+
+
+class ChatMessage(Base):
+    """
+    Повідомлення діалогу з AI-асистентом (append-only).
+    Останні N повідомлень користувача читаються по первинному ключу (user_id, seq).
+    """
+    __tablename__ = 'chat_messages'
+
+    user_id = Column(
+        BigInteger, ForeignKey('users.telegram_id', ondelete='CASCADE'), primary_key=True
+    )
+    seq = Column(BigInteger, chat_messages_seq, primary_key=True, server_default=chat_messages_seq.next_value())
+    role = Column(String(16), nullable=False)
+    content = Column(Text, nullable=False)
+    # Ідентифікатор, згенерований ботом: повторна вставка з журналу write-behind не дублює рядок.
+    # NULL — повідомлення, перенесені з users.chat_history або з журналу старого формату.
+    message_id = Column(UUID(as_uuid=False), nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        # Для прибирання за віком (prune_chat_messages)
+        Index('ix_chat_messages_created_at', 'created_at'),
+        Index('uq_chat_messages_message_id', 'message_id', unique=True),
+    )
+
+    def __repr__(self) -> str:
+        return f"<ChatMessage(user_id={self.user_id}, seq={self.seq}, role='{self.role}')>"
+
+
 # Імпортуємо моделі з інших модулів, щоб Base.metadata.create_all знав про них.
 from games.reaction.models import ReactionGameScore
 
@@ -7,8 +7,8 @@ from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 
 from config import logger
-# Використовуємо спільний engine з основного модуля БД
-from database.crud import engine
+# Використовуємо спільний engine бота
+from database.engine import engine
 
 
 async def save_reaction_score(user_id: int, time_ms: int) -> None:
@@ -11,7 +11,7 @@ from aiogram.exceptions import TelegramAPIError
 from aiogram.filters import Command
 
 from config import logger
-from database.crud import get_user_by_telegram_id
+from database.crud import user_exists
 from games.reaction.crud import get_leaderboard, save_reaction_score
 from games.reaction.facts import get_fact_for_time
 from games.reaction.keyboards import (create_leaderboard_keyboard,
@@ -54,8 +54,7 @@ async def start_reaction_game(callback_query: types.CallbackQuery):
         return
 
     # Перевірка, чи гравець зареєстрований
-    user_profile = await get_user_by_telegram_id(user_id)
-    if not user_profile:
+    if not await user_exists(user_id):
         await callback_query.answer(MSG_ERROR_NOT_REGISTERED, show_alert=True)
         return
 
@@ -44,9 +44,9 @@ from services.openai_service import MLBBChatGPT
 from utils.message_utils import send_message_in_chunks
 from utils.formatter import format_bot_response
 # 🧠 ІМПОРТУЄМО ФУНКЦІЇ ДЛЯ РОБОТИ З БД ТА НОВИМИ ШАРАМИ ПАМ'ЯТІ
-from database.crud import get_user_settings, update_user_settings
-from utils.session_memory import SessionData, load_session, save_session
-from utils.cache_manager import load_user_cache, save_user_cache, clear_user_cache
+from database.crud import MUTE_ALL, MUTE_CHAT, MUTE_VISION, get_settings_mask, update_user_settings
+from utils.session_memory import load_session, append_messages
+from utils.cache_manager import load_user_cache, save_user_chat_history, clear_user_cache
 
 
 # === СХОВИЩА ДАНИХ У ПАМ'ЯТІ ===
@@ -79,6 +79,7 @@ async def set_bot_commands(bot: Bot):
         BotCommand(command="profile", description="👤 Мій профіль (реєстрація/оновлення)"),
         BotCommand(command="go", description="💬 Задати питання AI-помічнику"),
         BotCommand(command="search", description="🔍 Пошук новин та оновлень"),
+        BotCommand(command="party", description="🎯 Знайти відкрите лобі під свою роль"),
         BotCommand(command="analyzeprofile", description="📸 Аналіз скріншота профілю"),
         BotCommand(command="analyzestats", description="📊 Аналіз скріншота статистики"),
         BotCommand(command="settings", description="⚙️ Налаштування реакцій бота"),
@@ -112,8 +113,7 @@ async def cmd_start(message: Message, state: FSMContext, bot: Bot):
     if not user: return
 
     # ❗️ ЛОГІКА ЗНЯТТЯ М'ЮТУ ПРИ СТАРТІ
-    settings = await get_user_settings(user.id)
-    if settings.mute_chat and settings.mute_vision and settings.mute_party:
+    if await get_settings_mask(user.id) & MUTE_ALL == MUTE_ALL:
         logger.info(f"Користувач {user.id} використав /start, знімаю всі м'юти.")
         await update_user_settings(user.id, mute_chat=False, mute_vision=False, mute_party=False)
         await clear_user_cache(user.id)
@@ -160,6 +160,7 @@ async def cmd_help(message: Message):
 /profile - Зареєструвати або оновити свій ігровий профіль.
 /go <code>&lt;питання&gt;</code> - Задати будь-яке питання про гру (герої, предмети, тактики).
 /search <code>&lt;запит&gt;</code> - Знайти останні новини або інформацію в Інтернеті.
+/party <code>[роль] [режим]</code> - Знайти відкрите лобі, якому бракує вашої ролі.
 /analyzeprofile - Запустити аналіз скріншота вашого профілю.
 /analyzestats - Запустити аналіз скріншота вашої статистики.
 /settings - Відкрити меню налаштувань моїх реакцій.
@@ -333,8 +334,7 @@ async def handle_image_messages(message: Message, bot: Bot):
     is_reply_to_bot = message.reply_to_message and message.reply_to_message.from_user.id == bot_info.id
 
     # ❗️ ОНОВЛЕНА ПЕРЕВІРКА СТАТУСУ М'ЮТУ
-    settings = await get_user_settings(user_id)
-    if settings.mute_vision:
+    if await get_settings_mask(user_id) & MUTE_VISION:
         if is_reply_to_bot:
             logger.info(f"Користувач {user_id} з mute_vision=True відповів боту, знімаю м'ют vision.")
             await update_user_settings(user_id, mute_vision=False)
@@ -429,8 +429,7 @@ async def handle_trigger_messages(message: Message, bot: Bot):
     is_reply_to_bot = message.reply_to_message and message.reply_to_message.from_user.id == bot_info.id
 
     # ❗️ ОНОВЛЕНА ПЕРЕВІРКА СТАТУСУ М'ЮТУ
-    settings = await get_user_settings(user_id)
-    if settings.mute_chat:
+    if await get_settings_mask(user_id) & MUTE_CHAT:
         if is_reply_to_bot:
             logger.info(f"Користувач {user_id} з mute_chat=True відповів боту, знімаю м'ют чату.")
             await update_user_settings(user_id, mute_chat=False)
@@ -517,11 +516,11 @@ async def handle_trigger_messages(message: Message, bot: Bot):
                 formatted_message = format_bot_response(reply_text, content_type="default")
                 
                 if is_registered:
-                    user_cache['chat_history'] = chat_history
-                    await save_user_cache(user_id, user_cache)
+                    # Оновлюємо лише історію, не перезаписуючи весь профіль
+                    await save_user_chat_history(user_id, chat_history, chat_history[-2:])
                 else:
-                    session.chat_history = chat_history
-                    await save_session(user_id, session)
+                    # Атомарно дописуємо лише нову пару повідомлень (RPUSH + LTRIM)
+                    await append_messages(user_id, chat_history[-2:])
 
                 await message.reply(formatted_message)
         except Exception as e:
@@ -12,18 +12,36 @@
 import asyncio
 import html
 import logging
+import os
 import re
+import resource
+import time
 from typing import Any
 
 from aiogram import Bot, F, Router
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramAPIError
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import CallbackQuery, Message
 
 # ❗️ НОВІ ІМПОРТИ
-from database.crud import get_user_settings, get_user_by_telegram_id
+from database.crud import MUTE_PARTY, get_settings_many, get_settings_mask
+from config import (
+    PARTY_LOBBY_EDIT_DEBOUNCE_SECONDS,
+    PARTY_LOBBY_IDLE_TIMEOUT_SECONDS,
+    PARTY_LOBBY_STORE,
+    PARTY_LOBBY_SWEEP_INTERVAL_SECONDS,
+    PARTY_LOBBY_TTL_SECONDS,
+    PARTY_MATCH_SUGGESTIONS,
+)
+from utils.cache_manager import get_cached_user_rank
+from utils.lobby_store import lobby_store
+from utils.message_coalescer import FINAL_VERSION, MessageEditCoalescer
+from utils.matchmaking import RANK_BANDS, matchmaking_index, missing_roles, rank_band
+from utils.message_fanout import MessageFanout
 from keyboards.inline_keyboards import (
     ALL_ROLES,
     create_game_mode_keyboard,
@@ -37,9 +55,19 @@ from keyboards.inline_keyboards import (
 
 logger = logging.getLogger(__name__)
 
-# === ІНІЦІАЛІЗАЦІЯ РОУТЕРА ТА СХОВИЩА ===
+# === ІНІЦІАЛІЗАЦІЯ РОУТЕРА ===
+# Лобі зберігаються в utils/lobby_store (Redis-хеш на лобі, атомарні операції)
 party_router = Router()
-active_lobbies: dict[int, dict] = {}
+# Редагування повідомлень лобі: debounce за (chat_id, message_id), завжди найновіша версія
+lobby_message_editor = MessageEditCoalescer(
+    "lobby",
+    PARTY_LOBBY_EDIT_DEBOUNCE_SECONDS,
+    sent_ttl=PARTY_LOBBY_TTL_SECONDS,
+    # Лобі спільні для воркерів (Redis) — порядок версій теж має бути спільним
+    shared_versions=PARTY_LOBBY_STORE != "memory",
+)
+# Особисті повідомлення учасникам зібраного паті: паралельно, у межах лімітів Telegram
+party_dm_fanout = MessageFanout("party_dm")
 
 
 # === СТАНИ FSM ДЛЯ СТВОРЕННЯ ПАТІ ===
@@ -66,11 +94,8 @@ def get_user_display_name(user: Message | CallbackQuery) -> str:
     return "друже"
 
 async def _get_user_rank(user_id: int) -> str:
-    """Отримує ранг користувача з БД, якщо він зареєстрований."""
-    user_data = await get_user_by_telegram_id(user_id)
-    if user_data and user_data.get("current_rank"):
-        return user_data["current_rank"]
-    return "невідомий"
+    """Ранг користувача з кешу рангів (utils/cache_manager); БД — лише при першому зверненні."""
+    return await get_cached_user_rank(user_id) or "невідомий"
 
 
 def is_party_request_message(message: Message) -> bool:
@@ -85,6 +110,8 @@ def is_party_request_message(message: Message) -> bool:
     except (AttributeError, TypeError):
         return False
 
+GAME_MODE_NAMES = {"Ranked": "🏆 Рейтинг", "Classic": "🕹️ Класика", "Brawl": "⚔️ Режим бою"}
+
 def get_lobby_message_text(lobby_data: dict, joining_user_name: str | None = None) -> str:
     """Створює розширений та візуально привабливий текст для лобі-повідомлення."""
     leader_name = html.escape(lobby_data['leader_name'])
@@ -92,8 +119,7 @@ def get_lobby_message_text(lobby_data: dict, joining_user_name: str | None = Non
     game_mode = lobby_data.get('game_mode', 'Ranked')
     party_size = lobby_data.get('party_size', 5)
 
-    game_mode_map = {"Ranked": "🏆 Рейтинг", "Classic": "🕹️ Класика", "Brawl": "⚔️ Режим бою"}
-    mode_display = game_mode_map.get(game_mode, game_mode)
+    mode_display = GAME_MODE_NAMES.get(game_mode, game_mode)
 
     role_emoji_map = {"EXP": "⚔️", "ЛІС": "🌳", "МІД": "🧙", "АДК": "🏹", "РОУМ": "🛡️"}
 
@@ -149,7 +175,15 @@ def get_lobby_message_text(lobby_data: dict, joining_user_name: str | None = Non
 async def notify_and_close_full_lobby(bot: Bot, lobby_id: int, lobby_data: dict[str, Any]):
     """
     Сповіщає учасників про повний збір, закриває лобі та видаляє його з активних.
+    Редагування групового повідомлення та розсилка в особисті йдуть у фоні,
+    тож обробник callback'а відповідає одразу.
     """
+    # Закриття атомарне: сповіщення розсилає лише той виклик, що справді закрив лобі
+    status, closed_lobby = await lobby_store.close(lobby_data["chat_id"], lobby_id)
+    if status != "ok":
+        logger.info(f"Лобі {lobby_id} вже закрито, сповіщення не потрібні.")
+        return
+    lobby_data = closed_lobby
     logger.info(f"Команда для лобі {lobby_id} повністю зібрана. Розсилаю сповіщення.")
     
     chat_id = lobby_data["chat_id"]
@@ -186,16 +220,7 @@ async def notify_and_close_full_lobby(bot: Bot, lobby_id: int, lobby_data: dict[
     ]
     group_message_text = "<blockquote>" + "\n".join(group_message_parts) + "</blockquote>"
 
-    try:
-        await bot.edit_message_text(
-            text=group_message_text,
-            chat_id=chat_id,
-            message_id=lobby_id,
-            reply_markup=None,
-            parse_mode=ParseMode.HTML
-        )
-    except TelegramAPIError as e:
-        logger.error(f"Не вдалося оновити фінальне повідомлення для лобі {lobby_id}: {e}")
+    _publish_closed_lobby(bot, chat_id, lobby_id, group_message_text)
 
     # Формуємо посилання на чат
     if chat_username:
@@ -219,18 +244,20 @@ async def notify_and_close_full_lobby(bot: Bot, lobby_id: int, lobby_data: dict[
     ]
     dm_text = "<blockquote>" + "\n".join(dm_parts) + "</blockquote>"
 
-    # Розсилка особистих повідомлень
+    # Розсилка особистих повідомлень (налаштування всіх учасників — одним запитом)
+    settings_masks = await get_settings_many(int(player_id) for player_id in players)
+    recipients = []
     for player_id in players.keys():
-        try:
-            await bot.send_message(player_id, dm_text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            await asyncio.sleep(0.1) # Невеликий таймаут, щоб уникнути спам-фільтрів
-        except TelegramAPIError as e:
-            logger.warning(f"Не вдалося надіслати особисте повідомлення гравцю {player_id} з лобі {lobby_id}: {e}")
-            
-    # Видаляємо лобі з активних
-    if lobby_id in active_lobbies:
-        del active_lobbies[lobby_id]
-        logger.info(f"Лобі {lobby_id} успішно закрито та видалено з пам'яті.")
+        if settings_masks.get(int(player_id), 0) & MUTE_PARTY:
+            logger.info(f"Пропускаю особисте повідомлення гравцю {player_id} з лобі {lobby_id}: mute_party=True.")
+            continue
+        recipients.append(int(player_id))
+    party_dm_fanout.dispatch(
+        bot, recipients, dm_text, label=f"Lobby {lobby_id} DMs",
+        parse_mode=ParseMode.HTML, disable_web_page_preview=True,
+    )
+
+    logger.info(f"Лобі {lobby_id} успішно закрито.")
 
 
 # === ЛОГІКА СТВОРЕННЯ ПАТІ (FSM) ===
@@ -244,8 +271,7 @@ async def ask_for_party_creation(message: Message, state: FSMContext):
     user_id = message.from_user.id
     user_name = get_user_display_name(message)
     
-    settings = await get_user_settings(user_id)
-    if settings.mute_party:
+    if await get_settings_mask(user_id) & MUTE_PARTY:
         logger.info(f"Ігнорую запит на паті від {user_name} (ID: {user_id}), оскільки mute_party=True.")
         return
 
@@ -431,7 +457,8 @@ async def create_party_lobby(callback: CallbackQuery, state: FSMContext, bot: Bo
         "required_roles": required_roles
     }
     
-    active_lobbies[lobby_id] = lobby_data
+    await lobby_store.create(chat.id, lobby_id, lobby_data)
+    matchmaking_index.update(chat.id, lobby_id, lobby_data)
     
     message_text = get_lobby_message_text(lobby_data)
     keyboard = create_lobby_keyboard(lobby_id, lobby_data)
@@ -513,46 +540,58 @@ async def step_back_to_leader_role(callback: CallbackQuery, state: FSMContext):
 
 
 # === ЛОГІКА ВЗАЄМОДІЇ З ЛОБІ ===
+# Кожна дія — одна атомарна операція lobby_store; повідомлення оновлюється вже
+# за результатом операції, тож одночасні натискання не конфліктують.
+
+def _publish_lobby_state(bot: Bot, lobby_id: int, lobby_data: dict[str, Any]):
+    """
+    Публікує стан, який повернула операція lobby_store: оновлює індекс матчмейкінгу
+    і ставить у чергу редагування повідомлення лобі.
+    Редагування об'єднуються (utils/message_coalescer): серія натискань дає одне
+    редагування з найновішою версією, а старіша версія не перезапише новішу.
+    """
+    matchmaking_index.update(lobby_data["chat_id"], lobby_id, lobby_data)
+    joining_user = lobby_data.get("joining_user") or {}
+    lobby_message_editor.submit(
+        bot,
+        lobby_data["chat_id"],
+        lobby_id,
+        get_lobby_message_text(lobby_data, joining_user_name=joining_user.get("name")),
+        reply_markup=create_lobby_keyboard(lobby_id, lobby_data),
+        version=lobby_data.get("version", 0),
+    )
+
+
+def _publish_closed_lobby(bot: Bot, chat_id: int, lobby_id: int, text: str):
+    """Прибирає лобі з матчмейкінгу й ставить фінальне повідомлення; далі воно не редагується."""
+    matchmaking_index.remove(chat_id, lobby_id)
+    lobby_message_editor.submit(bot, chat_id, lobby_id, text, reply_markup=None, version=FINAL_VERSION)
+
 
 @party_router.callback_query(F.data.startswith("party_join:"))
 async def handle_join_request(callback: CallbackQuery, bot: Bot):
     lobby_id = int(callback.data.split(":")[-1])
     user = callback.from_user
-    
-    if lobby_id not in active_lobbies:
+    user_name = get_user_display_name(callback)
+
+    status, lobby_data = await lobby_store.start_join(callback.message.chat.id, lobby_id, user.id, user_name)
+
+    if status == "missing":
         await callback.answer("Цього лобі більше не існує.", show_alert=True)
         try: await callback.message.delete()
         except TelegramAPIError: pass
         return
-
-    lobby_data = active_lobbies[lobby_id]
-    
-    if user.id in lobby_data["players"]:
+    if status == "member":
         await callback.answer("Ти вже у цьому паті!", show_alert=True)
         return
-        
-    if len(lobby_data["players"]) >= lobby_data.get("party_size", 5):
+    if status == "full":
         await callback.answer("Паті вже заповнено!", show_alert=True)
         return
-
-    if lobby_data["state"] == "joining":
+    if status == "busy":
         await callback.answer("Хтось інший зараз приєднується. Зачекай.", show_alert=True)
         return
-        
-    lobby_data["state"] = "joining"
-    user_name = get_user_display_name(callback)
-    lobby_data["joining_user"] = {"id": user.id, "name": user_name}
-    
-    new_text = get_lobby_message_text(lobby_data, joining_user_name=user_name)
-    new_keyboard = create_lobby_keyboard(lobby_id, lobby_data)
 
-    await bot.edit_message_text(
-        text=new_text,
-        chat_id=lobby_data["chat_id"],
-        message_id=lobby_id,
-        reply_markup=new_keyboard,
-        parse_mode=ParseMode.HTML
-    )
+    _publish_lobby_state(bot, lobby_id, lobby_data)
     await callback.answer()
 
 @party_router.callback_query(F.data.startswith("party_select_role:"))
@@ -564,76 +603,55 @@ async def handle_join_role_selection(callback: CallbackQuery, bot: Bot):
     selected_role = parts[-1]
     user = callback.from_user
 
-    if lobby_id not in active_lobbies:
+    user_name = get_user_display_name(callback)
+    # ❗️ Отримуємо ранг гравця, що приєднався
+    user_rank = await _get_user_rank(user.id)
+    status, lobby_data = await lobby_store.complete_join(
+        callback.message.chat.id, lobby_id, user.id, selected_role,
+        {"name": user_name, "role": selected_role, "rank": user_rank},
+    )
+
+    if status == "missing":
         await callback.answer("Лобі не знайдено.", show_alert=True)
         return
-
-    lobby_data = active_lobbies[lobby_id]
-
-    if lobby_data.get("state") != "joining" or not lobby_data.get("joining_user") or lobby_data["joining_user"]["id"] != user.id:
+    if status == "not_turn":
         await callback.answer("Зараз не твоя черга приєднуватися.", show_alert=True)
         return
+    if status == "role_taken":
+        await callback.answer("Цю роль уже зайнято. Обери іншу.", show_alert=True)
+        return
+    if status == "full":
+        await callback.answer("Паті вже заповнено!", show_alert=True)
+        return
 
-    user_name = get_user_display_name(callback)
-    # ❗️ Отримуємо ранг гравця, що приєднався
-    user_rank = await _get_user_rank(user.id)
-    lobby_data["players"][user.id] = {"name": user_name, "role": selected_role, "rank": user_rank}
-    lobby_data["state"] = "open" 
-    lobby_data["joining_user"] = None
-    
     # ❗️ Перевіряємо, чи заповнилося лобі
     if len(lobby_data["players"]) >= lobby_data.get("party_size", 5):
         await notify_and_close_full_lobby(bot, lobby_id, lobby_data)
         await callback.answer(f"Ти приєднався до паті! Команда зібрана!", show_alert=True)
     else:
-        new_text = get_lobby_message_text(lobby_data)
-        new_keyboard = create_lobby_keyboard(lobby_id, lobby_data)
-        
-        await bot.edit_message_text(
-            text=new_text,
-            chat_id=lobby_data["chat_id"],
-            message_id=lobby_id,
-            reply_markup=new_keyboard,
-            parse_mode=ParseMode.HTML
-        )
+        _publish_lobby_state(bot, lobby_id, lobby_data)
         await callback.answer(f"Ти приєднався до паті з роллю: {selected_role}!", show_alert=True)
 
 @party_router.callback_query(F.data.startswith("party_leave:"))
 async def handle_leave_lobby(callback: CallbackQuery, bot: Bot):
     lobby_id = int(callback.data.split(":")[-1])
     user = callback.from_user
-    
-    if lobby_id not in active_lobbies:
+
+    status, lobby_data = await lobby_store.leave(callback.message.chat.id, lobby_id, user.id)
+
+    if status == "missing":
         await callback.answer("Цього лобі більше не існує.", show_alert=True)
         return
-
-    lobby_data = active_lobbies[lobby_id]
-    
-    if user.id not in lobby_data["players"]:
+    if status == "not_member":
         await callback.answer("Ти не є учасником цього паті.", show_alert=True)
         return
-        
-    if user.id == lobby_data["leader_id"]:
+    if status == "leader":
         await callback.answer("Лідер не може покинути паті. Тільки закрити його.", show_alert=True)
         return
-        
-    removed_player_info = lobby_data["players"].pop(user.id)
-    logger.info(f"Гравець {removed_player_info['name']} покинув лобі {lobby_id}")
-    
-    new_text = get_lobby_message_text(lobby_data)
-    new_keyboard = create_lobby_keyboard(lobby_id, lobby_data)
-    try:
-        await bot.edit_message_text(
-            text=new_text,
-            chat_id=lobby_data["chat_id"],
-            message_id=lobby_id,
-            reply_markup=new_keyboard,
-            parse_mode=ParseMode.HTML
-        )
-        await callback.answer("Ти покинув паті.", show_alert=True)
-    except TelegramAPIError as e:
-        logger.error(f"Не вдалося оновити повідомлення лобі {lobby_id} після виходу гравця: {e}")
-        lobby_data["players"][user.id] = removed_player_info
+
+    logger.info(f"Гравець {user.id} покинув лобі {lobby_id}")
+    await callback.answer("Ти покинув паті.", show_alert=True)
+    _publish_lobby_state(bot, lobby_id, lobby_data)
 
 @party_router.callback_query(F.data.startswith("party_cancel_lobby:"))
 async def handle_cancel_lobby(callback: CallbackQuery, bot: Bot):
@@ -641,59 +659,200 @@ async def handle_cancel_lobby(callback: CallbackQuery, bot: Bot):
     user = callback.from_user
     user_name = get_user_display_name(callback)
 
-    if lobby_id not in active_lobbies:
+    status, lobby_data = await lobby_store.close(callback.message.chat.id, lobby_id, by_user_id=user.id)
+
+    if status == "missing":
         await callback.answer("Цього лобі більше не існує.", show_alert=True)
         return
-
-    lobby_data = active_lobbies[lobby_id]
-    
-    if user.id != lobby_data["leader_id"]:
+    if status == "forbidden":
         await callback.answer("Тільки лідер паті може закрити лобі.", show_alert=True)
         return
-        
-    del active_lobbies[lobby_id]
+
     logger.info(f"Лобі {lobby_id} скасовано лідером {user_name}")
     
-    try:
-        await bot.edit_message_text(
-            text="🚫 <b>Лобі закрито ініціатором.</b>",
-            chat_id=lobby_data["chat_id"],
-            message_id=lobby_id,
-            reply_markup=None,
-            parse_mode=ParseMode.HTML
-        )
-        await callback.answer("Лобі успішно закрито.", show_alert=True)
-    except TelegramAPIError as e:
-        logger.error(f"Не вдалося оновити повідомлення при скасуванні лобі {lobby_id}: {e}")
+    _publish_closed_lobby(bot, lobby_data["chat_id"], lobby_id, "🚫 <b>Лобі закрито ініціатором.</b>")
+    await callback.answer("Лобі успішно закрито.", show_alert=True)
 
 @party_router.callback_query(F.data.startswith("party_cancel_join:"))
 async def cancel_join_selection(callback: CallbackQuery, bot: Bot):
     lobby_id = int(callback.data.split(":")[1])
     user = callback.from_user
 
-    if lobby_id not in active_lobbies:
+    status, lobby_data = await lobby_store.cancel_join(callback.message.chat.id, lobby_id, user.id)
+
+    if status == "missing":
         await callback.answer("Лобі не знайдено.", show_alert=True)
         return
-        
-    lobby_data = active_lobbies[lobby_id]
-    
-    if (lobby_data["state"] == "joining" and lobby_data["joining_user"]["id"] == user.id) or (lobby_data["leader_id"] == user.id):
-        lobby_data["state"] = "open"
-        lobby_data["joining_user"] = None
-        
-        new_text = get_lobby_message_text(lobby_data)
-        new_keyboard = create_lobby_keyboard(lobby_id, lobby_data)
-        
-        await bot.edit_message_text(
-            text=new_text,
-            chat_id=lobby_data["chat_id"],
-            message_id=lobby_id,
-            reply_markup=new_keyboard,
-            parse_mode=ParseMode.HTML
-        )
-        await callback.answer("Приєднання скасовано.")
-    else:
+    if status == "forbidden":
         await callback.answer("Ти не можеш скасувати цю дію.", show_alert=True)
+        return
+
+    _publish_lobby_state(bot, lobby_id, lobby_data)
+    await callback.answer("Приєднання скасовано.")
+
+
+# === МАТЧМЕЙКІНГ: /party ===
+
+GAME_MODE_ALIASES = {
+    "ranked": "Ranked", "ранк": "Ranked", "рейт": "Ranked", "рейтинг": "Ranked",
+    "classic": "Classic", "класика": "Classic",
+    "brawl": "Brawl", "бій": "Brawl", "бої": "Brawl",
+}
+
+
+def _lobby_message_link(chat_id: int, chat_username: str | None, lobby_id: int) -> str:
+    """Посилання на повідомлення лобі (для приватних супергруп — лише для їхніх учасників)."""
+    if chat_username:
+        return f"https://t.me/{chat_username}/{lobby_id}"
+    return f"https://t.me/c/{str(chat_id).replace('-100', '')}/{lobby_id}"
+
+
+@party_router.message(Command("party"))
+async def suggest_open_lobbies(message: Message, command: CommandObject):
+    """
+    /party [роль] [режим] — відкриті лобі, яким бракує ролі гравця, близькі за рангом.
+    Кандидати беруться з matchmaking_index без запитів до сховища; перед показом
+    кожен перевіряється в lobby_store (лобі могло заповнитися на іншому воркері).
+    """
+    if not message.from_user:
+        return
+    user_id = message.from_user.id
+
+    roles, game_mode = [], None
+    for token in (command.args or "").split():
+        if token.upper() in ALL_ROLES:
+            roles.append(token.upper())
+        elif token.lower() in GAME_MODE_ALIASES:
+            game_mode = GAME_MODE_ALIASES[token.lower()]
+
+    user_rank = await _get_user_rank(user_id)
+    band = rank_band(user_rank)
+    candidates = matchmaking_index.suggest(
+        message.chat.id, roles=roles, band=band, game_mode=game_mode, limit=PARTY_MATCH_SUGGESTIONS * 2
+    )
+    lobbies = await asyncio.gather(*(lobby_store.get(chat_id, lobby_id) for chat_id, lobby_id in candidates))
+
+    lines = []
+    for (chat_id, lobby_id), lobby_data in zip(candidates, lobbies):
+        if lobby_data is None:
+            # Лобі прострочилося або закрилося на іншому воркері
+            matchmaking_index.remove(chat_id, lobby_id)
+            continue
+        if user_id in lobby_data["players"]:
+            continue
+        needed = [role for role in missing_roles(lobby_data) if not roles or role in roles]
+        if not needed:
+            continue
+        link = _lobby_message_link(chat_id, lobby_data.get("chat_username"), lobby_id)
+        title = html.escape(lobby_data.get("chat_title") or "цей чат")
+        leader = lobby_data["players"].get(lobby_data["leader_id"], {})
+        lines.append(
+            f"{len(lines) + 1}. <a href='{link}'>{title}</a> — {GAME_MODE_NAMES.get(lobby_data.get('game_mode'), '')}\n"
+            f"   шукають: <b>{', '.join(needed)}</b>, "
+            f"лідер {html.escape(lobby_data['leader_name'])} (<i>{html.escape(leader.get('rank', 'невідомий'))}</i>)"
+        )
+        if len(lines) >= PARTY_MATCH_SUGGESTIONS:
+            break
+
+    if not lines:
+        await message.reply(
+            "😔 Зараз немає відкритих лобі під твою роль.\n"
+            "Напиши в чаті «го паті», щоб зібрати власну команду!"
+        )
+        return
+
+    band_name = RANK_BANDS[band][0] if band is not None else "будь-який ранг"
+    await message.reply(
+        f"🎯 <b>Відкриті лобі для тебе</b> ({band_name}):\n\n" + "\n".join(lines)
+        + "\n\n<i>Переходь за посиланням і тисни «➕ Увійти».</i>",
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True,
+    )
+
+
+# === ПРИБИРАННЯ ПОКИНУТИХ ЛОБІ ===
+
+IDLE_LOBBY_SWEEP_BATCH = 100
+
+
+def _process_rss_bytes() -> int:
+    """Поточний RSS процесу (Linux /proc), або пік RSS, якщо /proc недоступний."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def get_lobby_stats() -> dict[str, Any]:
+    """Кількість живих лобі, черга редагувань та пам'ять воркера (для логів sweeper'а)."""
+    editor = lobby_message_editor.stats()
+    return {
+        "live_lobbies": await lobby_store.count(),
+        "tracked_messages": editor["tracked"],
+        "pending_edits": editor["pending"],
+        "edits_sent": editor["sent"],
+        "edits_coalesced": editor["coalesced"] + editor["skipped"],
+        "matchmaking_lobbies": len(matchmaking_index),
+        "rss_mb": round(_process_rss_bytes() / 1024 / 1024, 1),
+    }
+
+
+async def sweep_idle_lobbies(bot: Bot) -> int:
+    """
+    Закриває лобі без активності довше за PARTY_LOBBY_IDLE_TIMEOUT_SECONDS:
+    видаляє їх зі сховища й редагує повідомлення на "закрито".
+    Закриття атомарне, тож при кількох воркерах кожне лобі закриває лише один.
+    """
+    closed = 0
+    try:
+        while True:
+            idle_before = time.time() - PARTY_LOBBY_IDLE_TIMEOUT_SECONDS
+            idle = await lobby_store.idle_lobbies(PARTY_LOBBY_IDLE_TIMEOUT_SECONDS, limit=IDLE_LOBBY_SWEEP_BATCH)
+            settled = 0
+            for chat_id, lobby_id in idle:
+                status, _ = await lobby_store.close(chat_id, lobby_id, idle_before=idle_before)
+                if status == "missing":
+                    # Ключ уже прострочений за TTL; close() прибрав його з індексу
+                    matchmaking_index.remove(chat_id, lobby_id)
+                    settled += 1
+                if status != "ok":
+                    continue
+                settled += 1
+                closed += 1
+                _publish_closed_lobby(bot, chat_id, lobby_id, "⌛ <b>Лобі закрито через неактивність.</b>")
+            # Повна партія, у якій нічого не закрилося, означає, що лишилися тільки активні лобі
+            if len(idle) < IDLE_LOBBY_SWEEP_BATCH or not settled:
+                break
+    except Exception as e:
+        logger.error(f"Помилка під час прибирання неактивних лобі: {e}", exc_info=True)
+
+    lobby_message_editor.purge_expired()
+    # Підхоплюємо лобі, відкриті іншими воркерами
+    await matchmaking_index.sync()
+    stats = await get_lobby_stats()
+    log = logger.info if closed else logger.debug
+    log(
+        f"Lobby sweep: closed {closed} idle, {stats['live_lobbies']} live "
+        f"({stats['matchmaking_lobbies']} open for matchmaking), "
+        f"{stats['tracked_messages']} tracked messages, {stats['pending_edits']} pending edits "
+        f"({stats['edits_sent']} sent, {stats['edits_coalesced']} coalesced), RSS {stats['rss_mb']} MB."
+    )
+    return closed
+
+
+def schedule_lobby_sweeper(scheduler: AsyncIOScheduler, bot: Bot) -> None:
+    """Додає до планувальника періодичне прибирання неактивних лобі."""
+    scheduler.add_job(
+        sweep_idle_lobbies,
+        "interval",
+        seconds=PARTY_LOBBY_SWEEP_INTERVAL_SECONDS,
+        args=[bot],
+        id="party_lobby_sweeper",
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True,
+    )
 
 
 # === РЕЄСТРАЦІЯ ОБРОБНИКІВ ===
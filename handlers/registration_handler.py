@@ -4,7 +4,6 @@
 """
 import html
 import base64
-from pathlib import Path
 from typing import Any
 
 from aiogram import Bot, F, Router
@@ -22,30 +21,20 @@ from keyboards.inline_keyboards import (
 from services.openai_service import MLBBChatGPT
 from database.crud import (
     add_or_update_user,
-    get_user_by_telegram_id,
+    get_user_profile_card,
     delete_user_by_telegram_id,
 )
 from utils.file_manager import file_resilience_manager
-from utils.cache_manager import clear_user_cache
+from utils.cache_manager import clear_user_cache, warm_user_rank
+from prompts.loader import prompt_registry
 from config import OPENAI_API_KEY, logger
 
 registration_router = Router()
 
-# --- 🚀 Завантаження промптів з файлів ---
-try:
-    PROMPTS_DIR = Path(__file__).parent.parent / "prompts"
-    with open(PROMPTS_DIR / "profile.txt", "r", encoding="utf-8") as f:
-        PROFILE_PROMPT = f.read()
-    with open(PROMPTS_DIR / "player_stats.txt", "r", encoding="utf-8") as f:
-        STATS_PROMPT = f.read()
-    with open(PROMPTS_DIR / "hero_stats.txt", "r", encoding="utf-8") as f:
-        HEROES_PROMPT = f.read()
-    logger.info("✅ Промпти для реєстрації (profile, stats, heroes) успішно завантажено.")
-except FileNotFoundError as e:
-    logger.error(f"❌ Не вдалося знайти файл з промптом для реєстрації: {e}")
-    PROFILE_PROMPT = "Analyze profile screenshot."
-    STATS_PROMPT = "Analyze player statistics screenshot."
-    HEROES_PROMPT = "Analyze favorite heroes screenshot."
+# --- 🚀 Промпти з реєстру (оновлюються без перезапуску) ---
+PROFILE_PROMPT_FALLBACK = "Analyze profile screenshot."
+STATS_PROMPT_FALLBACK = "Analyze player statistics screenshot."
+HEROES_PROMPT_FALLBACK = "Analyze favorite heroes screenshot."
 
 
 def format_profile_display(user_data: dict[str, Any]) -> str:
@@ -165,7 +154,7 @@ async def show_profile_carousel(
     page_index: int,
 ) -> None:
     """Оновлює карусель профілю."""
-    user_data = await get_user_by_telegram_id(user_id) or {}
+    user_data = await get_user_profile_card(user_id) or {}
     pages = await build_profile_pages(user_data)
     if not pages:
         return
@@ -212,7 +201,7 @@ async def show_profile_menu(
         except TelegramAPIError:
             pass
 
-    user_data = await get_user_by_telegram_id(user_id)
+    user_data = await get_user_profile_card(user_id)
     if not user_data:
         await bot.send_message(chat_id, "Не знайдено профіль. Використайте /profile.")
         return
@@ -248,7 +237,7 @@ async def cmd_profile(message: Message, state: FSMContext, bot: Bot) -> None:
         pass
 
     await state.clear()
-    user_data = await get_user_by_telegram_id(uid)
+    user_data = await get_user_profile_card(uid)
     if user_data and user_data.get("basic_profile_permanent_url"):
         await show_profile_menu(bot, cid, uid)
     else:
@@ -343,9 +332,9 @@ async def handle_profile_update_photo(
     # Визначаємо режим: basic / stats / heroes
     current_fsm_state = await state.get_state()
     mode_map = {
-        RegistrationFSM.waiting_for_basic_photo.state: ("basic", PROFILE_PROMPT),
-        RegistrationFSM.waiting_for_stats_photo.state: ("stats", STATS_PROMPT),
-        RegistrationFSM.waiting_for_heroes_photo.state: ("heroes", HEROES_PROMPT),
+        RegistrationFSM.waiting_for_basic_photo.state: ("basic", prompt_registry.get_text("profile", PROFILE_PROMPT_FALLBACK)),
+        RegistrationFSM.waiting_for_stats_photo.state: ("stats", prompt_registry.get_text("player_stats", STATS_PROMPT_FALLBACK)),
+        RegistrationFSM.waiting_for_heroes_photo.state: ("heroes", prompt_registry.get_text("hero_stats", HEROES_PROMPT_FALLBACK)),
     }
     mode_info = mode_map.get(current_fsm_state)
     if not mode_info or not last_id:
@@ -421,6 +410,9 @@ async def handle_profile_update_photo(
         if status == "success":
             # Очистити кеш користувача, щоб брало свіжі дані
             await clear_user_cache(uid)
+            if "current_rank" in payload:
+                # Новий ранг одразу в кеш: приєднання до лобі не піде в БД
+                await warm_user_rank(uid, payload["current_rank"])
             await show_profile_menu(bot, cid, uid, message_to_delete_id=thinking.message_id)
         elif status == "conflict":
             await thinking.edit_text(
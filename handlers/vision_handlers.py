@@ -10,7 +10,6 @@ import logging
 import random
 import re
 from typing import Any, Coroutine, Callable
-from pathlib import Path
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
@@ -21,6 +20,7 @@ from aiogram.types import (CallbackQuery, InlineKeyboardButton,
                            InlineKeyboardMarkup, Message)
 
 from config import OPENAI_API_KEY
+from prompts.loader import prompt_registry
 from services.openai_service import MLBBChatGPT
 from states.vision_states import VisionAnalysisStates
 from utils.message_utils import (MAX_TELEGRAM_MESSAGE_LENGTH,
@@ -28,19 +28,9 @@ from utils.message_utils import (MAX_TELEGRAM_MESSAGE_LENGTH,
 
 logger = logging.getLogger(__name__)
 
-# --- 🚀 Завантаження промптів з файлів ---
-try:
-    PROMPTS_DIR = Path(__file__).parent.parent / "prompts"
-    with open(PROMPTS_DIR / "profile.txt", "r", encoding="utf-8") as f:
-        PROFILE_SCREENSHOT_PROMPT = f.read()
-    with open(PROMPTS_DIR / "player_stats.txt", "r", encoding="utf-8") as f:
-        PLAYER_STATS_PROMPT = f.read()
-    logger.info("✅ Промпти для Vision API успішно завантажено.")
-except FileNotFoundError as e:
-    logger.error(f"❌ Не вдалося знайти файл з промптом: {e}")
-    # Встановлюємо заглушки, щоб уникнути падіння при старті
-    PROFILE_SCREENSHOT_PROMPT = "Analyze profile screenshot."
-    PLAYER_STATS_PROMPT = "Analyze player statistics screenshot."
+# --- 🚀 Промпти з реєстру (оновлюються без перезапуску) ---
+PROFILE_SCREENSHOT_PROMPT_FALLBACK = "Analyze profile screenshot."
+PLAYER_STATS_PROMPT_FALLBACK = "Analyze player statistics screenshot."
 
 
 PROCESSING_MESSAGES: list[str] = [
@@ -173,7 +163,7 @@ async def cmd_analyze_profile(message: Message, state: FSMContext) -> None:
     
     await state.update_data(
         analysis_type="profile",
-        vision_prompt=PROFILE_SCREENSHOT_PROMPT,
+        vision_prompt=prompt_registry.get_text("profile", PROFILE_SCREENSHOT_PROMPT_FALLBACK),
         original_user_name=user_first_name # Зберігаємо не-екрановане ім'я для внутрішнього використання
     )
     await state.set_state(VisionAnalysisStates.awaiting_profile_screenshot)
@@ -197,7 +187,7 @@ async def cmd_analyze_player_stats(message: Message, state: FSMContext) -> None:
 
     await state.update_data(
         analysis_type="player_stats",
-        vision_prompt=PLAYER_STATS_PROMPT,
+        vision_prompt=prompt_registry.get_text("player_stats", PLAYER_STATS_PROMPT_FALLBACK),
         original_user_name=user_first_name
     )
     await state.set_state(VisionAnalysisStates.awaiting_profile_screenshot)
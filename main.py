@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import os
+import time
 import greenlet  # ❗️ Гарантуємо, що greenlet завантажено
 from datetime import datetime, timezone, timedelta
 
@@ -8,16 +9,27 @@ from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from aiogram.exceptions import TelegramAPIError
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 # Імпорти з проєкту
-from config import TELEGRAM_BOT_TOKEN, ADMIN_USER_ID, logger, ASYNC_DATABASE_URL
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy import text
+from config import (
+    TELEGRAM_BOT_TOKEN, ADMIN_USER_ID, logger,
+    PROMPT_RELOAD_INTERVAL_SECONDS,
+)
 
 # ❗️ НОВЕ: Імпортуємо модуль з моделями ДО ініціалізації БД
 # Це гарантує, що SQLAlchemy Base знає про всі таблиці, які потрібно створити.
 import database.models
+from database.engine import dispose_engine
 from database.init_db import init_db
+from prompts.loader import prompt_registry
+from utils.write_behind import chat_history_writer
+from utils.local_cache import cache_invalidator
+from utils.session_memory import start_session_sweeper, stop_session_sweeper
+from utils.redis_client import check_redis_health, close_redis
+from utils.fsm_storage import create_fsm_storage
+from utils.chat_retention import start_chat_pruner, stop_chat_pruner
+from utils.matchmaking import matchmaking_index
 from handlers.general_handlers import (
     register_general_handlers, 
     set_bot_commands,
@@ -25,77 +37,36 @@ from handlers.general_handlers import (
     cmd_go
 )
 # ❗️ НОВІ ІМПОРТИ
-from handlers.party_handler import register_party_handlers
+from handlers.party_handler import (
+    lobby_message_editor,
+    party_dm_fanout,
+    register_party_handlers,
+    schedule_lobby_sweeper,
+)
 from handlers.vision_handlers import register_vision_handlers
 from handlers.registration_handler import register_registration_handlers
 from handlers.user_settings_handler import register_settings_handlers
 from games.reaction.handlers import register_reaction_handlers
 
 
-async def sanitize_database():
-    """
-    Одноразова функція для очищення бази даних від дублікатів player_id.
-    """
-    logger.info("🩺 Starting database sanitization process...")
-    engine = create_async_engine(ASYNC_DATABASE_URL)
-    async with engine.connect() as conn:
-        try:
-            async with conn.begin():
-                find_duplicates_sql = text("""
-                    SELECT player_id, COUNT(*)
-                    FROM users
-                    GROUP BY player_id
-                    HAVING COUNT(*) > 1
-                """)
-                duplicates_result = await conn.execute(find_duplicates_sql)
-                duplicate_player_ids = [row[0] for row in duplicates_result.all()]
-
-                if not duplicate_player_ids:
-                    logger.info("✅ No duplicate player_id found. Database is clean.")
-                else:
-                    logger.warning(f"Found duplicate player_ids: {duplicate_player_ids}. Proceeding with cleanup...")
-                    cleanup_sql = text("""
-                        DELETE FROM users
-                        WHERE ctid IN (
-                            SELECT ctid
-                            FROM (
-                                SELECT 
-                                    ctid,
-                                    ROW_NUMBER() OVER(PARTITION BY player_id ORDER BY created_at DESC) as rn
-                                FROM users
-                                WHERE player_id = ANY(:player_ids)
-                            ) as sub
-                            WHERE rn > 1
-                        )
-                    """)
-                    result = await conn.execute(cleanup_sql, {"player_ids": duplicate_player_ids})
-                    logger.info(f"✅ Successfully deleted {result.rowcount} duplicate user entries.")
-
-            async with conn.begin():
-                logger.info("Attempting to create unique index on 'player_id' after sanitization...")
-                add_unique_index_sql = text("CREATE UNIQUE INDEX IF NOT EXISTS uq_users_player_id ON users (player_id)")
-                await conn.execute(add_unique_index_sql)
-                logger.info("✅ Successfully ensured unique index exists for 'player_id'.")
-
-        except Exception as e:
-            logger.error(f"❌ Critical error during database sanitization: {e}", exc_info=True)
-        finally:
-            await conn.close()
-
-    await engine.dispose()
-    logger.info("🩺 Database sanitization process finished.")
-
-
 async def main() -> None:
     """Головна функція запуску бота."""
+    started = time.perf_counter()
     bot_version = "v4.4.0 (Party Refactor)"
     logger.info(f"🚀 Запуск MLBB IUI mini {bot_version}... (PID: {os.getpid()})")
 
-    await sanitize_database()
-    await init_db()
+    # Санітизація player_id тепер одноразова міграція (database/migrations.py)
+    try:
+        await init_db()
+    except Exception as e:
+        # Без актуальної схеми бот не стартує; менеджер процесів перезапустить дино
+        logger.critical(f"❌ Database initialization failed, bot is not started: {e}", exc_info=True)
+        await dispose_engine()
+        raise SystemExit(1) from e
 
     bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
+    dp = Dispatcher(storage=create_fsm_storage())
+    scheduler = AsyncIOScheduler()
 
     await set_bot_commands(bot)
 
@@ -140,7 +111,18 @@ async def main() -> None:
             except Exception as e:
                 logger.warning(f"Не вдалося надіслати повідомлення про запуск адміну (ID: {ADMIN_USER_ID}): {e}", exc_info=True)
 
-        logger.info("Розпочинаю polling...")
+        if not await check_redis_health():
+            logger.warning("⚠️ Redis недоступний: кеш і сесії працюватимуть у резервному режимі.")
+        prompt_registry.start_watching(PROMPT_RELOAD_INTERVAL_SECONDS)
+        await chat_history_writer.start()
+        cache_invalidator.start()
+        start_session_sweeper()
+        start_chat_pruner()
+        await matchmaking_index.start()
+        schedule_lobby_sweeper(scheduler, bot)
+        scheduler.start()
+
+        logger.info(f"Розпочинаю polling... (time-to-polling: {(time.perf_counter() - started) * 1000:.0f} ms)")
         await bot.delete_webhook(drop_pending_updates=True)
         await dp.start_polling(bot)
     except KeyboardInterrupt:
@@ -149,6 +131,21 @@ async def main() -> None:
         logger.critical(f"Непередбачена критична помилка під час запуску або роботи: {e}", exc_info=True)
     finally:
         logger.info("🛑 Зупинка бота та закриття сесій...")
+        await prompt_registry.stop_watching()
+        # Скидаємо в БД усе, що ще не встигло записатися з буфера write-behind
+        await chat_history_writer.stop()
+        await cache_invalidator.stop()
+        await stop_session_sweeper()
+        await stop_chat_pruner()
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        # Дописуємо відкладені редагування лобі та розсилки, поки сесія бота ще відкрита
+        await lobby_message_editor.stop()
+        await party_dm_fanout.stop()
+        await matchmaking_index.stop()
+        # Після фінального flush буферів Redis більше не потрібен
+        await close_redis()
+        await dispose_engine()
         if bot and hasattr(bot, 'session') and bot.session and not bot.session.closed:
             try:
                 await bot.session.close()
@@ -1,64 +1,251 @@
 """
 Завантажувач для Бібліотеки Промптів.
 
-Цей модуль сканує директорію prompts/library, завантажує всі .yaml файли
-і компілює їх в єдиний словник для легкого доступу в усьому застосунку.
+Цей модуль збирає всі промпти застосунку в єдиний реєстр:
+- .yaml файли з prompts/library (фрагменти для PromptDirector);
+- .txt файли з prompts/ (промпти для Vision-аналізу та реєстрації).
+
+Для швидкого старту реєстр зберігає скомпільований знімок бібліотеки (pickle),
+прив'язаний до хешів вихідних файлів. Під час роботи реєстр може відстежувати
+зміни у файлах і атомарно підміняти бібліотеку без перезапуску бота.
 """
-import yaml
+import asyncio
+import hashlib
 import logging
+import pickle
 from pathlib import Path
 from typing import Any, Dict
 
+import yaml
+
+try:
+    # C-реалізація парсера (libyaml) у рази швидша за чистий Python
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
 # Налаштовуємо логер для цього модуля
 logger = logging.getLogger(__name__)
 
-# Визначаємо шлях до директорії з бібліотекою промптів
-PROMPTS_LIBRARY_PATH = Path(__file__).parent / "library"
+# Визначаємо шляхи до промптів та до скомпільованого знімка
+PROMPTS_ROOT_PATH = Path(__file__).parent
+PROMPTS_LIBRARY_PATH = PROMPTS_ROOT_PATH / "library"
+PROMPTS_SNAPSHOT_PATH = PROMPTS_ROOT_PATH / ".cache" / "library.pickle"
+SNAPSHOT_FORMAT_VERSION = 1
 
-def load_prompt_library() -> Dict[str, Any]:
-    """
-    Сканує директорію prompts/library, завантажує вміст усіх .yaml файлів
-    і повертає їх у вигляді єдиного словника.
 
-    Ключами верхнього рівня у словнику будуть назви файлів без розширення
-    (наприклад, 'personas', 'intents').
+class PromptRegistry:
+    """
+    Реєстр промптів зі скомпільованим знімком та гарячим перезавантаженням.
 
-    Returns:
-        Словник з усіма завантаженими фрагментами промптів.
-        Повертає порожній словник, якщо директорія не знайдена або порожня.
+    Увесь стан зберігається в одному словнику, тому підміна бібліотеки —
+    це одне присвоєння посилання: читачі бачать або стару, або нову версію.
     """
-    if not PROMPTS_LIBRARY_PATH.is_dir():
-        logger.error(f"Директорія бібліотеки промптів не знайдена: {PROMPTS_LIBRARY_PATH}")
-        return {}
 
-    prompt_library: Dict[str, Any] = {}
-    yaml_files = list(PROMPTS_LIBRARY_PATH.glob("*.yaml"))
+    def __init__(
+        self,
+        library_path: Path = PROMPTS_LIBRARY_PATH,
+        texts_path: Path = PROMPTS_ROOT_PATH,
+        snapshot_path: Path = PROMPTS_SNAPSHOT_PATH,
+    ):
+        self._library_path = library_path
+        self._texts_path = texts_path
+        self._snapshot_path = snapshot_path
+        self._state: Dict[str, Any] = {"library": {}, "texts": {}}
+        self._fingerprint: tuple = ()
+        self._watch_task: asyncio.Task | None = None
 
-    if not yaml_files:
-        logger.warning(f"У директорії {PROMPTS_LIBRARY_PATH} не знайдено жодного .yaml файлу.")
-        return {}
+    @property
+    def library(self) -> Dict[str, Any]:
+        """Поточна бібліотека YAML-фрагментів (ключ — назва файлу без розширення)."""
+        return self._state["library"]
 
-    logger.info(f"Завантаження бібліотеки промптів з {len(yaml_files)} файлів...")
+    def get_text(self, name: str, default: str = "") -> str:
+        """Повертає текстовий промпт (prompts/<name>.txt) або значення за замовчуванням."""
+        return self._state["texts"].get(name) or default
 
-    for file_path in yaml_files:
-        # Назва файлу без розширення буде ключем у словнику
-        library_key = file_path.stem
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = yaml.safe_load(f)
-                if data:
-                    prompt_library[library_key] = data
-                    logger.info(f"  ✅ Файл '{file_path.name}' успішно завантажено в ключ '{library_key}'.")
-                else:
+    # --- Завантаження ---
+
+    def _source_files(self) -> list[Path]:
+        """Повертає відсортований список усіх файлів, з яких складається реєстр."""
+        files: list[Path] = []
+        if self._library_path.is_dir():
+            files.extend(sorted(self._library_path.glob("*.yaml")))
+        else:
+            logger.error(f"Директорія бібліотеки промптів не знайдена: {self._library_path}")
+        if self._texts_path.is_dir():
+            files.extend(sorted(self._texts_path.glob("*.txt")))
+        return files
+
+    @staticmethod
+    def _stat_fingerprint(files: list[Path]) -> tuple:
+        """Дешевий відбиток (mtime + розмір) для виявлення змін без читання файлів."""
+        fingerprint = []
+        for path in files:
+            try:
+                stat = path.stat()
+                fingerprint.append((str(path), stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                continue
+        return tuple(fingerprint)
+
+    @staticmethod
+    def _digest(raw_files: dict[Path, bytes]) -> str:
+        """Хеш вмісту всіх файлів, до якого прив'язується знімок."""
+        hasher = hashlib.sha256(f"v{SNAPSHOT_FORMAT_VERSION}".encode())
+        for path, content in raw_files.items():
+            hasher.update(path.name.encode("utf-8"))
+            hasher.update(hashlib.sha256(content).digest())
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _compile(raw_files: dict[Path, bytes]) -> tuple[Dict[str, Any], list[str]]:
+        """
+        Парсить та валідує вихідні файли.
+
+        Returns:
+            Кортеж (скомпільований стан, список файлів з помилками).
+        """
+        library: Dict[str, Any] = {}
+        texts: Dict[str, str] = {}
+        errors: list[str] = []
+
+        for file_path, content in raw_files.items():
+            # Назва файлу без розширення буде ключем у словнику
+            key = file_path.stem
+            try:
+                text = content.decode("utf-8")
+                if file_path.suffix == ".txt":
+                    if text.strip():
+                        texts[key] = text
+                    else:
+                        logger.warning(f"  ⚠️ Текстовий промпт '{file_path.name}' порожній.")
+                    continue
+
+                data = yaml.load(text, Loader=_YamlLoader)
+                if not data:
                     logger.warning(f"  ⚠️ Файл '{file_path.name}' порожній або містить невалідний YAML.")
-        except yaml.YAMLError as e:
-            logger.error(f"  ❌ Помилка парсингу YAML у файлі '{file_path.name}': {e}", exc_info=True)
+                elif not isinstance(data, dict):
+                    logger.error(f"  ❌ Файл '{file_path.name}' має містити словник верхнього рівня.")
+                    errors.append(file_path.name)
+                else:
+                    library[key] = data
+            except (yaml.YAMLError, UnicodeDecodeError) as e:
+                logger.error(f"  ❌ Помилка парсингу файлу '{file_path.name}': {e}", exc_info=True)
+                errors.append(file_path.name)
+
+        return {"library": library, "texts": texts}, errors
+
+    def _read_snapshot(self, digest: str) -> Dict[str, Any] | None:
+        """Повертає скомпільований стан зі знімка, якщо він відповідає поточним файлам."""
+        try:
+            with open(self._snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return None
         except Exception as e:
-            logger.error(f"  ❌ Не вдалося прочитати або обробити файл '{file_path.name}': {e}", exc_info=True)
+            logger.warning(f"Не вдалося прочитати знімок бібліотеки промптів: {e}")
+            return None
+
+        if snapshot.get("version") != SNAPSHOT_FORMAT_VERSION or snapshot.get("digest") != digest:
+            return None
+        return snapshot.get("compiled")
+
+    def _write_snapshot(self, digest: str, compiled: Dict[str, Any]) -> None:
+        """Атомарно записує знімок (через тимчасовий файл)."""
+        try:
+            self._snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._snapshot_path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    {"version": SNAPSHOT_FORMAT_VERSION, "digest": digest, "compiled": compiled},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            tmp_path.replace(self._snapshot_path)
+        except OSError as e:
+            # Файлова система може бути лише для читання — це не критично
+            logger.debug(f"Не вдалося записати знімок бібліотеки промптів: {e}")
+
+    def load(self, *, strict: bool = False) -> bool:
+        """
+        Завантажує реєстр зі знімка або компілює його з вихідних файлів.
+
+        Args:
+            strict: Якщо True, бібліотека не підміняється при помилках валідації
+                    (використовується під час гарячого перезавантаження).
+
+        Returns:
+            True, якщо стан реєстру було оновлено.
+        """
+        files = self._source_files()
+        fingerprint = self._stat_fingerprint(files)
+
+        raw_files: dict[Path, bytes] = {}
+        for file_path in files:
+            try:
+                raw_files[file_path] = file_path.read_bytes()
+            except OSError as e:
+                logger.error(f"  ❌ Не вдалося прочитати файл '{file_path.name}': {e}", exc_info=True)
+
+        digest = self._digest(raw_files)
+        compiled = self._read_snapshot(digest)
+        if compiled is not None:
+            logger.info(f"✅ Бібліотеку промптів завантажено зі знімка ({len(raw_files)} файлів).")
+        else:
+            logger.info(f"Компіляція бібліотеки промптів з {len(raw_files)} файлів...")
+            compiled, errors = self._compile(raw_files)
+            if errors:
+                if strict:
+                    logger.error(f"❌ Бібліотеку промптів не оновлено через помилки у файлах: {errors}")
+                    # Запам'ятовуємо відбиток, щоб не повторювати невдалу спробу до наступної зміни
+                    self._fingerprint = fingerprint
+                    return False
+            else:
+                self._write_snapshot(digest, compiled)
+            logger.info("✅ Бібліотека промптів успішно скомпільована.")
+
+        self._state = compiled
+        self._fingerprint = fingerprint
+        return True
+
+    # --- Гаряче перезавантаження ---
+
+    async def _watch(self, interval: float) -> None:
+        """Періодично перевіряє файли та перезавантажує реєстр при змінах."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                fingerprint = self._stat_fingerprint(self._source_files())
+                if fingerprint != self._fingerprint:
+                    logger.info("🔄 Виявлено зміни в бібліотеці промптів. Перезавантаження...")
+                    self.load(strict=True)
+            except Exception as e:
+                logger.error(f"Помилка під час перевірки бібліотеки промптів: {e}", exc_info=True)
+
+    def start_watching(self, interval: float) -> None:
+        """Запускає фонове відстеження змін у файлах промптів."""
+        if interval <= 0 or (self._watch_task and not self._watch_task.done()):
+            return
+        self._watch_task = asyncio.create_task(self._watch(interval))
+        logger.info(f"👀 Відстеження змін бібліотеки промптів увімкнено (інтервал {interval} с).")
+
+    async def stop_watching(self) -> None:
+        """Зупиняє фонове відстеження змін."""
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
 
-    logger.info("✅ Бібліотека промптів успішно завантажена.")
-    return prompt_library
+# Завантажуємо реєстр один раз при імпорті модуля,
+# щоб він був доступний як глобальний об'єкт.
+prompt_registry = PromptRegistry()
+prompt_registry.load()
 
-# Завантажуємо бібліотеку один раз при імпорті модуля,
-# щоб вона була доступна як глобальна змінна.
-PROMPT_LIBRARY = load_prompt_library()
+# Знімок бібліотеки на момент старту (для сумісності).
+# Для актуальної версії використовуйте prompt_registry.library.
+PROMPT_LIBRARY = prompt_registry.library
@@ -6,7 +6,7 @@ import yaml
 from typing import Any, Dict, List
 
 from config import logger
-from prompts.loader import PROMPT_LIBRARY
+from prompts.loader import PromptRegistry, prompt_registry
 from services.context_engine import ContextVector, Intent
 
 class PromptDirector:
@@ -14,15 +14,20 @@ class PromptDirector:
     Клас, що відповідає за динамічну збірку системних промптів
     з модульних фрагментів на основі вхідного контексту.
     """
-    def __init__(self, prompt_library: Dict[str, Any]):
+    def __init__(self, registry: PromptRegistry):
         """
-        Ініціалізує директора, передаючи йому завантажену бібліотеку промптів.
+        Ініціалізує директора, передаючи йому реєстр промптів.
         """
-        if not prompt_library:
+        if not registry.library:
             logger.error("PromptDirector ініціалізовано з порожньою бібліотекою промптів!")
-        self.library = prompt_library
+        self.registry = registry
         logger.info("✅ PromptDirector ініціалізовано з бібліотекою промптів.")
 
+    @property
+    def library(self) -> Dict[str, Any]:
+        """Актуальна бібліотека (оновлюється реєстром без перезапуску)."""
+        return self.registry.library
+
     def _select_persona(self, intent: Intent) -> str:
         """Обирає спеціалізовану персону на основі наміру."""
         if intent in ["technical_help"]:
@@ -116,4 +121,4 @@ class PromptDirector:
         
         return final_prompt
 
-prompt_director = PromptDirector(PROMPT_LIBRARY)
+prompt_director = PromptDirector(prompt_registry)
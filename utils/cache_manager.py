@@ -2,106 +2,382 @@
 utils/cache_manager.py
 
 Cache layer for registered users:
-- Key: cache:user:{user_id}
+- Key: cache:user_hash:{user_id} (Redis HASH)
+  - profile      → колонки таблиці users
+  - settings     → налаштування м'юту
+  - chat_history → кільцевий буфер останніх MAX_CHAT_HISTORY_LENGTH повідомлень
+    (повна історія — append-only таблиця chat_messages)
+  Значення полів серіалізуються utils/codec (msgpack + zlib для довгих історій);
+  старі JSON-поля читаються без міграції.
 - TTL: 86400 sec (24h)
+- L1: поля хешу додатково тримаються в локальному LRU процесу (utils/local_cache);
+  зміни розсилаються іншим процесам через Redis pub/sub
 - Read-through: якщо в Redis є дані → повернути їх, інакше завантажити з БД та закешувати
-- Write-through: оновлює Redis + синхронно пише в БД
+- Stampede protection: single-flight у процесі + короткий Redis-лок між процесами,
+  імовірнісне дострокове оновлення гарячих ключів (XFetch)
+- Зміни профілю пишуться в БД (реєстрація), після чого clear_user_cache видаляє ключі
+  і розсилає інвалідацію L1; наступне читання перебудує кеш
+- Write-behind: історія чату пишеться в Redis одразу, а в БД лише нові повідомлення —
+  пакетами (utils/write_behind → chat_messages)
+- Partial updates: репліка в чаті перезаписує лише поле chat_history, а не весь профіль
 - Graceful fallback: якщо Redis недоступний → читати/писати безпосередньо в БД
+- Ранг окремо: cache:user_rank:{user_id} (рядок, "" — користувач не зареєстрований)
+  для приєднання до лобі; прогрівається при кожному записі профілю в кеш і при
+  реєстрації, очищається разом з рештою кешу в clear_user_cache
 """
 
 import asyncio
-import json
+import math
+import random
+import time
+import uuid
 from typing import Any
 
-from config import logger
-from utils.redis_client import get_redis
-from database.crud import get_user_by_telegram_id, add_or_update_user, get_user_settings
+from config import MAX_CHAT_HISTORY_LENGTH, logger
+from utils import codec
+from utils.local_redis import COMPARE_AND_DELETE_SCRIPT
+from utils.redis_client import get_redis, get_redis_raw, redis_pipeline
+from utils.local_cache import LocalCache, cache_invalidator
+from utils.write_behind import chat_history_writer
+from database.crud import (
+    get_recent_chat_messages,
+    get_user_profile_card,
+    get_user_rank,
+    get_user_settings,
+)
 
-KEY_TEMPLATE = "cache:user:{user_id}"
+KEY_TEMPLATE = "cache:user_hash:{user_id}"
+# Ключ старого формату (весь профіль одним JSON-рядком); лише для очищення
+LEGACY_KEY_TEMPLATE = "cache:user:{user_id}"
 CACHE_TTL = 86400  # 24 hours
+RANK_KEY_TEMPLATE = "cache:user_rank:{user_id}"
+# Ранг змінюється лише через реєстрацію, яка очищає кеш, тож ключ може жити довше за профіль
+RANK_CACHE_TTL = 7 * CACHE_TTL
+
+FIELD_PROFILE = "profile"
+FIELD_SETTINGS = "settings"
+FIELD_CHAT_HISTORY = "chat_history"
+# Скільки мілісекунд тривала остання перебудова з БД (для дострокового оновлення)
+FIELD_REBUILD_MS = "rebuild_ms"
+
+# Захист від "штормів" промахів кешу
+REBUILD_LOCK_KEY_TEMPLATE = "lock:cache:user:{user_id}"
+REBUILD_LOCK_TTL_MS = 5000
+REBUILD_WAIT_ATTEMPTS = 20
+REBUILD_WAIT_INTERVAL_SECONDS = 0.05
+EARLY_REFRESH_BETA = 1.0
+
+# Скрипт зняття локу (лише якщо лок досі наш), зареєстрований на поточному клієнті
+_release_lock_script: Any = None
+_release_lock_client: Any = None
+
+_inflight_rebuilds: dict[int, asyncio.Task] = {}
+
+# L1 зберігає серіалізовані поля хешу: кожне читання отримує власну копію даних,
+# тож зміни словника викликачем не псують кеш.
+INVALIDATION_NAMESPACE = "user"
+_l1_cache = LocalCache("user_cache")
+cache_invalidator.register(INVALIDATION_NAMESPACE, _l1_cache)
+RANK_INVALIDATION_NAMESPACE = "user_rank"
+_rank_l1_cache = LocalCache("user_rank")
+cache_invalidator.register(RANK_INVALIDATION_NAMESPACE, _rank_l1_cache)
+
+
+def _split_user_data(user_data: dict[str, Any]) -> dict[str, bytes]:
+    """Розкладає плоский словник користувача на поля Redis-хешу."""
+    profile = {
+        k: v for k, v in user_data.items()
+        if k not in (FIELD_SETTINGS, FIELD_CHAT_HISTORY)
+    }
+    fields = {FIELD_PROFILE: codec.encode(profile)}
+    if FIELD_SETTINGS in user_data:
+        fields[FIELD_SETTINGS] = codec.encode(user_data[FIELD_SETTINGS])
+    if FIELD_CHAT_HISTORY in user_data:
+        fields[FIELD_CHAT_HISTORY] = codec.encode(user_data[FIELD_CHAT_HISTORY])
+    return fields
+
+
+def _normalize_fields(raw_fields: dict[bytes, bytes]) -> dict[str, bytes]:
+    """Перетворює імена полів з bytes (бінарний клієнт Redis) у str."""
+    return {
+        (name.decode() if isinstance(name, bytes) else name): value
+        for name, value in raw_fields.items()
+    }
+
+
+def _merge_user_fields(fields: dict[str, bytes]) -> dict[str, Any]:
+    """Збирає поля Redis-хешу назад у плоский словник користувача."""
+    user_data: dict[str, Any] = codec.decode(fields.get(FIELD_PROFILE)) or {}
+    if FIELD_SETTINGS in fields:
+        user_data[FIELD_SETTINGS] = codec.decode(fields[FIELD_SETTINGS])
+    if FIELD_CHAT_HISTORY in fields:
+        user_data[FIELD_CHAT_HISTORY] = codec.decode(fields[FIELD_CHAT_HISTORY])
+    return user_data
 
-_lock = asyncio.Lock()
 
 async def load_user_cache(user_id: int) -> dict[str, Any]:
     """
     Повертає дані користувача (profile + chat_history + settings).
-    Спроба завантажити з Redis; при невдачі або cache miss → із БД + кешування.
+    Порядок: L1 процесу → Redis → БД (з захистом від "штормів" промахів кешу).
     """
+    fields = _l1_cache.get(user_id)
+    if fields:
+        return _merge_user_fields(fields)
+
     key = KEY_TEMPLATE.format(user_id=user_id)
     try:
-        redis = await get_redis()
-        raw = await redis.get(key)
-        if raw:
+        # HGETALL + PTTL за один round-trip
+        async with redis_pipeline(raw=True) as pipe:
+            pipe.hgetall(key)
+            pipe.pttl(key)
+            raw_fields, ttl_ms = await pipe.execute()
+        fields = _normalize_fields(raw_fields)
+        if fields:
             logger.debug(f"Loaded user cache from Redis for user {user_id}")
-            return json.loads(raw)
+            _l1_cache.set(user_id, fields)
+            if _should_refresh_early(fields, ttl_ms):
+                # Гарячий ключ оновлюємо у фоні до того, як він зникне
+                logger.debug(f"Early refresh of user cache for user {user_id} (ttl {ttl_ms} ms)")
+                _start_rebuild(user_id)
+            return _merge_user_fields(fields)
     except Exception as e:
         logger.warning(f"Redis unavailable on load_user_cache({user_id}): {e}")
         # При помилці Redis, переходимо до завантаження з БД
-    
-    # cache miss або помилка Redis → завантажуємо з БД
+
+    # cache miss або помилка Redis → один спільний rebuild на ключ
     logger.debug(f"Cache miss or Redis unavailable for user {user_id}. Loading from DB.")
-    user_data = await get_user_by_telegram_id(user_id) or {}
-    
-    # ❗️ Збагачуємо кеш налаштуваннями
-    settings = await get_user_settings(user_id)
-    user_data['settings'] = {
-        "mute_vision": settings.mute_vision,
-        "mute_chat": settings.mute_chat,
-        "mute_party": settings.mute_party,
-    }
+    fields = await asyncio.shield(_start_rebuild(user_id))
+    # Кожен очікувач декодує власну копію даних
+    return _merge_user_fields(fields)
 
-    if user_data:
-        # Зберігаємо повний об'єкт в кеш
-        await save_user_cache(user_id, user_data)
-        
-    return user_data
+def _should_refresh_early(fields: dict[str, bytes], ttl_ms: int) -> bool:
+    """
+    Імовірнісне дострокове оновлення (XFetch): що ближче закінчення TTL
+    і що довше триває перебудова, то вища ймовірність оновити ключ заздалегідь.
+    """
+    if ttl_ms is None or ttl_ms < 0:
+        return False
+    try:
+        rebuild_ms = float(fields.get(FIELD_REBUILD_MS) or 0)
+    except ValueError:
+        return False
+    return rebuild_ms * EARLY_REFRESH_BETA * -math.log(1.0 - random.random()) >= ttl_ms
+
+def _start_rebuild(user_id: int) -> asyncio.Task:
+    """Single-flight: на кожен user_id у процесі виконується не більше однієї перебудови."""
+    task = _inflight_rebuilds.get(user_id)
+    if task is None:
+        task = asyncio.create_task(_rebuild_user_cache(user_id))
+        _inflight_rebuilds[user_id] = task
+
+        def _done(t: asyncio.Task) -> None:
+            _inflight_rebuilds.pop(user_id, None)
+            if not t.cancelled() and t.exception():
+                logger.warning(f"Rebuild of user cache for {user_id} failed: {t.exception()}")
 
-async def save_user_cache(user_id: int, user_data: dict[str, Any]) -> None:
+        task.add_done_callback(_done)
+    return task
+
+async def _rebuild_user_cache(user_id: int) -> dict[str, bytes]:
     """
-    Зберігає дані користувача в Redis з TTL та синхронно в БД (write-through).
-    Якщо Redis недоступний, робить лише запис у БД.
+    Перебудовує кеш користувача з БД.
+    Між процесами координується коротким Redis-локом: якщо його тримає інший процес,
+    чекаємо на його результат у Redis, а не йдемо в БД паралельно.
     """
     key = KEY_TEMPLATE.format(user_id=user_id)
+    lock_key = REBUILD_LOCK_KEY_TEMPLATE.format(user_id=user_id)
+    token = uuid.uuid4().hex
+    redis = None
+    acquired = False
     try:
-        payload = json.dumps(user_data, ensure_ascii=False, default=str)
+        redis = await get_redis()
+        acquired = bool(await redis.set(lock_key, token, nx=True, px=REBUILD_LOCK_TTL_MS))
+        if not acquired:
+            redis_raw = await get_redis_raw()
+            for _ in range(REBUILD_WAIT_ATTEMPTS):
+                await asyncio.sleep(REBUILD_WAIT_INTERVAL_SECONDS)
+                fields = _normalize_fields(await redis_raw.hgetall(key))
+                if fields:
+                    _l1_cache.set(user_id, fields)
+                    return fields
+            logger.debug(f"Timed out waiting for foreign rebuild of user {user_id}, loading from DB.")
+    except Exception as e:
+        logger.warning(f"Redis unavailable on rebuild lock for user {user_id}: {e}")
+
+    try:
+        started = time.monotonic()
+        user_data = await get_user_profile_card(user_id) or {}
+        if user_data:
+            user_data['chat_history'] = await get_recent_chat_messages(user_id, MAX_CHAT_HISTORY_LENGTH)
+
+        # ❗️ Збагачуємо кеш налаштуваннями
+        settings = await get_user_settings(user_id)
+        user_data['settings'] = {
+            "mute_vision": settings.mute_vision,
+            "mute_chat": settings.mute_chat,
+            "mute_party": settings.mute_party,
+        }
+
+        # Повідомлення, що ще чекають у буфері write-behind, новіші за ті, що в БД
+        pending_messages = chat_history_writer.get_pending(user_id)
+        if pending_messages:
+            history = user_data.get('chat_history') or []
+            # id потрібен лише для ідемпотентного запису в БД, у кеші (і в запитах до OpenAI) його немає
+            pending_messages = [{k: v for k, v in message.items() if k != "id"} for message in pending_messages]
+            user_data['chat_history'] = [*history, *pending_messages][-MAX_CHAT_HISTORY_LENGTH:]
+
+        rebuild_ms = int((time.monotonic() - started) * 1000)
+        # Щойно прочитані з БД дані кладемо лише в кеш — писати їх назад у БД немає сенсу
+        fields = await _write_user_hash(user_id, user_data, rebuild_ms=rebuild_ms)
+        return fields if fields is not None else {FIELD_PROFILE: codec.encode({})}
+    finally:
+        if acquired and redis is not None:
+            try:
+                await _release_lock(redis)(keys=[lock_key], args=[token])
+            except Exception as e:
+                logger.debug(f"Could not release rebuild lock for user {user_id}: {e}")
+
+def _release_lock(redis: Any) -> Any:
+    """
+    COMPARE_AND_DELETE_SCRIPT для EVALSHA (як LobbyStore._script): на кожну перебудову
+    йде лише sha1; після перепідключення скрипт реєструється на новому клієнті.
+    """
+    global _release_lock_script, _release_lock_client
+    if redis is not _release_lock_client:
+        _release_lock_script = redis.register_script(COMPARE_AND_DELETE_SCRIPT)
+        _release_lock_client = redis
+    return _release_lock_script
+
+async def _write_user_hash(
+    user_id: int, user_data: dict[str, Any], rebuild_ms: int | None = None
+) -> dict[str, bytes] | None:
+    """
+    Записує дані користувача в Redis-хеш (HSET + EXPIRE одним пакетом).
+    Повертає записані поля або None, якщо дані не вдалося серіалізувати.
+    """
+    key = KEY_TEMPLATE.format(user_id=user_id)
+    try:
+        fields = _split_user_data(user_data)
     except Exception as e:
         logger.error(f"Error serializing user_data for cache (user {user_id}): {e}", exc_info=True)
-        return # Не зберігаємо пошкоджені дані
+        return None
+    if rebuild_ms is not None:
+        fields[FIELD_REBUILD_MS] = str(rebuild_ms).encode()
 
-    # Спроба запису в Redis
+    _l1_cache.set(user_id, fields)
+    # Повна картка профілю (перебудова чи реєстрація) заодно прогріває кеш рангу
+    has_rank = "current_rank" in user_data
+    if has_rank:
+        _rank_l1_cache.set(user_id, user_data["current_rank"] or "")
     try:
-        redis = await get_redis()
-        async with _lock:
-            await redis.set(key, payload, ex=CACHE_TTL)
+        async with redis_pipeline(raw=True, transaction=True) as pipe:
+            pipe.hset(key, mapping=fields)
+            pipe.expire(key, CACHE_TTL)
+            if has_rank:
+                pipe.set(
+                    RANK_KEY_TEMPLATE.format(user_id=user_id),
+                    (user_data["current_rank"] or "").encode("utf-8"),
+                    ex=RANK_CACHE_TTL,
+                )
+            await pipe.execute()
         logger.debug(f"Saved user cache to Redis for user {user_id}")
     except Exception as e:
-        logger.warning(f"Redis unavailable on save_user_cache({user_id}): {e}")
-    
-    # Write-through: синхронний запис у БД
+        logger.warning(f"Redis unavailable on _write_user_hash({user_id}): {e}")
+    return fields
+
+async def save_user_chat_history(
+    user_id: int, chat_history: list[dict[str, Any]], new_messages: list[dict[str, Any]]
+) -> None:
+    """
+    Оновлює лише історію чату користувача (HSET одного поля).
+    У кеші зберігається кільцевий буфер останніх MAX_CHAT_HISTORY_LENGTH повідомлень;
+    профіль і налаштування не перезаписуються. У БД дописуються лише new_messages —
+    пакетом разом з іншими користувачами (write-behind → chat_messages).
+    """
+    chat_history = chat_history[-MAX_CHAT_HISTORY_LENGTH:]
+    key = KEY_TEMPLATE.format(user_id=user_id)
     try:
-        # Видаляємо 'settings', оскільки вони не є частиною моделі User
-        user_data_for_db = user_data.copy()
-        user_data_for_db.pop('settings', None)
-        
-        if 'telegram_id' not in user_data_for_db:
-             user_data_for_db['telegram_id'] = user_id
-             
-        # Перевіряємо, чи є що зберігати в основну таблицю
-        if any(k in user_data_for_db for k in ['nickname', 'player_id']):
-            await add_or_update_user(user_data_for_db)
-            logger.debug(f"Write-through: persisted user_data to DB for user {user_id}")
+        payload = codec.encode(chat_history)
     except Exception as e:
-        logger.error(f"Error persisting user_data to DB for {user_id}: {e}", exc_info=True)
+        logger.error(f"Error serializing chat_history for cache (user {user_id}): {e}", exc_info=True)
+        return
+
+    cached_fields = _l1_cache.get(user_id)
+    if cached_fields:
+        _l1_cache.set(user_id, {**cached_fields, FIELD_CHAT_HISTORY: payload})
+
+    try:
+        async with redis_pipeline(raw=True, transaction=True) as pipe:
+            pipe.hset(key, FIELD_CHAT_HISTORY, payload)
+            pipe.expire(key, CACHE_TTL)
+            # Інші процеси мають перечитати оновлену історію з Redis
+            pipe.publish(cache_invalidator.CHANNEL, cache_invalidator.message(INVALIDATION_NAMESPACE, user_id))
+            await pipe.execute()
+        logger.debug(f"Saved chat_history to Redis for user {user_id}")
+    except Exception as e:
+        logger.warning(f"Redis unavailable on save_user_chat_history({user_id}): {e}")
+
+    # Write-behind: нові повідомлення потраплять у БД пакетом разом з іншими користувачами.
+    # id повідомлення робить повторний запис (відновлення журналу) ідемпотентним.
+    if new_messages:
+        await chat_history_writer.mark_dirty(
+            user_id, [{**message, "id": message.get("id") or str(uuid.uuid4())} for message in new_messages]
+        )
 
 async def clear_user_cache(user_id: int) -> None:
     """
-    Видаляє кеш користувача з Redis.
+    Видаляє кеш користувача з Redis та L1-кешів усіх процесів.
     Якщо Redis недоступний — мовчазно ігнорує.
     """
     key = KEY_TEMPLATE.format(user_id=user_id)
+    legacy_key = LEGACY_KEY_TEMPLATE.format(user_id=user_id)
+    rank_key = RANK_KEY_TEMPLATE.format(user_id=user_id)
     try:
         redis = await get_redis()
-        await redis.delete(key)
+        await redis.delete(key, legacy_key, rank_key)
         logger.info(f"Cleared user cache in Redis for user {user_id}")
     except Exception as e:
         logger.warning(f"Could not delete Redis cache for user {user_id}: {e}")
+    # Інвалідація L1 — лише після видалення з Redis (як в update_user_settings): інакше інший
+    # процес між цими кроками перечитав би старі дані з Redis і тримав їх у L1 до кінця TTL
+    await cache_invalidator.invalidate(INVALIDATION_NAMESPACE, user_id)
+    await cache_invalidator.invalidate(RANK_INVALIDATION_NAMESPACE, user_id)
+
+async def get_cached_user_rank(user_id: int) -> str | None:
+    """
+    Ранг користувача без звернення до БД на гарячому шляху:
+    L1 рангу → профіль у L1 → Redis (cache:user_rank) → БД (index-only scan).
+    Незареєстрованих користувачів теж кешуємо (""), щоб не питати БД щоразу.
+    """
+    rank = _rank_l1_cache.get(user_id)
+    if rank is not None:
+        return rank or None
+
+    fields = _l1_cache.get(user_id)
+    if fields:
+        profile = codec.decode(fields.get(FIELD_PROFILE)) or {}
+        if "current_rank" in profile:
+            _rank_l1_cache.set(user_id, profile["current_rank"] or "")
+            return profile["current_rank"] or None
+
+    try:
+        redis = await get_redis()
+        rank = await redis.get(RANK_KEY_TEMPLATE.format(user_id=user_id))
+        if rank is not None:
+            _rank_l1_cache.set(user_id, rank)
+            return rank or None
+    except Exception as e:
+        logger.warning(f"Redis unavailable on get_cached_user_rank({user_id}): {e}")
+
+    rank = await get_user_rank(user_id)
+    await warm_user_rank(user_id, rank)
+    return rank
+
+async def warm_user_rank(user_id: int, rank: str | None) -> None:
+    """Записує ранг у кеш рангу (L1 + Redis); None — користувач не зареєстрований."""
+    _rank_l1_cache.set(user_id, rank or "")
+    try:
+        redis = await get_redis()
+        await redis.set(RANK_KEY_TEMPLATE.format(user_id=user_id), rank or "", ex=RANK_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Could not cache rank for user {user_id}: {e}")
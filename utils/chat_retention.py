@@ -0,0 +1,45 @@
+"""
+utils/chat_retention.py
+
+Фонове прибирання таблиці chat_messages: для кожного користувача лишаються
+CHAT_HISTORY_RETENTION_MESSAGES останніх повідомлень, а все старше за
+CHAT_HISTORY_RETENTION_DAYS видаляється.
+"""
+
+import asyncio
+
+from config import (
+    CHAT_HISTORY_PRUNE_INTERVAL_SECONDS,
+    CHAT_HISTORY_RETENTION_DAYS,
+    CHAT_HISTORY_RETENTION_MESSAGES,
+    logger,
+)
+from database.crud import prune_chat_messages
+
+_pruner_task: asyncio.Task | None = None
+
+
+async def _prune_periodically() -> None:
+    while True:
+        deleted = await prune_chat_messages(CHAT_HISTORY_RETENTION_MESSAGES, CHAT_HISTORY_RETENTION_DAYS)
+        if deleted:
+            logger.info(f"Chat retention: видалено {deleted} старих повідомлень.")
+        await asyncio.sleep(CHAT_HISTORY_PRUNE_INTERVAL_SECONDS)
+
+
+def start_chat_pruner() -> None:
+    """Запускає періодичне прибирання історії чату."""
+    global _pruner_task
+    if _pruner_task is None or _pruner_task.done():
+        _pruner_task = asyncio.create_task(_prune_periodically())
+
+
+async def stop_chat_pruner() -> None:
+    global _pruner_task
+    if _pruner_task:
+        _pruner_task.cancel()
+        try:
+            await _pruner_task
+        except asyncio.CancelledError:
+            pass
+        _pruner_task = None
@@ -0,0 +1,73 @@
+"""
+utils/codec.py
+
+Compact binary codec for records stored in Redis (user cache, sessions, journals):
+- Формат: [SCHEMA_VERSION][FLAGS][тіло], де тіло — msgpack (або JSON, якщо
+  бібліотека msgpack недоступна), за потреби стиснуте zlib.
+- Довгі значення (історія чату) стискаються, якщо це реально зменшує розмір.
+- Міграція: значення без заголовка вважаються старими JSON-рядками і читаються
+  через json.loads, тож кеш не потрібно скидати при оновленні.
+"""
+
+import json
+import zlib
+from typing import Any
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - залежить від оточення
+    msgpack = None
+
+SCHEMA_VERSION = 1
+
+FORMAT_MSGPACK = 0x01
+FORMAT_JSON = 0x02
+FLAG_ZLIB = 0x80
+
+# Значення, коротші за поріг, не стискаємо: заголовок zlib з'їсть увесь виграш
+ZLIB_THRESHOLD_BYTES = 512
+ZLIB_LEVEL = 6
+
+
+def encode(value: Any) -> bytes:
+    """Серіалізує значення у компактний бінарний формат із заголовком версії."""
+    if msgpack is not None:
+        # default=str — як і раніше для JSON: datetime та інші типи стають рядками
+        body = msgpack.packb(value, default=str, use_bin_type=True)
+        flags = FORMAT_MSGPACK
+    else:
+        body = json.dumps(value, ensure_ascii=False, default=str).encode("utf-8")
+        flags = FORMAT_JSON
+
+    if len(body) >= ZLIB_THRESHOLD_BYTES:
+        compressed = zlib.compress(body, ZLIB_LEVEL)
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= FLAG_ZLIB
+
+    return bytes((SCHEMA_VERSION, flags)) + body
+
+
+def decode(raw: bytes | str | None) -> Any:
+    """
+    Десеріалізує значення, записане encode(), або старий JSON-рядок.
+    Повертає None для порожнього значення.
+    """
+    if raw is None or raw == b"" or raw == "":
+        return None
+    if isinstance(raw, str):
+        return json.loads(raw)
+    if raw[0] != SCHEMA_VERSION or len(raw) < 2:
+        # Легасі: JSON без заголовка (завжди починається з друкованого символу)
+        return json.loads(raw.decode("utf-8"))
+
+    flags = raw[1]
+    body = raw[2:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+
+    if flags & FORMAT_MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("msgpack is required to decode this cached value.")
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    return json.loads(body.decode("utf-8"))
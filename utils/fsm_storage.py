@@ -0,0 +1,80 @@
+"""
+utils/fsm_storage.py
+
+Redis-сховище FSM для aiogram:
+- Стан і дані одного контексту (бот/чат/користувач) лежать в одному HASH
+  (замість двох ключів у стандартному RedisStorage): поле "s" — назва стану,
+  поле "d" — дані у форматі utils/codec (msgpack + zlib для довгих значень,
+  як-от промпти Vision, замість JSON). Кожна операція — один round-trip.
+- Кожен запис продовжує TTL ключа, тож покинуті діалоги (реєстрація, Vision,
+  створення паті) зникають самі через FSM_STATE_TTL_SECONDS.
+- Стан переживає рестарт дино і доступний усім воркерам, що працюють з одним токеном.
+"""
+
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import FSM_STATE_TTL_SECONDS, FSM_STORAGE, logger
+from utils import codec
+from utils.redis_client import get_redis_raw, redis_pipeline
+
+FIELD_STATE = "s"
+FIELD_DATA = "d"
+
+
+class CompactRedisStorage(BaseStorage):
+    """FSM-сховище: один Redis-хеш на контекст, дані через utils/codec, TTL на покинуті діалоги."""
+
+    def __init__(self, key_builder: KeyBuilder | None = None, ttl: int = FSM_STATE_TTL_SECONDS):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True)
+        self.ttl = ttl
+
+    async def _write(self, key: StorageKey, field: str, value: bytes | str | None) -> None:
+        redis_key = self.key_builder.build(key)
+        async with redis_pipeline(raw=True, transaction=True) as pipe:
+            if value is None:
+                pipe.hdel(redis_key, field)
+            else:
+                pipe.hset(redis_key, field, value)
+            pipe.expire(redis_key, self.ttl)
+            await pipe.execute()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        await self._write(key, FIELD_STATE, state)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        redis = await get_redis_raw()
+        raw_state = await redis.hget(self.key_builder.build(key), FIELD_STATE)
+        return raw_state.decode("utf-8") if raw_state else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._write(key, FIELD_DATA, codec.encode(dict(data)) if data else None)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        redis = await get_redis_raw()
+        raw_data = await redis.hget(self.key_builder.build(key), FIELD_DATA)
+        if not raw_data:
+            return {}
+        try:
+            return codec.decode(raw_data) or {}
+        except Exception as e:
+            logger.error(f"Пошкоджені дані FSM для {key}: {e}", exc_info=True)
+            return {}
+
+    async def close(self) -> None:
+        # Клієнт Redis спільний для всього бота і закривається в close_redis()
+        return None
+
+
+def create_fsm_storage() -> BaseStorage:
+    """Повертає FSM-сховище згідно з FSM_STORAGE."""
+    if FSM_STORAGE == "memory":
+        logger.warning("⚠️ FSM_STORAGE=memory: стани діалогів не переживуть рестарт і не спільні між воркерами.")
+        return MemoryStorage()
+    logger.info(f"✅ FSM storage: Redis (TTL {FSM_STATE_TTL_SECONDS} с).")
+    return CompactRedisStorage()
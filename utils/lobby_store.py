@@ -0,0 +1,394 @@
+"""
+utils/lobby_store.py
+
+Сховище лобі паті (handlers/party_handler):
+- Одне лобі — один Redis-хеш party:lobby:{chat_id}:{message_id}; лобі переживає
+  рестарт і спільне для всіх воркерів. Ключ включає chat_id, бо message_id
+  унікальний лише в межах чату.
+- Кожна зміна (почати приєднання, обрати роль, вийти, скасувати, закрити) — один
+  Lua-скрипт: перевірка й запис відбуваються атомарно на сервері, тож одночасні
+  натискання не можуть двічі зайняти роль чи переповнити паті.
+  Ролі резервуються полями r:{role}, кількість гравців — поле count.
+- Кожна зміна збільшує поле version, продовжує TTL ключа (PARTY_LOBBY_TTL_SECONDS)
+  і оновлює індекс party:lobbies (sorted set за часом останньої активності).
+- Поле version дає змогу не показати старіший стан поверх новішого
+  (див. lobby_message_editor у handlers/party_handler.py).
+- PARTY_LOBBY_STORE=memory — той самий код поверх in-process сховища
+  (utils/local_redis): поведінка як у колишнього словника active_lobbies.
+"""
+
+import time
+from typing import Any, Literal
+
+from config import PARTY_LOBBY_STORE, PARTY_LOBBY_TTL_SECONDS, logger
+from utils import codec
+from utils.local_redis import LocalRedis, LocalRedisServer, register_lua_script
+from utils.redis_client import get_redis_raw
+
+KEY_TEMPLATE = "party:lobby:{chat_id}:{lobby_id}"
+# Індекс живих лобі: member "{chat_id}:{lobby_id}", score — час останньої зміни
+INDEX_KEY = "party:lobbies"
+
+LobbyStatus = Literal[
+    "ok", "missing", "member", "full", "busy", "not_turn", "role_taken", "not_member", "leader", "forbidden",
+    "active",
+]
+
+# --- Lua-скрипти (KEYS[1] — хеш лобі, KEYS[2] — індекс) ---
+
+_START_JOIN_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then return {'missing'} end
+if redis.call('hexists', KEYS[1], 'p:' .. ARGV[1]) == 1 then return {'member'} end
+if tonumber(redis.call('hget', KEYS[1], 'count')) >= tonumber(redis.call('hget', KEYS[1], 'size')) then
+    return {'full'}
+end
+if redis.call('hget', KEYS[1], 'state') == 'joining' then return {'busy'} end
+redis.call('hset', KEYS[1], 'state', 'joining', 'joining', ARGV[1], 'joining_name', ARGV[2], 'updated_at', ARGV[4])
+redis.call('hincrby', KEYS[1], 'version', 1)
+redis.call('expire', KEYS[1], ARGV[3])
+redis.call('zadd', KEYS[2], ARGV[4], ARGV[5])
+return {'ok', redis.call('hgetall', KEYS[1])}
+"""
+
+_COMPLETE_JOIN_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then return {'missing'} end
+if redis.call('hget', KEYS[1], 'state') ~= 'joining' or redis.call('hget', KEYS[1], 'joining') ~= ARGV[1] then
+    return {'not_turn'}
+end
+if redis.call('hexists', KEYS[1], 'r:' .. ARGV[2]) == 1 then return {'role_taken'} end
+if tonumber(redis.call('hget', KEYS[1], 'count')) >= tonumber(redis.call('hget', KEYS[1], 'size')) then
+    return {'full'}
+end
+redis.call('hset', KEYS[1], 'p:' .. ARGV[1], ARGV[3], 'pr:' .. ARGV[1], ARGV[2], 'r:' .. ARGV[2], ARGV[1],
+    'state', 'open', 'updated_at', ARGV[5])
+redis.call('hdel', KEYS[1], 'joining', 'joining_name')
+redis.call('hincrby', KEYS[1], 'count', 1)
+redis.call('hincrby', KEYS[1], 'version', 1)
+redis.call('expire', KEYS[1], ARGV[4])
+redis.call('zadd', KEYS[2], ARGV[5], ARGV[6])
+return {'ok', redis.call('hgetall', KEYS[1])}
+"""
+
+_LEAVE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then return {'missing'} end
+local role = redis.call('hget', KEYS[1], 'pr:' .. ARGV[1])
+if not role then return {'not_member'} end
+if redis.call('hget', KEYS[1], 'leader') == ARGV[1] then return {'leader'} end
+redis.call('hdel', KEYS[1], 'p:' .. ARGV[1], 'pr:' .. ARGV[1], 'r:' .. role)
+redis.call('hincrby', KEYS[1], 'count', -1)
+redis.call('hset', KEYS[1], 'updated_at', ARGV[3])
+redis.call('hincrby', KEYS[1], 'version', 1)
+redis.call('expire', KEYS[1], ARGV[2])
+redis.call('zadd', KEYS[2], ARGV[3], ARGV[4])
+return {'ok', redis.call('hgetall', KEYS[1])}
+"""
+
+_CANCEL_JOIN_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then return {'missing'} end
+local is_joining = redis.call('hget', KEYS[1], 'state') == 'joining' and redis.call('hget', KEYS[1], 'joining') == ARGV[1]
+if not is_joining and redis.call('hget', KEYS[1], 'leader') ~= ARGV[1] then return {'forbidden'} end
+redis.call('hset', KEYS[1], 'state', 'open', 'updated_at', ARGV[3])
+redis.call('hdel', KEYS[1], 'joining', 'joining_name')
+redis.call('hincrby', KEYS[1], 'version', 1)
+redis.call('expire', KEYS[1], ARGV[2])
+redis.call('zadd', KEYS[2], ARGV[3], ARGV[4])
+return {'ok', redis.call('hgetall', KEYS[1])}
+"""
+
+# ARGV[1] — id того, хто закриває ('' — закриття ботом, без перевірки лідера);
+# ARGV[3] — закрити лише якщо лобі не змінювалося після цього часу ('' — без перевірки)
+_CLOSE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    redis.call('zrem', KEYS[2], ARGV[2])
+    return {'missing'}
+end
+if ARGV[1] ~= '' and redis.call('hget', KEYS[1], 'leader') ~= ARGV[1] then return {'forbidden'} end
+if ARGV[3] ~= '' and tonumber(redis.call('hget', KEYS[1], 'updated_at')) > tonumber(ARGV[3]) then
+    return {'active'}
+end
+local data = redis.call('hgetall', KEYS[1])
+redis.call('del', KEYS[1])
+redis.call('zrem', KEYS[2], ARGV[2])
+return {'ok', data}
+"""
+
+
+# --- Python-еквіваленти скриптів для utils/local_redis ---
+
+def _flat_hash(server: LocalRedisServer, key: bytes) -> list[bytes]:
+    return [item for pair in server.hgetall(key).items() for item in pair]
+
+
+def _full(server: LocalRedisServer, key: bytes) -> bool:
+    return int(server.hget(key, b"count")) >= int(server.hget(key, b"size"))
+
+
+def _touch(server: LocalRedisServer, keys: list[bytes], ttl: bytes, now: bytes, member: bytes) -> None:
+    server.hset(keys[0], b"updated_at", now)
+    server.hincrby(keys[0], b"version", 1)
+    server.expire(keys[0], int(ttl))
+    server.zadd(keys[1], {member: float(now)})
+
+
+def _local_start_join(server: LocalRedisServer, keys: list[bytes], args: list[bytes]) -> list:
+    user_id, name, ttl, now, member = args
+    if not server.exists(keys[0]):
+        return [b"missing"]
+    if server.hexists(keys[0], b"p:" + user_id):
+        return [b"member"]
+    if _full(server, keys[0]):
+        return [b"full"]
+    if server.hget(keys[0], b"state") == b"joining":
+        return [b"busy"]
+    server.hset(keys[0], mapping={b"state": b"joining", b"joining": user_id, b"joining_name": name})
+    _touch(server, keys, ttl, now, member)
+    return [b"ok", _flat_hash(server, keys[0])]
+
+
+def _local_complete_join(server: LocalRedisServer, keys: list[bytes], args: list[bytes]) -> list:
+    user_id, role, payload, ttl, now, member = args
+    if not server.exists(keys[0]):
+        return [b"missing"]
+    if server.hget(keys[0], b"state") != b"joining" or server.hget(keys[0], b"joining") != user_id:
+        return [b"not_turn"]
+    if server.hexists(keys[0], b"r:" + role):
+        return [b"role_taken"]
+    if _full(server, keys[0]):
+        return [b"full"]
+    server.hset(keys[0], mapping={
+        b"p:" + user_id: payload, b"pr:" + user_id: role, b"r:" + role: user_id, b"state": b"open",
+    })
+    server.hdel(keys[0], b"joining", b"joining_name")
+    server.hincrby(keys[0], b"count", 1)
+    _touch(server, keys, ttl, now, member)
+    return [b"ok", _flat_hash(server, keys[0])]
+
+
+def _local_leave(server: LocalRedisServer, keys: list[bytes], args: list[bytes]) -> list:
+    user_id, ttl, now, member = args
+    if not server.exists(keys[0]):
+        return [b"missing"]
+    role = server.hget(keys[0], b"pr:" + user_id)
+    if role is None:
+        return [b"not_member"]
+    if server.hget(keys[0], b"leader") == user_id:
+        return [b"leader"]
+    server.hdel(keys[0], b"p:" + user_id, b"pr:" + user_id, b"r:" + role)
+    server.hincrby(keys[0], b"count", -1)
+    _touch(server, keys, ttl, now, member)
+    return [b"ok", _flat_hash(server, keys[0])]
+
+
+def _local_cancel_join(server: LocalRedisServer, keys: list[bytes], args: list[bytes]) -> list:
+    user_id, ttl, now, member = args
+    if not server.exists(keys[0]):
+        return [b"missing"]
+    is_joining = server.hget(keys[0], b"state") == b"joining" and server.hget(keys[0], b"joining") == user_id
+    if not is_joining and server.hget(keys[0], b"leader") != user_id:
+        return [b"forbidden"]
+    server.hset(keys[0], b"state", b"open")
+    server.hdel(keys[0], b"joining", b"joining_name")
+    _touch(server, keys, ttl, now, member)
+    return [b"ok", _flat_hash(server, keys[0])]
+
+
+def _local_close(server: LocalRedisServer, keys: list[bytes], args: list[bytes]) -> list:
+    user_id, member, idle_before = args
+    if not server.exists(keys[0]):
+        server.zrem(keys[1], member)
+        return [b"missing"]
+    if user_id and server.hget(keys[0], b"leader") != user_id:
+        return [b"forbidden"]
+    if idle_before and float(server.hget(keys[0], b"updated_at")) > float(idle_before):
+        return [b"active"]
+    data = _flat_hash(server, keys[0])
+    server.delete(keys[0])
+    server.zrem(keys[1], member)
+    return [b"ok", data]
+
+
+register_lua_script(_START_JOIN_SCRIPT, _local_start_join)
+register_lua_script(_COMPLETE_JOIN_SCRIPT, _local_complete_join)
+register_lua_script(_LEAVE_SCRIPT, _local_leave)
+register_lua_script(_CANCEL_JOIN_SCRIPT, _local_cancel_join)
+register_lua_script(_CLOSE_SCRIPT, _local_close)
+
+
+# --- Сховище ---
+
+def _decode_lobby(flat: list[bytes]) -> dict[str, Any]:
+    """Збирає з полів хешу словник лобі у форматі, який очікують хендлери й клавіатури."""
+    fields = dict(zip(flat[::2], flat[1::2]))
+    lobby: dict[str, Any] = codec.decode(fields[b"meta"]) or {}
+    players: dict[int, dict[str, Any]] = {}
+    for field, value in fields.items():
+        if field.startswith(b"p:"):
+            players[int(field[2:])] = codec.decode(value)
+    joining = fields.get(b"joining")
+    lobby.update(
+        leader_id=int(fields[b"leader"]),
+        party_size=int(fields[b"size"]),
+        state=fields.get(b"state", b"open").decode(),
+        players=players,
+        joining_user=(
+            {"id": int(joining), "name": fields.get(b"joining_name", b"").decode("utf-8")} if joining else None
+        ),
+        updated_at=float(fields.get(b"updated_at", 0)),
+        version=int(fields.get(b"version", 0)),
+    )
+    return lobby
+
+
+class LobbyStore:
+    """Атомарні операції над лобі поверх Redis (або in-process stand-in'а)."""
+
+    def __init__(self, client: LocalRedis | None = None, ttl: int = PARTY_LOBBY_TTL_SECONDS):
+        # client=None — спільний bytes-клієнт Redis (utils/redis_client)
+        self._client = client
+        self.ttl = ttl
+        # Скрипти, зареєстровані на поточному клієнті: {текст скрипта: Script}
+        self._scripts: dict[str, Any] = {}
+        self._scripts_client: Any = None
+
+    async def _redis(self):
+        return self._client if self._client is not None else await get_redis_raw()
+
+    @staticmethod
+    def _key(chat_id: int, lobby_id: int) -> str:
+        return KEY_TEMPLATE.format(chat_id=chat_id, lobby_id=lobby_id)
+
+    @staticmethod
+    def _member(chat_id: int, lobby_id: int) -> str:
+        return f"{chat_id}:{lobby_id}"
+
+    def _script(self, redis: Any, script: str) -> Any:
+        """
+        Script для EVALSHA: на кожне натискання йде лише sha1, а не весь текст скрипта;
+        після рестарту Redis (NOSCRIPT) redis-py сам завантажує скрипт повторно.
+        """
+        if redis is not self._scripts_client:
+            # Клієнт пересоздано (close_redis / перепідключення) — реєструємо скрипти на новому
+            self._scripts = {}
+            self._scripts_client = redis
+        registered = self._scripts.get(script)
+        if registered is None:
+            registered = self._scripts[script] = redis.register_script(script)
+        return registered
+
+    async def _run(
+        self, script: str, chat_id: int, lobby_id: int, *args: Any
+    ) -> tuple[LobbyStatus, dict[str, Any] | None]:
+        redis = await self._redis()
+        result = await self._script(redis, script)(keys=[self._key(chat_id, lobby_id), INDEX_KEY], args=list(args))
+        status = result[0].decode() if isinstance(result[0], bytes) else result[0]
+        lobby = _decode_lobby(result[1]) if len(result) > 1 else None
+        return status, lobby
+
+    async def create(self, chat_id: int, lobby_id: int, lobby_data: dict[str, Any]) -> None:
+        """Зберігає нове лобі (лідер уже серед гравців)."""
+        now = time.time()
+        static = {
+            key: value for key, value in lobby_data.items()
+            if key not in ("players", "leader_id", "party_size", "state", "joining_user", "updated_at", "version")
+        }
+        mapping: dict[str, Any] = {
+            "meta": codec.encode(static),
+            "leader": lobby_data["leader_id"],
+            "size": lobby_data.get("party_size", 5),
+            "count": len(lobby_data["players"]),
+            "state": "open",
+            "version": 1,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for user_id, info in lobby_data["players"].items():
+            mapping[f"p:{user_id}"] = codec.encode(info)
+            mapping[f"pr:{user_id}"] = info["role"]
+            mapping[f"r:{info['role']}"] = user_id
+        key = self._key(chat_id, lobby_id)
+        redis = await self._redis()
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, self.ttl)
+            pipe.zadd(INDEX_KEY, {self._member(chat_id, lobby_id): now})
+            await pipe.execute()
+
+    async def get(self, chat_id: int, lobby_id: int) -> dict[str, Any] | None:
+        redis = await self._redis()
+        fields = await redis.hgetall(self._key(chat_id, lobby_id))
+        if not fields:
+            return None
+        return _decode_lobby([item for pair in fields.items() for item in pair])
+
+    async def start_join(
+        self, chat_id: int, lobby_id: int, user_id: int, user_name: str
+    ) -> tuple[LobbyStatus, dict[str, Any] | None]:
+        """Займає чергу на приєднання: missing | member | full | busy | ok."""
+        return await self._run(
+            _START_JOIN_SCRIPT, chat_id, lobby_id,
+            user_id, user_name, self.ttl, time.time(), self._member(chat_id, lobby_id),
+        )
+
+    async def complete_join(
+        self, chat_id: int, lobby_id: int, user_id: int, role: str, player_info: dict[str, Any]
+    ) -> tuple[LobbyStatus, dict[str, Any] | None]:
+        """Додає гравця з роллю: missing | not_turn | role_taken | full | ok."""
+        return await self._run(
+            _COMPLETE_JOIN_SCRIPT, chat_id, lobby_id,
+            user_id, role, codec.encode(player_info), self.ttl, time.time(), self._member(chat_id, lobby_id),
+        )
+
+    async def leave(self, chat_id: int, lobby_id: int, user_id: int) -> tuple[LobbyStatus, dict[str, Any] | None]:
+        """Видаляє гравця і звільняє його роль: missing | not_member | leader | ok."""
+        return await self._run(
+            _LEAVE_SCRIPT, chat_id, lobby_id, user_id, self.ttl, time.time(), self._member(chat_id, lobby_id)
+        )
+
+    async def cancel_join(
+        self, chat_id: int, lobby_id: int, user_id: int
+    ) -> tuple[LobbyStatus, dict[str, Any] | None]:
+        """Скасовує приєднання (сам гравець у черзі або лідер): missing | forbidden | ok."""
+        return await self._run(
+            _CANCEL_JOIN_SCRIPT, chat_id, lobby_id, user_id, self.ttl, time.time(), self._member(chat_id, lobby_id)
+        )
+
+    async def close(
+        self, chat_id: int, lobby_id: int, by_user_id: int | None = None, idle_before: float | None = None
+    ) -> tuple[LobbyStatus, dict[str, Any] | None]:
+        """
+        Видаляє лобі й повертає його останній стан: missing | forbidden | active | ok.
+        by_user_id — перевірка, що закриває лідер; None — закриття ботом.
+        idle_before — закрити, лише якщо лобі не змінювалося після цього часу (інакше "active").
+        Лише один виклик отримує "ok", тож фінальні дії виконуються рівно один раз.
+        """
+        return await self._run(
+            _CLOSE_SCRIPT, chat_id, lobby_id, "" if by_user_id is None else by_user_id,
+            self._member(chat_id, lobby_id), "" if idle_before is None else idle_before,
+        )
+
+    async def idle_lobbies(self, idle_seconds: float, limit: int = 100) -> list[tuple[int, int]]:
+        """(chat_id, lobby_id) лобі без жодної зміни довше за idle_seconds, найстаріші першими."""
+        redis = await self._redis()
+        members = await redis.zrangebyscore(INDEX_KEY, "-inf", time.time() - idle_seconds, start=0, num=limit)
+        lobbies = []
+        for member in members:
+            chat_id, _, lobby_id = (member.decode() if isinstance(member, bytes) else member).rpartition(":")
+            lobbies.append((int(chat_id), int(lobby_id)))
+        return lobbies
+
+    async def count(self) -> int:
+        """Кількість лобі в індексі (включно з ще не прибраними простроченими ключами)."""
+        redis = await self._redis()
+        return await redis.zcard(INDEX_KEY)
+
+
+def create_lobby_store() -> LobbyStore:
+    """Повертає сховище лобі згідно з PARTY_LOBBY_STORE."""
+    if PARTY_LOBBY_STORE == "memory":
+        logger.warning("⚠️ PARTY_LOBBY_STORE=memory: лобі не переживуть рестарт і не спільні між воркерами.")
+        return LobbyStore(LocalRedis(LocalRedisServer()))
+    return LobbyStore()
+
+
+lobby_store = create_lobby_store()
@@ -0,0 +1,166 @@
+"""
+utils/local_cache.py
+
+In-process L1 cache layer:
+- LocalCache: обмежений LRU-кеш з TTL для кожного запису (без await — операції атомарні в asyncio).
+- CacheInvalidator: розсилає інвалідації через Redis pub/sub, щоб L1-кеші
+  кількох процесів бота залишалися узгодженими.
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from config import L1_CACHE_MAX_SIZE, L1_CACHE_TTL_SECONDS, logger
+from utils.redis_client import get_redis
+
+_MISSING = object()
+
+
+class LocalCache:
+    """Обмежений за розміром LRU-кеш з TTL."""
+
+    def __init__(self, name: str, max_size: int = L1_CACHE_MAX_SIZE, ttl: float = L1_CACHE_TTL_SECONDS):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def purge_expired(self) -> int:
+        """Видаляє всі прострочені записи. Повертає кількість видалених."""
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at < now]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    def values(self) -> list[Any]:
+        """Знімок значень (включно з ще не прибраними простроченими)."""
+        return [value for _, value in self._data.values()]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+class CacheInvalidator:
+    """
+    Інвалідація L1-кешів між процесами через Redis pub/sub.
+    Повідомлення має формат "{namespace}:{key}:{origin}"; власні повідомлення
+    процес ігнорує, бо свій L1 він уже оновив.
+    """
+
+    CHANNEL = "cache:invalidate"
+
+    def __init__(self):
+        self._caches: dict[str, LocalCache] = {}
+        self._task: asyncio.Task | None = None
+        self.origin = uuid.uuid4().hex[:12]
+
+    def register(self, namespace: str, cache: LocalCache) -> None:
+        self._caches[namespace] = cache
+
+    def _apply(self, namespace: str, key: str) -> None:
+        cache = self._caches.get(namespace)
+        if cache is None:
+            return
+        try:
+            cache.delete(int(key))
+        except ValueError:
+            cache.delete(key)
+
+    def message(self, namespace: str, key: Hashable) -> str:
+        """Формує повідомлення інвалідації (для публікації в чужому пайплайні)."""
+        return f"{namespace}:{key}:{self.origin}"
+
+    async def invalidate(self, namespace: str, key: Hashable) -> None:
+        """Видаляє запис з локального кешу та повідомляє про це інші процеси."""
+        self._apply(namespace, str(key))
+        try:
+            redis = await get_redis()
+            await redis.publish(self.CHANNEL, self.message(namespace, key))
+        except Exception as e:
+            logger.warning(f"Could not publish cache invalidation {namespace}:{key}: {e}")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                redis = await get_redis()
+                pubsub = redis.pubsub()
+                await pubsub.subscribe(self.CHANNEL)
+                # Поки підписки не було, інвалідації могли загубитися — починаємо з чистого L1
+                for cache in self._caches.values():
+                    cache.clear()
+                logger.info(f"✅ Subscribed to '{self.CHANNEL}' for L1 cache invalidation.")
+                try:
+                    async for message in pubsub.listen():
+                        if message.get("type") != "message":
+                            continue
+                        namespace, _, rest = str(message["data"]).partition(":")
+                        key, _, origin = rest.rpartition(":")
+                        if origin != self.origin:
+                            self._apply(namespace, key)
+                finally:
+                    await pubsub.reset()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener error, reconnecting: {e}")
+                await asyncio.sleep(1)
+
+    def start(self) -> None:
+        """Запускає фонового слухача інвалідацій."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+cache_invalidator = CacheInvalidator()
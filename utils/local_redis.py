@@ -0,0 +1,616 @@
+"""
+utils/local_redis.py
+
+In-process async stand-in for Redis (REDIS_BACKEND=local):
+- Рядки, хеші, списки, sorted sets, TTL (ліниве видалення прострочених ключів),
+  pub/sub та пайплайни з тим самим API, що й redis-py asyncio.
+- Lua: підтримується підмножина — скрипти, для яких зареєстровано Python-еквівалент
+  (register_lua_script). Вбудовано compare-and-delete для звільнення локів.
+- Усі команди виконуються без await, тож кожна з них і кожен пайплайн атомарні
+  в межах event loop — як і на справжньому однопотоковому Redis.
+
+Призначення — бенчмарки та інтеграційні перевірки cache/session/lobby-коду
+на машині без Redis-сервера. Для продакшну не використовується.
+"""
+
+import asyncio
+import fnmatch
+import hashlib
+import time
+from typing import Any, Callable, Iterable
+
+from redis.exceptions import ResponseError
+
+WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+LuaHandler = Callable[["LocalRedisServer", list[bytes], list[bytes]], Any]
+_lua_scripts: dict[str, LuaHandler] = {}
+
+
+def _normalize_script(script: str) -> str:
+    return " ".join(script.split())
+
+
+def register_lua_script(script: str, handler: LuaHandler) -> None:
+    """
+    Реєструє Python-еквівалент Lua-скрипта.
+    handler(server, keys, args) отримує ключі й аргументи як bytes.
+    """
+    _lua_scripts[_normalize_script(script)] = handler
+
+
+def _encode(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    if isinstance(value, bool):
+        raise ResponseError("Invalid input of type: 'bool'. Convert to a bytes, string, int or float first.")
+    if isinstance(value, (int, float)):
+        return repr(value).encode()
+    raise ResponseError(f"Invalid input of type: '{type(value).__name__}'.")
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_decode(item) for item in value)
+    if isinstance(value, dict):
+        return {_decode(k): _decode(v) for k, v in value.items()}
+    return value
+
+
+class LocalRedisServer:
+    """Сховище та реалізація команд (синхронно, аргументи/результати — bytes)."""
+
+    def __init__(self):
+        self._data: dict[bytes, Any] = {}
+        self._expires: dict[bytes, float] = {}
+        self._subscribers: dict[bytes, set["LocalPubSub"]] = {}
+        self._pattern_subscribers: dict[bytes, set["LocalPubSub"]] = {}
+        self._scripts_by_sha: dict[str, str] = {}
+
+    # --- Внутрішні хелпери ---
+
+    def _alive(self, key: bytes) -> bool:
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+            return False
+        return key in self._data
+
+    def _get_typed(self, key: Any, kind: type, create: bool = False) -> Any:
+        key = _encode(key)
+        if not self._alive(key):
+            if not create:
+                return None
+            self._data[key] = kind()
+        value = self._data[key]
+        if type(value) is not kind:
+            raise ResponseError(WRONGTYPE)
+        return value
+
+    def _drop_if_empty(self, key: Any) -> None:
+        key = _encode(key)
+        if key in self._data and not self._data[key]:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+
+    # --- Ключі / TTL ---
+
+    def ping(self) -> bool:
+        return True
+
+    def exists(self, *keys: Any) -> int:
+        return sum(1 for key in keys if self._alive(_encode(key)))
+
+    def delete(self, *keys: Any) -> int:
+        removed = 0
+        for key in map(_encode, keys):
+            if self._alive(key):
+                removed += 1
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return removed
+
+    def expire(self, key: Any, seconds: float) -> bool:
+        return self.pexpire(key, int(seconds * 1000))
+
+    def pexpire(self, key: Any, milliseconds: int) -> bool:
+        key = _encode(key)
+        if not self._alive(key):
+            return False
+        self._expires[key] = time.monotonic() + milliseconds / 1000
+        return True
+
+    def persist(self, key: Any) -> bool:
+        key = _encode(key)
+        return self._alive(key) and self._expires.pop(key, None) is not None
+
+    def pttl(self, key: Any) -> int:
+        key = _encode(key)
+        if not self._alive(key):
+            return -2
+        expires_at = self._expires.get(key)
+        if expires_at is None:
+            return -1
+        return max(0, int((expires_at - time.monotonic()) * 1000))
+
+    def ttl(self, key: Any) -> int:
+        ms = self.pttl(key)
+        return ms if ms < 0 else round(ms / 1000)
+
+    def keys(self, pattern: Any = "*") -> list[bytes]:
+        pattern = _encode(pattern)
+        return [key for key in list(self._data) if self._alive(key) and fnmatch.fnmatchcase(key, pattern)]
+
+    def dbsize(self) -> int:
+        return len(self.keys())
+
+    def flushdb(self) -> bool:
+        self._data.clear()
+        self._expires.clear()
+        return True
+
+    # --- Рядки ---
+
+    def get(self, key: Any) -> bytes | None:
+        return self._get_typed(key, bytes)
+
+    def mget(self, keys: Iterable[Any], *more: Any) -> list[bytes | None]:
+        keys = [keys, *more] if isinstance(keys, (str, bytes)) else [*keys, *more]
+        return [self.get(key) for key in keys]
+
+    def set(
+        self, key: Any, value: Any, ex: float | None = None, px: int | None = None,
+        nx: bool = False, xx: bool = False, keepttl: bool = False,
+    ) -> bool | None:
+        key = _encode(key)
+        exists = self._alive(key)
+        if (nx and exists) or (xx and not exists):
+            return None
+        self._data[key] = _encode(value)
+        if ex is not None:
+            self._expires[key] = time.monotonic() + ex
+        elif px is not None:
+            self._expires[key] = time.monotonic() + px / 1000
+        elif not keepttl:
+            self._expires.pop(key, None)
+        return True
+
+    def setex(self, key: Any, seconds: float, value: Any) -> bool | None:
+        return self.set(key, value, ex=seconds)
+
+    def getdel(self, key: Any) -> bytes | None:
+        value = self.get(key)
+        self.delete(key)
+        return value
+
+    def incrby(self, key: Any, amount: int = 1) -> int:
+        current = self.get(key)
+        value = int(current or 0) + amount
+        self.set(key, value, keepttl=True)
+        return value
+
+    def incr(self, key: Any, amount: int = 1) -> int:
+        return self.incrby(key, amount)
+
+    # --- Хеші ---
+
+    def hset(self, name: Any, key: Any = None, value: Any = None, mapping: dict | None = None) -> int:
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        if not items:
+            raise ResponseError("'hset' with no key value pairs")
+        hash_ = self._get_typed(name, dict, create=True)
+        added = 0
+        for field, field_value in items.items():
+            field = _encode(field)
+            added += field not in hash_
+            hash_[field] = _encode(field_value)
+        return added
+
+    def hget(self, name: Any, key: Any) -> bytes | None:
+        hash_ = self._get_typed(name, dict)
+        return hash_.get(_encode(key)) if hash_ else None
+
+    def hmget(self, name: Any, keys: Iterable[Any], *more: Any) -> list[bytes | None]:
+        keys = [keys, *more] if isinstance(keys, (str, bytes)) else [*keys, *more]
+        hash_ = self._get_typed(name, dict) or {}
+        return [hash_.get(_encode(key)) for key in keys]
+
+    def hgetall(self, name: Any) -> dict[bytes, bytes]:
+        return dict(self._get_typed(name, dict) or {})
+
+    def hdel(self, name: Any, *keys: Any) -> int:
+        hash_ = self._get_typed(name, dict)
+        if not hash_:
+            return 0
+        removed = sum(1 for key in keys if hash_.pop(_encode(key), None) is not None)
+        self._drop_if_empty(name)
+        return removed
+
+    def hexists(self, name: Any, key: Any) -> bool:
+        return _encode(key) in (self._get_typed(name, dict) or {})
+
+    def hlen(self, name: Any) -> int:
+        return len(self._get_typed(name, dict) or {})
+
+    def hkeys(self, name: Any) -> list[bytes]:
+        return list(self._get_typed(name, dict) or {})
+
+    def hincrby(self, name: Any, key: Any, amount: int = 1) -> int:
+        hash_ = self._get_typed(name, dict, create=True)
+        value = int(hash_.get(_encode(key), b"0")) + amount
+        hash_[_encode(key)] = _encode(value)
+        return value
+
+    # --- Списки ---
+
+    def rpush(self, name: Any, *values: Any) -> int:
+        list_ = self._get_typed(name, list, create=True)
+        list_.extend(_encode(value) for value in values)
+        return len(list_)
+
+    def lpush(self, name: Any, *values: Any) -> int:
+        list_ = self._get_typed(name, list, create=True)
+        for value in values:
+            list_.insert(0, _encode(value))
+        return len(list_)
+
+    @staticmethod
+    def _range(length: int, start: int, end: int) -> tuple[int, int]:
+        if start < 0:
+            start = max(length + start, 0)
+        if end < 0:
+            end = length + end
+        return start, min(end, length - 1) + 1
+
+    def lrange(self, name: Any, start: int, end: int) -> list[bytes]:
+        list_ = self._get_typed(name, list) or []
+        lo, hi = self._range(len(list_), start, end)
+        return list_[lo:hi]
+
+    def ltrim(self, name: Any, start: int, end: int) -> bool:
+        list_ = self._get_typed(name, list)
+        if list_ is None:
+            return True
+        lo, hi = self._range(len(list_), start, end)
+        list_[:] = list_[lo:hi] if lo < hi else []
+        self._drop_if_empty(name)
+        return True
+
+    def llen(self, name: Any) -> int:
+        return len(self._get_typed(name, list) or [])
+
+    def lpop(self, name: Any) -> bytes | None:
+        list_ = self._get_typed(name, list)
+        if not list_:
+            return None
+        value = list_.pop(0)
+        self._drop_if_empty(name)
+        return value
+
+    def rpop(self, name: Any) -> bytes | None:
+        list_ = self._get_typed(name, list)
+        if not list_:
+            return None
+        value = list_.pop()
+        self._drop_if_empty(name)
+        return value
+
+    # --- Sorted sets ---
+
+    def zadd(self, name: Any, mapping: dict, nx: bool = False, xx: bool = False) -> int:
+        zset = self._get_typed(name, _ZSet, create=True)
+        added = 0
+        for member, score in mapping.items():
+            member = _encode(member)
+            exists = member in zset
+            if (nx and exists) or (xx and not exists):
+                continue
+            added += not exists
+            zset[member] = float(score)
+        self._drop_if_empty(name)
+        return added
+
+    def zrem(self, name: Any, *members: Any) -> int:
+        zset = self._get_typed(name, _ZSet)
+        if not zset:
+            return 0
+        removed = sum(1 for member in members if zset.pop(_encode(member), None) is not None)
+        self._drop_if_empty(name)
+        return removed
+
+    def zscore(self, name: Any, member: Any) -> float | None:
+        return (self._get_typed(name, _ZSet) or {}).get(_encode(member))
+
+    def zcard(self, name: Any) -> int:
+        return len(self._get_typed(name, _ZSet) or {})
+
+    def zincrby(self, name: Any, amount: float, member: Any) -> float:
+        zset = self._get_typed(name, _ZSet, create=True)
+        member = _encode(member)
+        zset[member] = zset.get(member, 0.0) + amount
+        return zset[member]
+
+    def _sorted(self, name: Any, desc: bool = False) -> list[tuple[bytes, float]]:
+        zset = self._get_typed(name, _ZSet) or {}
+        return sorted(zset.items(), key=lambda item: (item[1], item[0]), reverse=desc)
+
+    def zrange(self, name: Any, start: int, end: int, desc: bool = False, withscores: bool = False) -> list:
+        items = self._sorted(name, desc)
+        lo, hi = self._range(len(items), start, end)
+        items = items[lo:hi]
+        return items if withscores else [member for member, _ in items]
+
+    @staticmethod
+    def _score_bound(bound: Any) -> tuple[float, bool]:
+        bound = _encode(bound).decode()
+        exclusive = bound.startswith("(")
+        return float(bound.lstrip("(")), exclusive
+
+    def _in_score_range(self, score: float, min_: Any, max_: Any) -> bool:
+        low, low_excl = self._score_bound(min_)
+        high, high_excl = self._score_bound(max_)
+        return (score > low if low_excl else score >= low) and (score < high if high_excl else score <= high)
+
+    def zrangebyscore(
+        self, name: Any, min: Any, max: Any, start: int | None = None, num: int | None = None,
+        withscores: bool = False,
+    ) -> list:
+        items = [item for item in self._sorted(name) if self._in_score_range(item[1], min, max)]
+        if start is not None and num is not None:
+            items = items[start:start + num] if num >= 0 else items[start:]
+        return items if withscores else [member for member, _ in items]
+
+    def zremrangebyscore(self, name: Any, min: Any, max: Any) -> int:
+        members = self.zrangebyscore(name, min, max)
+        return self.zrem(name, *members) if members else 0
+
+    # --- Pub/Sub ---
+
+    def publish(self, channel: Any, message: Any) -> int:
+        channel, message = _encode(channel), _encode(message)
+        receivers = 0
+        for pubsub in list(self._subscribers.get(channel, ())):
+            pubsub._deliver({"type": "message", "pattern": None, "channel": channel, "data": message})
+            receivers += 1
+        for pattern, subscribers in list(self._pattern_subscribers.items()):
+            if fnmatch.fnmatchcase(channel, pattern):
+                for pubsub in list(subscribers):
+                    pubsub._deliver({"type": "pmessage", "pattern": pattern, "channel": channel, "data": message})
+                    receivers += 1
+        return receivers
+
+    # --- Lua (підмножина) ---
+
+    def eval(self, script: str, numkeys: int, *keys_and_args: Any) -> Any:
+        handler = _lua_scripts.get(_normalize_script(script))
+        if handler is None:
+            raise ResponseError("Local Redis stand-in: Lua script is not registered (see register_lua_script).")
+        encoded = [_encode(item) for item in keys_and_args]
+        return handler(self, encoded[:numkeys], encoded[numkeys:])
+
+    def script_load(self, script: str) -> str:
+        sha = hashlib.sha1(script.encode("utf-8")).hexdigest()
+        self._scripts_by_sha[sha] = script
+        return sha
+
+    def evalsha(self, sha: str, numkeys: int, *keys_and_args: Any) -> Any:
+        script = self._scripts_by_sha.get(sha)
+        if script is None:
+            raise ResponseError("NOSCRIPT No matching script. Please use EVAL.")
+        return self.eval(script, numkeys, *keys_and_args)
+
+
+class _ZSet(dict):
+    """Sorted set: {member: score}."""
+
+
+_COMMANDS = (
+    "ping", "exists", "delete", "expire", "pexpire", "persist", "pttl", "ttl", "keys", "dbsize", "flushdb",
+    "get", "mget", "set", "setex", "getdel", "incr", "incrby",
+    "hset", "hget", "hmget", "hgetall", "hdel", "hexists", "hlen", "hkeys", "hincrby",
+    "rpush", "lpush", "lrange", "ltrim", "llen", "lpop", "rpop",
+    "zadd", "zrem", "zscore", "zcard", "zincrby", "zrange", "zrangebyscore", "zremrangebyscore",
+    "publish", "eval", "script_load", "evalsha",
+)
+
+
+class LocalRedis:
+    """Async-клієнт зі знайомим API redis-py поверх LocalRedisServer."""
+
+    def __init__(self, server: LocalRedisServer, decode_responses: bool = False):
+        self.server = server
+        self.decode_responses = decode_responses
+
+    def _call(self, command: str, *args: Any, **kwargs: Any) -> Any:
+        result = getattr(self.server, command)(*args, **kwargs)
+        return _decode(result) if self.decode_responses else result
+
+    def pipeline(self, transaction: bool = True) -> "LocalPipeline":
+        return LocalPipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages: bool = False) -> "LocalPubSub":
+        return LocalPubSub(self, ignore_subscribe_messages)
+
+    def register_script(self, script: str) -> "LocalScript":
+        return LocalScript(self, script)
+
+    async def scan_iter(self, match: Any = "*", count: int | None = None):
+        for key in self._call("keys", match):
+            yield key
+
+    async def aclose(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        return None
+
+
+class LocalPipeline:
+    """Пайплайн: команди накопичуються і виконуються разом (атомарно) в execute()."""
+
+    def __init__(self, client: LocalRedis):
+        self._client = client
+        self._stack: list[tuple[str, tuple, dict]] = []
+
+    async def __aenter__(self) -> "LocalPipeline":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.reset()
+
+    def __len__(self) -> int:
+        return len(self._stack)
+
+    def reset(self) -> None:
+        self._stack.clear()
+
+    async def execute(self, raise_on_error: bool = True) -> list[Any]:
+        stack, self._stack = self._stack, []
+        results = []
+        for command, args, kwargs in stack:
+            try:
+                results.append(self._client._call(command, *args, **kwargs))
+            except ResponseError as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+
+class LocalScript:
+    def __init__(self, client: LocalRedis, script: str):
+        self._client = client
+        self.script = script
+
+    async def __call__(self, keys: list | None = None, args: list | None = None) -> Any:
+        keys, args = list(keys or []), list(args or [])
+        return self._client._call("eval", self.script, len(keys), *keys, *args)
+
+
+def _make_command(command: str):
+    async def method(self: LocalRedis, *args: Any, **kwargs: Any) -> Any:
+        return self._call(command, *args, **kwargs)
+    method.__name__ = command
+    return method
+
+
+def _make_pipeline_command(command: str):
+    def method(self: LocalPipeline, *args: Any, **kwargs: Any) -> LocalPipeline:
+        self._stack.append((command, args, kwargs))
+        return self
+    method.__name__ = command
+    return method
+
+
+for _command in _COMMANDS:
+    setattr(LocalRedis, _command, _make_command(_command))
+    setattr(LocalPipeline, _command, _make_pipeline_command(_command))
+
+
+class LocalPubSub:
+    """Pub/Sub-підписка з API redis-py (subscribe, listen, get_message, reset)."""
+
+    def __init__(self, client: LocalRedis, ignore_subscribe_messages: bool = False):
+        self._client = client
+        self._server = client.server
+        self._ignore_subscribe_messages = ignore_subscribe_messages
+        self._queue: asyncio.Queue[dict] = asyncio.Queue()
+        self._channels: set[bytes] = set()
+        self._patterns: set[bytes] = set()
+
+    @property
+    def subscribed(self) -> bool:
+        return bool(self._channels or self._patterns)
+
+    def _deliver(self, message: dict) -> None:
+        self._queue.put_nowait(_decode(message) if self._client.decode_responses else message)
+
+    def _confirm(self, kind: str, name: bytes) -> None:
+        count = len(self._channels) + len(self._patterns)
+        self._deliver({"type": kind, "pattern": None, "channel": name, "data": count})
+
+    async def subscribe(self, *channels: Any) -> None:
+        for channel in map(_encode, channels):
+            self._channels.add(channel)
+            self._server._subscribers.setdefault(channel, set()).add(self)
+            self._confirm("subscribe", channel)
+
+    async def psubscribe(self, *patterns: Any) -> None:
+        for pattern in map(_encode, patterns):
+            self._patterns.add(pattern)
+            self._server._pattern_subscribers.setdefault(pattern, set()).add(self)
+            self._confirm("psubscribe", pattern)
+
+    async def unsubscribe(self, *channels: Any) -> None:
+        for channel in list(map(_encode, channels)) or list(self._channels):
+            self._channels.discard(channel)
+            self._server._subscribers.get(channel, set()).discard(self)
+            self._confirm("unsubscribe", channel)
+
+    async def punsubscribe(self, *patterns: Any) -> None:
+        for pattern in list(map(_encode, patterns)) or list(self._patterns):
+            self._patterns.discard(pattern)
+            self._server._pattern_subscribers.get(pattern, set()).discard(self)
+            self._confirm("punsubscribe", pattern)
+
+    def _skip(self, message: dict) -> bool:
+        return self._ignore_subscribe_messages and message["type"] not in ("message", "pmessage")
+
+    async def get_message(self, ignore_subscribe_messages: bool = False, timeout: float | None = 0.0) -> dict | None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                if remaining == 0.0:
+                    message = self._queue.get_nowait()
+                else:
+                    message = await asyncio.wait_for(self._queue.get(), remaining)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                return None
+            if (ignore_subscribe_messages or self._ignore_subscribe_messages) and message["type"] not in ("message", "pmessage"):
+                continue
+            return message
+
+    async def listen(self):
+        while self.subscribed or not self._queue.empty():
+            message = await self._queue.get()
+            if not self._skip(message):
+                yield message
+
+    async def reset(self) -> None:
+        for channel in self._channels:
+            self._server._subscribers.get(channel, set()).discard(self)
+        for pattern in self._patterns:
+            self._server._pattern_subscribers.get(pattern, set()).discard(self)
+        self._channels.clear()
+        self._patterns.clear()
+
+    async def aclose(self) -> None:
+        await self.reset()
+
+
+# --- Вбудовані Lua-скрипти ---
+
+def _compare_and_delete(server: LocalRedisServer, keys: list[bytes], args: list[bytes]) -> int:
+    if server.get(keys[0]) == args[0]:
+        return server.delete(keys[0])
+    return 0
+
+
+# Звільнення локу лише власником токена (utils/cache_manager та інші локи)
+COMPARE_AND_DELETE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+register_lua_script(COMPARE_AND_DELETE_SCRIPT, _compare_and_delete)
@@ -0,0 +1,294 @@
+"""
+utils/matchmaking.py
+
+Індекс відкритих лобі для матчмейкінгу (/party):
+- Кошики {(режим гри, роль, якої бракує, рангова група): {(chat_id, lobby_id)}}.
+  Лобі лежить у кошику кожної своєї вільної ролі (не більше п'яти), тож
+  update()/remove() після приєднання чи виходу — O(1), без перебору лобі.
+- Рангова група лобі — група рангу лідера (rank_band); пошук дивиться на групу
+  гравця ± PARTY_MATCH_RANK_SPREAD та на лобі з невідомим рангом.
+- Пам'ять процесу — основне джерело для пошуку; зміни дзеркаляться в Redis
+  (хеш party:match:lobbies) фоновим циклом, як у write-behind буфері.
+  start() і sync() відновлюють індекс із дзеркала (рестарт, лобі інших воркерів).
+- Закриті лобі пам'ятаються (_closed), щоб запізніле оновлення не повернуло їх в індекс.
+"""
+
+import asyncio
+import heapq
+import time
+from dataclasses import dataclass
+from itertools import product
+from typing import Any, Iterable
+
+from config import PARTY_LOBBY_STORE, PARTY_MATCH_MIRROR_FLUSH_SECONDS, PARTY_MATCH_RANK_SPREAD, logger
+from keyboards.inline_keyboards import ALL_ROLES
+from utils import codec
+from utils.local_cache import LocalCache
+from utils.redis_client import get_redis_raw
+
+LobbyRef = tuple[int, int]
+MIRROR_KEY = "party:match:lobbies"
+# Скільки пам'ятати закрите лобі (захист від запізнілих оновлень)
+CLOSED_LOBBY_MEMORY_SECONDS = 600
+
+# Рангові групи від нижчої до вищої: (назва, фрагменти тексту рангу)
+RANK_BANDS: list[tuple[str, tuple[str, ...]]] = [
+    ("Воїн–Гранд-майстер", ("воїн", "воин", "warrior", "елітн", "элит", "elite", "майстер", "мастер", "master")),
+    ("Епік", ("епік", "эпик", "epic")),
+    ("Легенда", ("легенд", "legend")),
+    ("Міфічний", ("міфіч", "мифич", "mythic")),
+    ("Міфічна честь і вище", ("чест", "honor", "honour", "слав", "glory", "безсмерт", "immortal")),
+]
+
+
+def rank_band(rank: str | None) -> int | None:
+    """Індекс рангової групи для тексту рангу (як його розпізнав vision); None — невідомо."""
+    if not rank:
+        return None
+    rank_lower = rank.lower()
+    # Від вищої групи: "Міфічна слава" містить і "міфіч", і "слав"
+    for band in range(len(RANK_BANDS) - 1, -1, -1):
+        if any(fragment in rank_lower for fragment in RANK_BANDS[band][1]):
+            return band
+    return None
+
+
+def missing_roles(lobby_data: dict[str, Any]) -> list[str]:
+    """Ролі, яких бракує лобі (та сама логіка, що й у create_lobby_keyboard)."""
+    taken = {player["role"] for player in lobby_data.get("players", {}).values()}
+    required = lobby_data.get("required_roles") or ALL_ROLES
+    return [role for role in required if role not in taken]
+
+
+@dataclass(frozen=True, slots=True)
+class MatchEntry:
+    game_mode: str
+    band: int | None
+    roles: tuple[str, ...]
+    # Лобі в публічному чаті (з username) можна пропонувати гравцям з інших чатів
+    public: bool
+    updated_at: float
+    version: int
+
+    @classmethod
+    def from_lobby(cls, lobby_data: dict[str, Any]) -> "MatchEntry":
+        leader = lobby_data.get("players", {}).get(lobby_data.get("leader_id"), {})
+        return cls(
+            game_mode=lobby_data.get("game_mode", "Ranked"),
+            band=rank_band(leader.get("rank")),
+            roles=tuple(missing_roles(lobby_data)),
+            public=bool(lobby_data.get("chat_username")),
+            updated_at=float(lobby_data.get("updated_at") or time.time()),
+            version=int(lobby_data.get("version", 0)),
+        )
+
+    def bucket_keys(self) -> list[tuple[str, str, int | None]]:
+        return [(self.game_mode, role, self.band) for role in self.roles]
+
+
+class MatchmakingIndex:
+    """Індекс відкритих лобі за (режим, вільна роль, рангова група) з дзеркалом у Redis."""
+
+    def __init__(self, mirror: bool = True, flush_interval: float = PARTY_MATCH_MIRROR_FLUSH_SECONDS):
+        self._mirror = mirror
+        self._flush_interval = flush_interval
+        self._buckets: dict[tuple[str, str, int | None], set[LobbyRef]] = {}
+        self._entries: dict[LobbyRef, MatchEntry] = {}
+        self._closed = LocalCache("matchmaking_closed", ttl=CLOSED_LOBBY_MEMORY_SECONDS)
+        # Зміни, ще не записані в дзеркало: None — лобі видалено
+        self._dirty: dict[LobbyRef, MatchEntry | None] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # --- Оновлення ---
+
+    def update(self, chat_id: int, lobby_id: int, lobby_data: dict[str, Any]) -> None:
+        """Оновлює лобі в індексі за станом, який повернуло lobby_store."""
+        ref = (chat_id, lobby_id)
+        if self._closed.get(ref):
+            return
+        entry = MatchEntry.from_lobby(lobby_data)
+        current = self._entries.get(ref)
+        if current is not None and entry.version < current.version:
+            return
+        if not entry.roles or len(lobby_data.get("players", {})) >= lobby_data.get("party_size", 5):
+            self._discard(ref)
+        else:
+            self._apply(ref, entry)
+        self._mark_dirty(ref, self._entries.get(ref))
+
+    def remove(self, chat_id: int, lobby_id: int) -> None:
+        """Прибирає закрите лобі з індексу."""
+        ref = (chat_id, lobby_id)
+        self._closed.set(ref, True)
+        self._discard(ref)
+        self._mark_dirty(ref, None)
+
+    def _apply(self, ref: LobbyRef, entry: MatchEntry) -> None:
+        current = self._entries.get(ref)
+        old_keys = set(current.bucket_keys()) if current else set()
+        new_keys = set(entry.bucket_keys())
+        for key in old_keys - new_keys:
+            self._unbucket(key, ref)
+        for key in new_keys - old_keys:
+            self._buckets.setdefault(key, set()).add(ref)
+        self._entries[ref] = entry
+
+    def _discard(self, ref: LobbyRef) -> None:
+        current = self._entries.pop(ref, None)
+        if current is not None:
+            for key in current.bucket_keys():
+                self._unbucket(key, ref)
+
+    def _unbucket(self, key: tuple[str, str, int | None], ref: LobbyRef) -> None:
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.discard(ref)
+            if not bucket:
+                del self._buckets[key]
+
+    def _mark_dirty(self, ref: LobbyRef, entry: MatchEntry | None) -> None:
+        if self._mirror:
+            self._dirty[ref] = entry
+
+    # --- Пошук ---
+
+    def suggest(
+        self,
+        chat_id: int,
+        roles: Iterable[str] | None = None,
+        band: int | None = None,
+        game_mode: str | None = None,
+        limit: int = 5,
+        spread: int = PARTY_MATCH_RANK_SPREAD,
+    ) -> list[LobbyRef]:
+        """
+        Лобі, яким бракує однієї з roles (None — будь-якої), у ранговій групі band ± spread.
+        Спершу лобі з цього ж чату, далі — найближчі за рангом, далі — найсвіжіші.
+        З інших чатів пропонуються лише лобі публічних чатів.
+        """
+        role_list = list(roles) if roles else ALL_ROLES
+        if band is None:
+            bands: list[int | None] = [*range(len(RANK_BANDS)), None]
+        else:
+            bands = [*range(max(band - spread, 0), min(band + spread, len(RANK_BANDS) - 1) + 1), None]
+        modes = [game_mode] if game_mode else {key[0] for key in self._buckets}
+
+        ranked: dict[LobbyRef, tuple[bool, int, float]] = {}
+        for key in product(modes, role_list, bands):
+            for ref in self._buckets.get(key, ()):
+                if ref in ranked:
+                    continue
+                entry = self._entries[ref]
+                foreign = ref[0] != chat_id
+                if foreign and not entry.public:
+                    continue
+                distance = abs(entry.band - band) if entry.band is not None and band is not None else spread + 1
+                ranked[ref] = (foreign, distance, -entry.updated_at)
+        return heapq.nsmallest(limit, ranked, key=ranked.__getitem__)
+
+    # --- Дзеркало в Redis ---
+
+    async def flush(self) -> int:
+        """Записує накопичені зміни в дзеркало одним пайплайном."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            batch, self._dirty = self._dirty, {}
+            try:
+                redis = await get_redis_raw()
+                async with redis.pipeline(transaction=False) as pipe:
+                    for (chat_id, lobby_id), entry in batch.items():
+                        member = f"{chat_id}:{lobby_id}"
+                        if entry is None:
+                            pipe.hdel(MIRROR_KEY, member)
+                        else:
+                            pipe.hset(MIRROR_KEY, member, codec.encode(_entry_to_record(entry)))
+                    await pipe.execute()
+            except Exception as e:
+                # Новіші зміни, що надійшли під час запису, не затираємо
+                for ref, entry in batch.items():
+                    self._dirty.setdefault(ref, entry)
+                logger.warning(f"Matchmaking: не вдалося оновити дзеркало в Redis ({len(batch)} лобі): {e}")
+                return 0
+            return len(batch)
+
+    async def sync(self) -> int:
+        """
+        Перебудовує індекс із дзеркала (разом із лобі інших воркерів).
+        Власні зміни спершу записуються, а ті, що надійшли під час читання, накладаються зверху.
+        """
+        if not self._mirror:
+            return len(self._entries)
+        await self.flush()
+        try:
+            redis = await get_redis_raw()
+            raw_entries = await redis.hgetall(MIRROR_KEY)
+        except Exception as e:
+            logger.warning(f"Matchmaking: дзеркало в Redis недоступне, індекс не синхронізовано: {e}")
+            return len(self._entries)
+
+        self._buckets.clear()
+        self._entries.clear()
+        for raw_member, raw_value in raw_entries.items():
+            try:
+                member = raw_member.decode() if isinstance(raw_member, bytes) else raw_member
+                chat_id, _, lobby_id = member.rpartition(":")
+                ref = (int(chat_id), int(lobby_id))
+                if not self._closed.get(ref):
+                    self._apply(ref, _entry_from_record(codec.decode(raw_value)))
+            except Exception as e:
+                logger.error(f"Matchmaking: пошкоджений запис дзеркала {raw_member!r}: {e}")
+        for ref, entry in self._dirty.items():
+            if entry is None:
+                self._discard(ref)
+            else:
+                self._apply(ref, entry)
+        return len(self._entries)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Matchmaking: помилка фонового запису дзеркала: {e}", exc_info=True)
+
+    async def start(self) -> None:
+        """Відновлює індекс із дзеркала та запускає фоновий запис змін."""
+        if not self._mirror or (self._task and not self._task.done()):
+            return
+        restored = await self.sync()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"✅ Matchmaking index started: {restored} open lobbies restored from Redis.")
+
+    async def stop(self) -> None:
+        """Зупиняє фоновий цикл і записує залишок змін у дзеркало."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._mirror:
+            await self.flush()
+
+    def stats(self) -> dict[str, Any]:
+        return {"lobbies": len(self._entries), "buckets": len(self._buckets), "pending_mirror": len(self._dirty)}
+
+
+def _entry_to_record(entry: MatchEntry) -> list[Any]:
+    return [entry.game_mode, entry.band, list(entry.roles), entry.public, entry.updated_at, entry.version]
+
+
+def _entry_from_record(record: list[Any]) -> MatchEntry:
+    game_mode, band, roles, public, updated_at, version = record
+    return MatchEntry(game_mode, band, tuple(roles), bool(public), float(updated_at), int(version))
+
+
+# PARTY_LOBBY_STORE=memory: лобі живуть лише в процесі, тож і дзеркало не потрібне
+matchmaking_index = MatchmakingIndex(mirror=PARTY_LOBBY_STORE != "memory")
@@ -0,0 +1,242 @@
+"""
+utils/message_coalescer.py
+
+Об'єднання редагувань одного повідомлення (лобі паті та подібні "живі" повідомлення):
+- Оновлення для (chat_id, message_id) не редагуються одразу, а чекають вікно
+  debounce; за вікно лишається лише найновіша версія стану, тож серія натискань
+  дає одне редагування замість серії.
+- Для кожного повідомлення працює щонайбільше одна задача-відправник: редагування
+  йдуть послідовно і не частіше за одне на вікно debounce.
+- Стан, старіший за вже показаний (менша version), відкидається; редагування
+  з тим самим текстом і клавіатурою пропускається без запиту до Telegram.
+- shared_versions=True: перед редагуванням версія атомарно "заявляється" в Redis
+  (msgver:{name}:{chat_id}:{message_id}), і стан, старіший за вже заявлений будь-яким
+  воркером, не надсилається. Лишається вузьке вікно: воркер зі старшою версією міг
+  заявити її раніше, а запит до Telegram відправити пізніше за інший воркер.
+- TelegramRetryAfter: чекаємо retry_after і надсилаємо найновіший стан, що
+  накопичився за цей час.
+- Виклик submit() не чекає на Telegram, тож обробник callback'а відповідає одразу.
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from config import logger
+from utils.local_cache import LocalCache
+from utils.local_redis import LocalRedisServer, register_lua_script
+from utils.redis_client import get_redis_raw
+
+MessageKey = tuple[int, int]
+# Версія фінального стану (лобі закрито): після неї повідомлення не редагується
+FINAL_VERSION = math.inf
+# FINAL_VERSION у Redis (Lua-числа не мають нескінченності)
+_SHARED_FINAL_VERSION = 2 ** 53
+VERSION_KEY_TEMPLATE = "msgver:{name}:{chat_id}:{message_id}"
+
+# Заявляє версію, якщо вона не старша за вже заявлену: 1 — можна редагувати, 0 — є новіша
+_CLAIM_VERSION_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '-1')
+if tonumber(ARGV[1]) < current then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+
+def _local_claim_version(server: LocalRedisServer, keys: list[bytes], args: list[bytes]) -> int:
+    current = server.get(keys[0])
+    if float(args[0]) < (float(current) if current is not None else -1):
+        return 0
+    server.set(keys[0], args[0], ex=int(args[1]))
+    return 1
+
+
+register_lua_script(_CLAIM_VERSION_SCRIPT, _local_claim_version)
+
+
+@dataclass
+class _PendingEdit:
+    text: str
+    reply_markup: InlineKeyboardMarkup | None
+    version: float
+
+    @property
+    def digest(self) -> str:
+        markup = self.reply_markup.model_dump_json() if self.reply_markup else ""
+        return hashlib.sha1(f"{self.text}\x00{markup}".encode("utf-8")).hexdigest()
+
+
+class MessageEditCoalescer:
+    """Debounce + coalescing редагувань повідомлень за ключем (chat_id, message_id)."""
+
+    def __init__(
+        self,
+        name: str,
+        debounce_seconds: float,
+        max_retries: int = 3,
+        sent_ttl: float = 24 * 3600,
+        parse_mode: str = ParseMode.HTML,
+        shared_versions: bool = False,
+    ):
+        self.name = name
+        self.shared_versions = shared_versions
+        self.sent_ttl = sent_ttl
+        self._claim_script: Any = None
+        self._claim_client: Any = None
+        self.debounce_seconds = debounce_seconds
+        self.max_retries = max_retries
+        self.parse_mode = parse_mode
+        self._pending: dict[MessageKey, _PendingEdit] = {}
+        self._workers: dict[MessageKey, asyncio.Task] = {}
+        # Остання показана версія та відбиток вмісту: {(chat_id, message_id): (version, digest)}
+        self._sent = LocalCache(f"{name}_sent", ttl=sent_ttl)
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.skipped = 0
+        self.retried = 0
+
+    def submit(
+        self,
+        bot: Bot,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        reply_markup: InlineKeyboardMarkup | None = None,
+        version: float | None = None,
+    ) -> None:
+        """
+        Ставить у чергу новий стан повідомлення. version — монотонна версія стану
+        (None — час надходження); FINAL_VERSION — фінальний стан, після якого
+        повідомлення більше не редагується.
+        """
+        key = (chat_id, message_id)
+        # Без явної версії — wall clock: його можна порівнювати і між воркерами
+        edit = _PendingEdit(text, reply_markup, time.time() if version is None else version)
+        self.submitted += 1
+        shown = self._sent.get(key)
+        pending = self._pending.get(key)
+        if (shown and edit.version <= shown[0]) or (pending and edit.version < pending.version):
+            self.skipped += 1
+            return
+        if pending:
+            self.coalesced += 1
+        self._pending[key] = edit
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._run(bot, key))
+
+    async def _run(self, bot: Bot, key: MessageKey) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.debounce_seconds)
+                edit = self._pending.pop(key, None)
+                if edit is None:
+                    return
+                await self._send(bot, key, edit)
+        except Exception as e:
+            logger.error(f"[{self.name}] Edit worker for {key} failed: {e}", exc_info=True)
+        finally:
+            # Між перевіркою черги вище і цим рядком немає await, тож submit() не загубиться
+            self._workers.pop(key, None)
+
+    async def _send(self, bot: Bot, key: MessageKey, edit: _PendingEdit) -> None:
+        chat_id, message_id = key
+        for attempt in range(self.max_retries + 1):
+            shown = self._sent.get(key)
+            if shown and (edit.version <= shown[0] or edit.digest == shown[1]):
+                self.skipped += 1
+                if edit.version > shown[0]:
+                    self._sent.set(key, (edit.version, shown[1]))
+                return
+            if self.shared_versions and not await self._claim_shared_version(key, edit.version):
+                # Новіший стан уже показав (або показує) інший воркер
+                self.skipped += 1
+                return
+            try:
+                await bot.edit_message_text(
+                    text=edit.text,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    reply_markup=edit.reply_markup,
+                    parse_mode=self.parse_mode,
+                )
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    logger.warning(f"[{self.name}] Giving up editing {key} after {attempt + 1} flood waits.")
+                    return
+                self.retried += 1
+                logger.info(f"[{self.name}] Flood control on {key}: retrying in {e.retry_after} s.")
+                await asyncio.sleep(e.retry_after)
+                # За час очікування міг накопичитися новіший стан — надсилаємо його
+                newer = self._pending.pop(key, None)
+                if newer is not None and newer.version >= edit.version:
+                    self.coalesced += 1
+                    edit = newer
+                continue
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    logger.warning(f"[{self.name}] Could not edit {key}: {e}")
+                    return
+            except TelegramAPIError as e:
+                logger.warning(f"[{self.name}] Could not edit {key}: {e}")
+                return
+            self.sent += 1
+            self._sent.set(key, (edit.version, edit.digest))
+            return
+
+    async def _claim_shared_version(self, key: MessageKey, version: float) -> bool:
+        """Заявляє версію в Redis; якщо Redis недоступний — лише локальний порядок."""
+        chat_id, message_id = key
+        try:
+            redis = await get_redis_raw()
+            if redis is not self._claim_client:
+                self._claim_script = redis.register_script(_CLAIM_VERSION_SCRIPT)
+                self._claim_client = redis
+            claimed = await self._claim_script(
+                keys=[VERSION_KEY_TEMPLATE.format(name=self.name, chat_id=chat_id, message_id=message_id)],
+                args=[_SHARED_FINAL_VERSION if version == FINAL_VERSION else version, int(self.sent_ttl)],
+            )
+            return bool(claimed)
+        except Exception as e:
+            logger.warning(f"[{self.name}] Could not claim version for {key} in Redis: {e}")
+            return True
+
+    def purge_expired(self) -> int:
+        return self._sent.purge_expired()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "pending": len(self._pending),
+            "workers": len(self._workers),
+            "tracked": len(self._sent),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "retried": self.retried,
+        }
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Дає відправникам дописати чергу (до timeout), решту скасовує."""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        _, still_running = await asyncio.wait(workers, timeout=timeout)
+        for task in still_running:
+            task.cancel()
+        if still_running:
+            await asyncio.gather(*still_running, return_exceptions=True)
+            logger.warning(f"[{self.name}] {len(still_running)} message edit(s) dropped on shutdown.")
+        logger.info(f"[{self.name}] Edit coalescer stats on shutdown: {self.stats()}")
+
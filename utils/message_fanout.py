@@ -0,0 +1,158 @@
+"""
+utils/message_fanout.py
+
+Розсилка одного повідомлення багатьом користувачам (особисті повідомлення учасникам паті тощо):
+- Повідомлення надсилаються паралельно (до FANOUT_CONCURRENCY запитів одночасно),
+  а не по одному в циклі, тож останній отримувач не чекає на всіх попередніх.
+- Загальний бюджет FANOUT_GLOBAL_RATE_PER_SECOND на процес: кожне надсилання
+  бронює наступний вільний слот, тож кілька одночасних розсилок ділять один ліміт.
+- У кожен чат — не частіше одного повідомлення за FANOUT_PER_CHAT_INTERVAL_SECONDS.
+- TelegramRetryAfter: бюджет ставиться на паузу на retry_after для всіх розсилок,
+  повідомлення надсилається повторно (до FANOUT_MAX_RETRIES разів).
+- dispatch() запускає розсилку у фоні й не чекає на Telegram; stop() дописує
+  незавершені розсилки при зупинці бота.
+"""
+
+import asyncio
+import time
+from typing import Any, Iterable, Literal
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+
+from config import (
+    FANOUT_CONCURRENCY,
+    FANOUT_GLOBAL_RATE_PER_SECOND,
+    FANOUT_MAX_RETRIES,
+    FANOUT_PER_CHAT_INTERVAL_SECONDS,
+    logger,
+)
+
+SendOutcome = Literal["sent", "blocked", "failed"]
+# Після скількох записів таблиця per-chat слотів чиститься від минулих
+_CHAT_SLOTS_PURGE_THRESHOLD = 1024
+
+
+class MessageFanout:
+    """Паралельна розсилка з глобальним і per-chat лімітом та повтором при flood control."""
+
+    def __init__(
+        self,
+        name: str,
+        rate_per_second: float = FANOUT_GLOBAL_RATE_PER_SECOND,
+        per_chat_interval: float = FANOUT_PER_CHAT_INTERVAL_SECONDS,
+        concurrency: int = FANOUT_CONCURRENCY,
+        max_retries: int = FANOUT_MAX_RETRIES,
+    ):
+        self.name = name
+        self._interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._per_chat_interval = per_chat_interval
+        self._max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max(concurrency, 1))
+        # Наступний вільний слот глобального бюджету та per-chat: час time.monotonic()
+        self._next_slot = 0.0
+        self._chat_slots: dict[int, float] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        self.retried = 0
+
+    def dispatch(self, bot: Bot, chat_ids: Iterable[int], text: str, label: str = "", **send_kwargs: Any) -> asyncio.Task:
+        """Запускає розсилку у фоні; повертає задачу (її можна не чекати)."""
+        task = asyncio.create_task(self.send_many(bot, chat_ids, text, label=label, **send_kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def send_many(
+        self, bot: Bot, chat_ids: Iterable[int], text: str, label: str = "", **send_kwargs: Any
+    ) -> dict[SendOutcome, int]:
+        """Надсилає text кожному чату з chat_ids (дублікати відкидаються) і повертає підсумок."""
+        recipients = list(dict.fromkeys(chat_ids))
+        outcomes = await asyncio.gather(
+            *(self._send_one(bot, chat_id, text, label, send_kwargs) for chat_id in recipients)
+        )
+        summary: dict[SendOutcome, int] = {"sent": 0, "blocked": 0, "failed": 0}
+        for outcome in outcomes:
+            summary[outcome] += 1
+        self._purge_chat_slots()
+        logger.info(
+            f"[{self.name}] {label or 'Fan-out'}: {summary['sent']}/{len(recipients)} sent, "
+            f"{summary['blocked']} blocked the bot, {summary['failed']} failed."
+        )
+        return summary
+
+    async def _send_one(self, bot: Bot, chat_id: int, text: str, label: str, send_kwargs: dict[str, Any]) -> SendOutcome:
+        for attempt in range(self._max_retries + 1):
+            await self._wait_for_slot(chat_id)
+            try:
+                async with self._semaphore:
+                    await bot.send_message(chat_id, text, **send_kwargs)
+            except TelegramRetryAfter as e:
+                if attempt == self._max_retries:
+                    logger.warning(f"[{self.name}] {label}: giving up on {chat_id} after {attempt + 1} flood waits.")
+                    break
+                self.retried += 1
+                # Flood control стосується всього бота: пауза для всіх розсилок процесу
+                self.pause(e.retry_after)
+                logger.info(f"[{self.name}] Flood control while sending to {chat_id}: pausing for {e.retry_after} s.")
+                continue
+            except TelegramForbiddenError:
+                # Користувач заблокував бота або ще не починав з ним діалог — повтор не допоможе
+                self.blocked += 1
+                logger.info(f"[{self.name}] {label}: {chat_id} cannot receive messages from the bot.")
+                return "blocked"
+            except TelegramAPIError as e:
+                logger.warning(f"[{self.name}] {label}: could not send to {chat_id}: {e}")
+                break
+            self.sent += 1
+            return "sent"
+        self.failed += 1
+        return "failed"
+
+    async def _wait_for_slot(self, chat_id: int) -> None:
+        # Бронювання слоту не містить await, тож конкурентні надсилання не отримають той самий слот
+        now = time.monotonic()
+        chat_slot = max(now, self._chat_slots.get(chat_id, 0.0))
+        self._chat_slots[chat_id] = chat_slot + self._per_chat_interval
+        if chat_slot > now:
+            await asyncio.sleep(chat_slot - now)
+
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self._interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float) -> None:
+        """Зсуває глобальний бюджет: жодне надсилання не почнеться раніше ніж через seconds."""
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+    def _purge_chat_slots(self) -> None:
+        if len(self._chat_slots) < _CHAT_SLOTS_PURGE_THRESHOLD:
+            return
+        now = time.monotonic()
+        self._chat_slots = {chat_id: slot for chat_id, slot in self._chat_slots.items() if slot > now}
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "in_flight": len(self._tasks),
+            "sent": self.sent,
+            "blocked": self.blocked,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дає фоновим розсилкам завершитися (до timeout), решту скасовує."""
+        tasks = list(self._tasks)
+        if tasks:
+            _, still_running = await asyncio.wait(tasks, timeout=timeout)
+            for task in still_running:
+                task.cancel()
+            if still_running:
+                await asyncio.gather(*still_running, return_exceptions=True)
+                logger.warning(f"[{self.name}] {len(still_running)} fan-out(s) cancelled on shutdown.")
+        logger.info(f"[{self.name}] Fan-out stats on shutdown: {self.stats()}")
@@ -2,14 +2,103 @@
 utils/redis_client.py
 
 Асинхронний менеджер з’єднань до Redis через офіційний redis-py (asyncio).
+
+Надає два клієнти:
+- get_redis()     — відповіді декодуються в str (лічильники, локи, pub/sub);
+- get_redis_raw() — відповіді повертаються як bytes (бінарні записи utils/codec).
+
+Обидва працюють поверх блокуючого пулу з обмеженим розміром: при вичерпанні пулу
+запит чекає на вільне з’єднання (до REDIS_POOL_TIMEOUT_SECONDS), а не падає.
+З’єднання перевіряються health-check'ом, мережеві помилки повторюються
+з експоненційною затримкою. redis_pipeline() — спільний хелпер для пакетних
+команд, get_redis_pool_stats() — метрики пулів (зайняті з’єднання, час очікування).
+
+REDIS_BACKEND=local підміняє обидва клієнти in-process stand-in'ом (utils/local_redis)
+зі спільним сховищем — для бенчмарків і перевірок без Redis-сервера.
 """
 import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
 
 from redis import asyncio as aioredis
-from config import REDIS_URL, logger
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+from config import (
+    REDIS_BACKEND,
+    REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT_SECONDS,
+    REDIS_RETRY_ATTEMPTS,
+    REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+    REDIS_SOCKET_TIMEOUT_SECONDS,
+    REDIS_URL,
+    logger,
+)
+from utils.local_redis import LocalRedis, LocalRedisServer
 
 _redis: aioredis.Redis | None = None
+_redis_raw: aioredis.Redis | None = None
 _lock = asyncio.Lock()
+# Спільне сховище для str- та bytes-клієнтів stand-in'а
+_local_server: LocalRedisServer | None = None
+
+
+class MeteredConnectionPool(aioredis.BlockingConnectionPool):
+    """Блокуючий пул, що рахує час очікування на з’єднання."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def get_connection(self, *args, **kwargs):
+        started = time.perf_counter()
+        connection = await super().get_connection(*args, **kwargs)
+        waited = time.perf_counter() - started
+        self.acquired += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return connection
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "max_connections": self.max_connections,
+            "in_use": len(self._in_use_connections),
+            "idle": len([c for c in self._available_connections if c is not None]),
+            "acquired": self.acquired,
+            "wait_avg_ms": round(self.wait_total / self.acquired * 1000, 3) if self.acquired else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+def _create_client(decode_responses: bool) -> aioredis.Redis:
+    if REDIS_BACKEND == "local":
+        global _local_server
+        if _local_server is None:
+            _local_server = LocalRedisServer()
+        return LocalRedis(_local_server, decode_responses=decode_responses)
+    if not REDIS_URL:
+        raise RuntimeError("REDIS_URL is not set in config.")
+    pool = MeteredConnectionPool.from_url(
+        REDIS_URL,
+        encoding="utf-8",
+        decode_responses=decode_responses,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT_SECONDS,
+        socket_timeout=REDIS_SOCKET_TIMEOUT_SECONDS,
+        socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+        retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), REDIS_RETRY_ATTEMPTS),
+        retry_on_error=[RedisConnectionError, RedisTimeoutError],
+    )
+    # Клієнт володіє пулом: aclose() закриває і його з’єднання
+    return aioredis.Redis.from_pool(pool)
+
 
 async def get_redis() -> aioredis.Redis:
     """
@@ -20,29 +109,87 @@ async def get_redis() -> aioredis.Redis:
     if _redis is None:
         async with _lock:
             if _redis is None:
-                if not REDIS_URL:
-                    raise RuntimeError("REDIS_URL is not set in config.")
                 try:
-                    # Використовуємо redis-py asyncio API
-                    _redis = aioredis.from_url(
-                        REDIS_URL, encoding="utf-8", decode_responses=True, max_connections=10
+                    _redis = _create_client(decode_responses=True)
+                    logger.info(
+                        f"✅ Redis (redis-py asyncio) client initialized "
+                        f"(pool up to {REDIS_MAX_CONNECTIONS} connections)."
                     )
-                    logger.info("✅ Redis (redis-py asyncio) client initialized.")
                 except Exception as e:
                     logger.error(f"❌ Failed to connect to Redis: {e}", exc_info=True)
                     raise
     return _redis
 
+async def get_redis_raw() -> aioredis.Redis:
+    """
+    Повертає клієнт Redis без декодування відповідей (bytes).
+    Використовується для бінарних записів, серіалізованих utils/codec.
+    """
+    global _redis_raw
+    if _redis_raw is None:
+        async with _lock:
+            if _redis_raw is None:
+                try:
+                    _redis_raw = _create_client(decode_responses=False)
+                    logger.info("✅ Redis binary client initialized.")
+                except Exception as e:
+                    logger.error(f"❌ Failed to connect to Redis: {e}", exc_info=True)
+                    raise
+    return _redis_raw
+
+
+@asynccontextmanager
+async def redis_pipeline(*, raw: bool = False, transaction: bool = False) -> AsyncIterator[Any]:
+    """
+    Пакет команд за один round-trip.
+
+    Команди додаються до pipe синхронно, результати повертає `await pipe.execute()`.
+    transaction=True обгортає пакет у MULTI/EXEC (атомарно).
+
+    Example:
+        async with redis_pipeline(raw=True) as pipe:
+            pipe.hgetall(key)
+            pipe.pttl(key)
+            fields, ttl_ms = await pipe.execute()
+    """
+    client = await (get_redis_raw() if raw else get_redis())
+    async with client.pipeline(transaction=transaction) as pipe:
+        yield pipe
+
+
+async def check_redis_health() -> bool:
+    """PING до Redis; повертає False замість винятку, якщо сервер недоступний."""
+    try:
+        redis = await get_redis()
+        return bool(await redis.ping())
+    except Exception as e:
+        logger.warning(f"Redis health check failed: {e}")
+        return False
+
+
+def get_redis_pool_stats() -> dict[str, dict[str, Any]]:
+    """Метрики пулів з’єднань: зайняті/вільні з’єднання та час очікування на з’єднання."""
+    stats = {}
+    for name, client in (("str", _redis), ("raw", _redis_raw)):
+        if client is not None and isinstance(getattr(client, "connection_pool", None), MeteredConnectionPool):
+            stats[name] = client.connection_pool.stats()
+    return stats
+
+
 async def close_redis() -> None:
     """
     Закриває з’єднання Redis при завершенні програми.
     """
-    global _redis
-    if _redis:
-        try:
-            await _redis.close()
-            logger.info("🔒 Redis connection closed.")
-        except Exception as e:
-            logger.warning(f"Error closing Redis connection: {e}", exc_info=True)
-        finally:
-            _redis = None
+    global _redis, _redis_raw
+    stats = get_redis_pool_stats()
+    if stats:
+        logger.info(f"Redis pool stats on shutdown: {stats}")
+    for client in (_redis, _redis_raw):
+        if client:
+            try:
+                await client.aclose()
+                logger.info("🔒 Redis connection closed.")
+            except Exception as e:
+                logger.warning(f"Error closing Redis connection: {e}", exc_info=True)
+    _redis = None
+    _redis_raw = None
@@ -2,28 +2,43 @@
 utils/session_memory.py
 
 Session memory layer for unregistered users:
-- Stores short-term chat history and context in Redis with TTL.
-- Falls back to an in-memory store if Redis is unavailable.
+- Stores short-term chat history in a Redis list (one codec-encoded entry per
+  message) and session metadata in a Redis hash, both with TTL.
+- append_message(s) is a single MULTI/EXEC round-trip (RPUSH + LTRIM + EXPIRE),
+  so concurrent appends for the same user never overwrite each other.
+- Legacy whole-session records (session:chat:{user_id}) are still readable;
+  the first append moves their history into the new list instead of hiding it.
+- Falls back to an in-memory store only if Redis is unavailable.
+  The fallback is a capacity-bounded LRU with per-entry TTL and a periodic
+  sweeper, so a long-running worker does not accumulate stale sessions.
 - Ensures maximum history length and automatic expiration.
 """
 
 import asyncio
-import json
-from dataclasses import dataclass, asdict
+from collections import deque
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Any
 
-from config import MAX_CHAT_HISTORY_LENGTH, logger
-from utils.redis_client import get_redis
-
-# In-memory fallback store
-_in_memory_sessions: dict[int, dict[str, Any]] = {}
-_in_memory_lock = asyncio.Lock()
+from config import (
+    MAX_CHAT_HISTORY_LENGTH,
+    SESSION_FALLBACK_MAX_ENTRIES,
+    SESSION_FALLBACK_SWEEP_INTERVAL_SECONDS,
+    logger,
+)
+from utils import codec
+from utils.local_cache import LocalCache
+from utils.redis_client import get_redis, redis_pipeline
 
 # Session settings
 SESSION_TTL: int = 3600  # 1 hour in seconds
+HISTORY_KEY_TEMPLATE: str = "session:history:{user_id}"
+META_KEY_TEMPLATE: str = "session:meta:{user_id}"
+# Legacy whole-session record (read-only, migrated/removed on the next write)
 KEY_TEMPLATE: str = "session:chat:{user_id}"
 
+_sweeper_task: asyncio.Task | None = None
+
 
 @dataclass
 class SessionData:
@@ -33,33 +48,79 @@ class SessionData:
     session_context: dict[str, Any]
 
 
+class _MemorySession:
+    """In-memory counterpart of the Redis layout: bounded list of encoded entries + metadata."""
+
+    __slots__ = ("history", "last_activity", "session_context")
+
+    def __init__(self, last_activity: str, session_context: bytes):
+        self.history: deque[bytes] = deque(maxlen=MAX_CHAT_HISTORY_LENGTH)
+        self.last_activity = last_activity
+        self.session_context = session_context
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(entry) for entry in self.history) + len(self.session_context)
+
+    def to_session(self) -> SessionData:
+        return SessionData(
+            chat_history=[codec.decode(entry) for entry in self.history],
+            last_activity=self.last_activity,
+            session_context=codec.decode(self.session_context) or {},
+        )
+
+
+# In-memory fallback store: {user_id: _MemorySession}.
+# Operations never await, so no lock is needed under asyncio.
+_fallback_sessions = LocalCache(
+    "session_fallback", max_size=SESSION_FALLBACK_MAX_ENTRIES, ttl=SESSION_TTL
+)
+
+
 async def _now_iso() -> str:
     """Return current UTC time as ISO formatted string."""
     return datetime.now(timezone.utc).isoformat()
 
 
+def _memory_append(user_id: int, entries: list[bytes], now: str) -> None:
+    record = _fallback_sessions.get(user_id)
+    if record is None:
+        record = _MemorySession(now, codec.encode({}))
+    record.history.extend(entries)
+    record.last_activity = now
+    # set() also refreshes the TTL, like EXPIRE in Redis
+    _fallback_sessions.set(user_id, record)
+
+
 async def load_session(user_id: int) -> SessionData:
     """
     Load session for given user_id.
     Attempts Redis first, falls back to in-memory store.
     """
-    key = KEY_TEMPLATE.format(user_id=user_id)
     try:
-        redis = await get_redis()
-        raw = await redis.get(key)
-        if raw:
-            data = json.loads(raw)
+        async with redis_pipeline(raw=True) as pipe:
+            pipe.lrange(HISTORY_KEY_TEMPLATE.format(user_id=user_id), 0, -1)
+            pipe.hgetall(META_KEY_TEMPLATE.format(user_id=user_id))
+            pipe.get(KEY_TEMPLATE.format(user_id=user_id))
+            entries, meta, legacy = await pipe.execute()
+        if entries or meta:
             logger.debug(f"Loaded session from Redis for user {user_id}")
-            return SessionData(**data)
+            return SessionData(
+                chat_history=[codec.decode(entry) for entry in entries],
+                last_activity=(meta.get(b"last_activity") or b"").decode() or await _now_iso(),
+                session_context=codec.decode(meta.get(b"session_context")) or {},
+            )
+        if legacy:
+            logger.debug(f"Loaded legacy session from Redis for user {user_id}")
+            return SessionData(**codec.decode(legacy))
     except Exception as e:
         logger.warning(f"Redis unavailable, using in-memory session for {user_id}: {e}", exc_info=True)
 
-    # In-memory fallback
-    async with _in_memory_lock:
-        record = _in_memory_sessions.get(user_id)
-        if record:
-            logger.debug(f"Loaded session from memory for user {user_id}")
-            return SessionData(**record)
+    # In-memory fallback (sessions saved while Redis was unavailable)
+    record = _fallback_sessions.get(user_id)
+    if record:
+        logger.debug(f"Loaded session from memory for user {user_id}")
+        return record.to_session()
 
     # No existing session: return new
     now = await _now_iso()
@@ -68,24 +129,106 @@ async def load_session(user_id: int) -> SessionData:
 
 async def save_session(user_id: int, session: SessionData) -> None:
     """
-    Save session for given user_id.
-    Persists to Redis with TTL and also updates in-memory store.
+    Save (replace) the whole session for given user_id.
+    Persists to Redis with TTL; the in-memory store is used only if Redis fails.
+    Prefer append_message(s) for adding messages: it does not rewrite the history.
     """
-    key = KEY_TEMPLATE.format(user_id=user_id)
-    payload = asdict(session)
-    raw = json.dumps(payload, ensure_ascii=False)
+    history = session.chat_history[-MAX_CHAT_HISTORY_LENGTH:]
+    entries = [codec.encode(entry) for entry in history]
+    context = codec.encode(session.session_context)
+    history_key = HISTORY_KEY_TEMPLATE.format(user_id=user_id)
+    meta_key = META_KEY_TEMPLATE.format(user_id=user_id)
     # Try Redis
     try:
-        redis = await get_redis()
-        await redis.set(key, raw, ex=SESSION_TTL)
+        async with redis_pipeline(raw=True, transaction=True) as pipe:
+            pipe.delete(history_key, KEY_TEMPLATE.format(user_id=user_id))
+            if entries:
+                pipe.rpush(history_key, *entries)
+                pipe.expire(history_key, SESSION_TTL)
+            pipe.hset(meta_key, mapping={"last_activity": session.last_activity, "session_context": context})
+            pipe.expire(meta_key, SESSION_TTL)
+            await pipe.execute()
         logger.debug(f"Saved session to Redis for user {user_id}")
+        # Redis has the fresh copy; a memory copy would only go stale
+        _fallback_sessions.delete(user_id)
+        return
     except Exception as e:
         logger.warning(f"Redis unavailable, using in-memory save for {user_id}: {e}", exc_info=True)
 
     # In-memory fallback
-    async with _in_memory_lock:
-        _in_memory_sessions[user_id] = payload
-        logger.debug(f"Saved session to memory for user {user_id}")
+    record = _MemorySession(session.last_activity, context)
+    record.history.extend(entries)
+    _fallback_sessions.set(user_id, record)
+    logger.debug(f"Saved session to memory for user {user_id}")
+
+
+async def append_messages(user_id: int, messages: list[dict[str, Any]]) -> None:
+    """
+    Atomically append messages to the user's session history in one round-trip:
+    RPUSH + LTRIM (MAX_CHAT_HISTORY_LENGTH) + EXPIRE, plus last_activity update.
+    The same transaction takes the legacy record (GETDEL); if there was one, its history
+    is prepended in a second round-trip, so only the first append after an upgrade pays for it.
+    """
+    if not messages:
+        return
+    entries = [codec.encode(message) for message in messages]
+    now = await _now_iso()
+    history_key = HISTORY_KEY_TEMPLATE.format(user_id=user_id)
+    meta_key = META_KEY_TEMPLATE.format(user_id=user_id)
+    try:
+        async with redis_pipeline(raw=True, transaction=True) as pipe:
+            pipe.getdel(KEY_TEMPLATE.format(user_id=user_id))
+            pipe.rpush(history_key, *entries)
+            pipe.ltrim(history_key, -MAX_CHAT_HISTORY_LENGTH, -1)
+            pipe.expire(history_key, SESSION_TTL)
+            pipe.hset(meta_key, "last_activity", now)
+            pipe.expire(meta_key, SESSION_TTL)
+            legacy, *_ = await pipe.execute()
+        if legacy:
+            await _migrate_legacy_session(user_id, legacy)
+        logger.debug(f"Appended {len(entries)} message(s) to Redis session of user {user_id}")
+        _fallback_sessions.delete(user_id)
+        return
+    except Exception as e:
+        logger.warning(f"Redis unavailable, appending to in-memory session for {user_id}: {e}", exc_info=True)
+
+    _memory_append(user_id, entries, now)
+
+
+async def _migrate_legacy_session(user_id: int, legacy: bytes) -> None:
+    """
+    Move a legacy session record (already removed by GETDEL) in front of the new list.
+    LPUSH keeps it older than any message appended concurrently.
+    """
+    try:
+        session = SessionData(**codec.decode(legacy))
+    except Exception as e:
+        logger.error(f"Corrupted legacy session of user {user_id} dropped: {e}")
+        return
+    entries = [codec.encode(entry) for entry in session.chat_history[-MAX_CHAT_HISTORY_LENGTH:]]
+    history_key = HISTORY_KEY_TEMPLATE.format(user_id=user_id)
+    meta_key = META_KEY_TEMPLATE.format(user_id=user_id)
+    try:
+        async with redis_pipeline(raw=True, transaction=True) as pipe:
+            if entries:
+                pipe.lpush(history_key, *reversed(entries))
+                pipe.ltrim(history_key, -MAX_CHAT_HISTORY_LENGTH, -1)
+                pipe.expire(history_key, SESSION_TTL)
+            if session.session_context:
+                pipe.hset(meta_key, "session_context", codec.encode(session.session_context))
+                pipe.expire(meta_key, SESSION_TTL)
+            await pipe.execute()
+        logger.debug(f"Migrated legacy session of user {user_id} ({len(entries)} message(s))")
+    except Exception as e:
+        logger.warning(f"Could not migrate legacy session of user {user_id}: {e}", exc_info=True)
+
+
+async def append_message(user_id: int, role: str, content: Any) -> None:
+    """
+    Append a message to the user's session history,
+    enforce MAX_CHAT_HISTORY_LENGTH and update last_activity.
+    """
+    await append_messages(user_id, [{"role": role, "content": content}])
 
 
 async def clear_session(user_id: int) -> None:
@@ -93,32 +236,53 @@ async def clear_session(user_id: int) -> None:
     Clear session data for given user_id.
     Removes from Redis and in-memory store.
     """
-    key = KEY_TEMPLATE.format(user_id=user_id)
     try:
         redis = await get_redis()
-        await redis.delete(key)
+        await redis.delete(
+            HISTORY_KEY_TEMPLATE.format(user_id=user_id),
+            META_KEY_TEMPLATE.format(user_id=user_id),
+            KEY_TEMPLATE.format(user_id=user_id),
+        )
         logger.debug(f"Deleted session from Redis for user {user_id}")
     except Exception:
         logger.debug(f"No Redis session to delete for {user_id}")
 
-    async with _in_memory_lock:
-        if user_id in _in_memory_sessions:
-            del _in_memory_sessions[user_id]
-            logger.debug(f"Deleted session from memory for user {user_id}")
+    _fallback_sessions.delete(user_id)
+    logger.debug(f"Deleted session from memory for user {user_id}")
 
 
-async def append_message(user_id: int, role: str, content: Any) -> None:
-    """
-    Append a message to the user's session history,
-    enforce MAX_CHAT_HISTORY_LENGTH and update last_activity.
-    """
-    session = await load_session(user_id)
-    entry = {"role": role, "content": content}
-    session.chat_history.append(entry)
-    # Trim history if exceeding maximum
-    if len(session.chat_history) > MAX_CHAT_HISTORY_LENGTH:
-        session.chat_history = session.chat_history[-MAX_CHAT_HISTORY_LENGTH:]
-
-    # Update timestamp
-    session.last_activity = await _now_iso()
-    await save_session(user_id, session)
+def get_fallback_memory_stats() -> dict[str, Any]:
+    """Report size and approximate payload memory of the in-memory fallback store."""
+    stats = _fallback_sessions.stats()
+    stats["payload_bytes"] = sum(record.nbytes for record in _fallback_sessions.values())
+    return stats
+
+
+async def _sweep_fallback_sessions() -> None:
+    while True:
+        await asyncio.sleep(SESSION_FALLBACK_SWEEP_INTERVAL_SECONDS)
+        purged = _fallback_sessions.purge_expired()
+        stats = get_fallback_memory_stats()
+        log = logger.info if purged else logger.debug
+        log(
+            f"Session fallback sweep: purged {purged}, "
+            f"{stats['size']}/{stats['max_size']} entries, ~{stats['payload_bytes']} bytes."
+        )
+
+
+def start_session_sweeper() -> None:
+    """Start the background sweeper of expired in-memory sessions."""
+    global _sweeper_task
+    if _sweeper_task is None or _sweeper_task.done():
+        _sweeper_task = asyncio.create_task(_sweep_fallback_sessions())
+
+
+async def stop_session_sweeper() -> None:
+    global _sweeper_task
+    if _sweeper_task:
+        _sweeper_task.cancel()
+        try:
+            await _sweeper_task
+        except asyncio.CancelledError:
+            pass
+        _sweeper_task = None
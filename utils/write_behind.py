@@ -0,0 +1,222 @@
+"""
+utils/write_behind.py
+
+Write-behind buffer for hot, frequently rewritten user records:
+- mark_dirty() лише запам'ятовує останню версію запису (коалесценція по user_id)
+  та дублює її в Redis-журнал (HASH, записи utils/codec) для захисту від падіння процесу.
+  Журнал у кожного воркера свій (WRITE_BEHIND_WORKER_ID): чужі записи не перезаписуються,
+  не видаляються і не відтворюються при старті іншого воркера.
+  Для append-only даних (повідомлення чату) передається merge: нові значення
+  дописуються до ще не збережених, а не заміщують їх.
+- Фоновий цикл скидає накопичені записи в БД одним пакетом за інтервалом
+  або одразу при досягненні порогу розміру.
+- recover() при старті дочитує незбережені записи зі свого журналу (flush_func має бути
+  ідемпотентним: запис міг потрапити в БД перед падінням, до очищення журналу),
+  stop() виконує фінальний flush при завершенні роботи.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from config import (
+    WRITE_BEHIND_FLUSH_INTERVAL_SECONDS,
+    WRITE_BEHIND_MAX_BATCH_SIZE,
+    WRITE_BEHIND_WORKER_ID,
+    logger,
+)
+from database.crud import bulk_insert_chat_messages
+from utils import codec
+from utils.redis_client import get_redis_raw
+
+FlushFunc = Callable[[dict[int, Any]], Awaitable[bool]]
+MergeFunc = Callable[[Any, Any], Any]
+
+
+def append_lists(older: list, newer: list) -> list:
+    """merge для append-only буферів: зберігає порядок надходження."""
+    return [*older, *newer]
+
+
+class WriteBehindBuffer:
+    """
+    Буфер відкладеного запису: {user_id: останнє значення} → пакетний запис у БД.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_func: FlushFunc,
+        flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL_SECONDS,
+        max_batch_size: int = WRITE_BEHIND_MAX_BATCH_SIZE,
+        merge: MergeFunc | None = None,
+    ):
+        self.name = name
+        self.journal_key = f"journal:write_behind:{name}:{WRITE_BEHIND_WORKER_ID}"
+        self._flush_func = flush_func
+        self._flush_interval = flush_interval
+        self._max_batch_size = max_batch_size
+        # None — новіше значення заміщує старе; інакше merge(старе, нове)
+        self._merge = merge
+        self._dirty: dict[int, Any] = {}
+        # Пакет, який саме зараз записується в БД
+        self._flushing: dict[int, Any] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        # Позачергові записи з mark_dirty (буфер переповнений)
+        self._flush_tasks: set[asyncio.Task] = set()
+        # Лічильники для моніторингу
+        self.records_marked = 0
+        self.records_flushed = 0
+        self.flush_count = 0
+
+    @property
+    def pending(self) -> int:
+        """Кількість записів, що очікують на запис у БД."""
+        return len(self._dirty)
+
+    def _combine(self, older: Any, newer: Any) -> Any:
+        return newer if self._merge is None else self._merge(older, newer)
+
+    def get_pending(self, user_id: int) -> Any | None:
+        """Повертає ще не записане в БД значення для user_id (якщо є)."""
+        if user_id in self._dirty and user_id in self._flushing:
+            return self._combine(self._flushing[user_id], self._dirty[user_id])
+        if user_id in self._dirty:
+            return self._dirty[user_id]
+        return self._flushing.get(user_id)
+
+    async def mark_dirty(self, user_id: int, value: Any) -> None:
+        """
+        Позначає запис користувача як змінений.
+        Попереднє незбережене значення для цього user_id замінюється новим
+        (або об'єднується з ним через merge).
+        """
+        if user_id in self._dirty:
+            value = self._combine(self._dirty[user_id], value)
+        self._dirty[user_id] = value
+        self.records_marked += 1
+
+        try:
+            redis = await get_redis_raw()
+            await redis.hset(self.journal_key, str(user_id), codec.encode(value))
+        except Exception as e:
+            logger.warning(f"Write-behind[{self.name}]: не вдалося записати журнал для {user_id}: {e}")
+
+        if len(self._dirty) >= self._max_batch_size:
+            task = asyncio.create_task(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self) -> int:
+        """
+        Записує всі накопичені записи в БД одним пакетом.
+
+        Returns:
+            Кількість успішно записаних записів.
+        """
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            batch, self._dirty = self._dirty, {}
+            self._flushing = batch
+            try:
+                flushed = await self._flush_func(batch)
+            finally:
+                self._flushing = {}
+            if not flushed:
+                # Повертаємо невдалий пакет у буфер, не затираючи новіші значення
+                remerged = {}
+                for user_id, value in batch.items():
+                    if user_id in self._dirty:
+                        if self._merge is not None:
+                            self._dirty[user_id] = remerged[user_id] = self._merge(value, self._dirty[user_id])
+                    else:
+                        self._dirty[user_id] = value
+                if remerged:
+                    # У журналі для цих user_id лише новіші значення — записуємо об'єднані
+                    try:
+                        redis = await get_redis_raw()
+                        await redis.hset(
+                            self.journal_key,
+                            mapping={str(user_id): codec.encode(value) for user_id, value in remerged.items()},
+                        )
+                    except Exception as e:
+                        logger.warning(f"Write-behind[{self.name}]: не вдалося оновити журнал: {e}")
+                logger.error(f"Write-behind[{self.name}]: пакет з {len(batch)} записів не збережено, повтор пізніше.")
+                return 0
+
+            self.records_flushed += len(batch)
+            self.flush_count += 1
+
+            # З журналу прибираємо лише ті записи, що не змінилися під час запису
+            flushed_ids = [str(user_id) for user_id in batch if user_id not in self._dirty]
+            if flushed_ids:
+                try:
+                    redis = await get_redis_raw()
+                    await redis.hdel(self.journal_key, *flushed_ids)
+                except Exception as e:
+                    logger.warning(f"Write-behind[{self.name}]: не вдалося очистити журнал: {e}")
+
+            logger.debug(f"Write-behind[{self.name}]: збережено пакет з {len(batch)} записів.")
+            return len(batch)
+
+    async def recover(self) -> int:
+        """
+        Відновлює незбережені записи з Redis-журналу (після падіння процесу)
+        та одразу скидає їх у БД.
+        """
+        try:
+            redis = await get_redis_raw()
+            journal = await redis.hgetall(self.journal_key)
+        except Exception as e:
+            logger.warning(f"Write-behind[{self.name}]: журнал недоступний, відновлення пропущено: {e}")
+            return 0
+
+        for raw_user_id, raw_value in journal.items():
+            try:
+                self._dirty.setdefault(int(raw_user_id), codec.decode(raw_value))
+            except Exception as e:
+                logger.error(f"Write-behind[{self.name}]: пошкоджений запис журналу для {raw_user_id}: {e}")
+
+        if journal:
+            logger.info(f"Write-behind[{self.name}]: відновлено {len(journal)} записів з журналу.")
+        return await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind[{self.name}]: помилка фонового запису: {e}", exc_info=True)
+
+    async def start(self) -> None:
+        """Відновлює журнал і запускає фоновий цикл запису."""
+        if self._task and not self._task.done():
+            return
+        await self.recover()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"✅ Write-behind[{self.name}] запущено "
+            f"(інтервал {self._flush_interval} с, пакет до {self._max_batch_size})."
+        )
+
+    async def stop(self) -> None:
+        """Зупиняє фоновий цикл, чекає позачергові записи та скидає залишок буфера в БД."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        flushed = await self.flush()
+        logger.info(f"Write-behind[{self.name}] зупинено, фінальний запис: {flushed} записів.")
+
+
+# Буфер нових повідомлень чату зареєстрованих користувачів (append-only таблиця chat_messages).
+# Журнал має нову назву: записи старого журналу "chat_history" містили цілі історії, а не дописи.
+chat_history_writer = WriteBehindBuffer("chat_messages", bulk_insert_chat_messages, merge=append_lists)